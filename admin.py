@@ -0,0 +1,25 @@
+"""
+This module contains handlers for the application's administrators, served 
+behind an admin login.
+"""
+import json
+
+import webapp2
+
+from instrumentation import stats
+
+
+class Stats(webapp2.RequestHandler):
+    def get(self):
+        """Report the latency, RPC and entity size statistics of this instance"""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(stats.to_dict(), sort_keys=True))
+        
+    def delete(self):
+        """Reset the statistics of this instance"""
+        stats.reset()
+        
+
+app = webapp2.WSGIApplication([
+    ('/admin/stats', Stats),
+], debug=True)
@@ -12,6 +12,7 @@ MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
 #define the name of the overall application api
 memory_api = endpoints.api(name='memory', version='v1.0')
 
-#import user and game api modules
+#import user, game and tournament api modules
 import users
 import games
+import tournaments
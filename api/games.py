@@ -10,21 +10,46 @@ Game logic and persistence is manipulated in the games service module.
 
 import endpoints
 from protorpc import remote, messages
+from google.appengine.ext import ndb
 
 from api import memory_api
+from instrumentation import instrumented
 
-from forms import NewGameForm, GameForm, GameForms, MakeMoveForm, StringMessage, ScoreForms
+from forms import NewGameForm, GameForm, GameForms, MakeMoveForm, MakeTurnForm, StringMessage, ScoreForms, GameBoardForm, TurnForms
 
 from services import games, users, scores 
 
-USER_REQUEST = endpoints.ResourceContainer(name=messages.StringField(1),
-                                           email=messages.StringField(2))
+USER_PAGE_REQUEST = endpoints.ResourceContainer(name=messages.StringField(1),
+                                                page_size=messages.IntegerField(2),
+                                                cursor=messages.StringField(3))
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
         urlsafe_game_key=messages.StringField(1),)
+GET_GAME_VERSION_REQUEST = endpoints.ResourceContainer(
+        urlsafe_game_key=messages.StringField(1),
+        version=messages.IntegerField(2, variant=messages.Variant.INT32),)
+WAIT_FOR_TURN_REQUEST = endpoints.ResourceContainer(
+        urlsafe_game_key=messages.StringField(1),
+        name=messages.StringField(2),
+        version=messages.IntegerField(3, variant=messages.Variant.INT32),
+        timeout=messages.IntegerField(4, variant=messages.Variant.INT32),)
+GET_GAMES_REQUEST = endpoints.ResourceContainer(
+        urlsafe_game_keys=messages.StringField(1, repeated=True),)
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1),)
+MAKE_TURN_REQUEST = endpoints.ResourceContainer(
+    MakeTurnForm,
+    urlsafe_game_key=messages.StringField(1),)
+
+#The largest page of a user's games or scores that can be requested
+MAX_PAGE_SIZE = 100
+#The most games that can be requested by key at once
+MAX_BATCH_GAMES = 100
+#The longest a user can wait for their turn in one request, in seconds
+MAX_WAIT_SECONDS = 30
+#The number of times a move is retried when it contends with another move on the same game
+MAKE_MOVE_RETRIES = 5
 
 
 @memory_api.api_class(resource_name='games', path='games')
@@ -37,6 +62,7 @@ class GameApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrumented
     def new_game(self, request):
         """Creates a new game of memory for two users"""
         first_user = users.get_by_name(request.first_user)
@@ -48,80 +74,193 @@ class GameApi(remote.Service):
             raise endpoints.BadRequestException(
                     'Please select two different users to play this game!')
 
-        game = games.new_game(first_user.key, second_user.key)
+        game = games.new_game(first_user.key, second_user.key, first_user.name, second_user.name,
+                              **self._board_size(request))
 
         return games.to_form(game, 'Good luck playing Memory, it\'s {0}\'s turn first!'.format(first_user.name))
 
-    @endpoints.method(request_message=GET_GAME_REQUEST,
+    @endpoints.method(request_message=GET_GAME_VERSION_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrumented
     def get_game(self, request):
-        """Return the current game state."""
+        """Return the current game state. A client polling with the version of the 
+        game it already has is told the game is unchanged, without the game being read"""
+        if request.version is not None and games.is_unchanged(request.urlsafe_game_key, request.version):
+            return GameForm(urlsafe_key=request.urlsafe_game_key, version=request.version,
+                            unchanged=True, message='Game unchanged')
         game = games.get_by_urlsafe(request.urlsafe_game_key)
         if game:
             return games.to_form(game, 'Time to make a move!')
         else:
             raise endpoints.NotFoundException('Game not found!')
  
+    @endpoints.method(request_message=WAIT_FOR_TURN_REQUEST,
+                      response_message=GameForm,
+                      path='game/{urlsafe_game_key}/wait',
+                      name='wait_for_turn',
+                      http_method='GET')
+    @instrumented
+    def wait_for_turn(self, request):
+        """Wait for the other user to move. Returns the game once it changes from the
+        version given, by default its version when the wait began, or straight away if 
+        it is already the user's turn. After the timeout the game is returned unchanged"""
+        if request.timeout is not None and not 0 < request.timeout <= MAX_WAIT_SECONDS:
+            raise endpoints.BadRequestException(
+                    'Timeout must be between 1 and {0} seconds'.format(MAX_WAIT_SECONDS))
+        if not request.name:
+            raise endpoints.BadRequestException('A User name is required!')
+        game = games.get_by_urlsafe(request.urlsafe_game_key)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        user_key = users.key_for_name(request.name)
+        if user_key not in (game.first_user, game.second_user):
+            raise endpoints.BadRequestException('You are not playing this game!')
+        
+        version = game.version if request.version is None else request.version
+        if not game.game_over and game.next_move != user_key:
+            game = games.wait_for_change(game, request.timeout, version)
+            if not game:
+                raise endpoints.NotFoundException('Game not found!')
+        
+        if game.game_over:
+            form = games.to_form(game, 'Game over')
+        elif game.next_move == user_key:
+            form = games.to_form(game, 'It\'s your turn!')
+        else:
+            form = games.to_form(game, 'Still waiting for the other user')
+        if game.version == version:
+            form.unchanged = True
+        return form
+    
+    @endpoints.method(request_message=GET_GAMES_REQUEST,
+                      response_message=GameForms,
+                      path='games',
+                      name='get_games',
+                      http_method='GET')
+    @instrumented
+    def get_games(self, request):
+        """Return the current state of a batch of games, read together. The keys
+        of any games not found are listed in not_found"""
+        if len(request.urlsafe_game_keys) > MAX_BATCH_GAMES:
+            raise endpoints.BadRequestException(
+                    'At most {0} games can be requested at once'.format(MAX_BATCH_GAMES))
+        found = games.get_multi_by_urlsafe(request.urlsafe_game_keys)
+        forms = games.to_forms([game for game in found if game], 'Time to make a move!')
+        forms.not_found = [urlsafe for urlsafe, game in zip(request.urlsafe_game_keys, found) if not game]
+        return forms
+ 
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @instrumented
     def make_move(self, request):
         """Makes a move on the grid board. Returns a game state with message"""
-        game = games.get_by_urlsafe(request.urlsafe_game_key)
+        return self._make_move_async(request, (request.row, request.column)).get_result()
+    
+    @endpoints.method(request_message=MAKE_TURN_REQUEST,
+                      response_message=GameForm,
+                      path='game/{urlsafe_game_key}/turn',
+                      name='make_turn',
+                      http_method='PUT')
+    @instrumented
+    def make_turn(self, request):
+        """Makes both guesses of a turn on the grid board, saving the game once. 
+        Returns a game state with the message of the second guess"""
+        return self._make_move_async(request, (request.first_row, request.first_column),
+                                     (request.second_row, request.second_column)).get_result()
+    
+    @ndb.tasklet
+    def _make_move_async(self, request, *guesses):
+        """Tasklet making a move, or both guesses of a turn, on the grid board. The 
+        move is made in a transaction, and a draw cancels the game, unless it is a
+        tournament game, or the other user is notified of their turn once the 
+        transaction has committed"""
+        user_key = users.key_for_name(request.name)
+        game, message = yield self._make_move_transaction_async(request.urlsafe_game_key, user_key, *guesses)
+        
+        if game.game_over and not game.winner and not game.tournament: #we had a draw, cancel the game
+            games.delete(game)
+            raise endpoints.NotFoundException('You had a draw, begin again!')
+        
+        #notify the other user once the move is committed, while the form is built
+        if games.turn_passed(game, user_key):
+            notified = games.notify_turn_async(game)
+            form = games.to_form(game, message)
+            yield notified
+            raise ndb.Return(form)
+        raise ndb.Return(games.to_form(game, message))
+    
+    @ndb.transactional_tasklet(xg=True, retries=MAKE_MOVE_RETRIES)
+    def _make_move_transaction_async(self, urlsafe_game_key, user_key, *guesses):
+        """Transaction reading the game, making the move or turn and, when the game ends, 
+        updating the winner, loser and scoreboard. Everything the move changes is
+        committed in one batch, and the transaction is retried if another move on
+        the same game commits first. Returns the game and the move's message"""
+        game = yield games.get_by_urlsafe_async(urlsafe_game_key)
         if not game:
             raise endpoints.NotFoundException('Game not found')
         if game.game_over:
             raise endpoints.BadRequestException('Game already over')
  
-        user = users.get_by_name(request.name)
-        if user.key != game.next_move:
+        if user_key != game.next_move:
             raise endpoints.BadRequestException('It\'s not your turn!')
+        first_user = (user_key == game.first_user)
          
-        # Ask the games service to verify move is valid, exception raised if not
-        games.is_valid_move(game, request.row, request.column)
-        
-        # Make the move on the gridboard, change turn of user if necessary
-        message = games.make_move(game, request.row, request.column, (user.key == game.first_user))
+        # Ask the games service to verify the move is valid, exception raised if not,
+        # then make the move on the gridboard, changing the turn of user if necessary
+        if len(guesses) == 2:
+            games.is_valid_turn(game, *guesses)
+            message, related = games.apply_turn(game, guesses[0], guesses[1], first_user)
+        else:
+            (row, column), = guesses
+            games.is_valid_move(game, row, column)
+            message, related = games.apply_move(game, row, column, first_user)
          
         #if the game is over, assign a winner and loser, add score to the scoreboard 
-        if game.game_over:
-            if game.winner:
-                users.add_win(game.winner.get())
-                users.add_loss(game.loser.get())
-                scores.new_score(game.winner, game.loser, game.first_user_score, game.second_user_score)
-            else: #we had a draw, cancel the game
-                games.delete(game)
-                raise endpoints.NotFoundException('You had a draw, begin again!')
-              
-        return games.to_form(game, message)
+        if game.game_over and game.winner:
+            winner, loser = yield (users.get_by_key_async(game.winner), 
+                                   users.get_by_key_async(game.loser))
+            related += [users.record_win(winner), 
+                        users.record_loss(loser),
+                        scores.build_score(game.winner, game.loser, 
+                                           game.first_user_score, game.second_user_score,
+                                           game.user_name(game.winner), game.user_name(game.loser))]
+        
+        yield games.save_async(game, *related)
+        games.advance_tournament(game)
+        raise ndb.Return((game, message))
     
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=GameForms,
                       path='user/games',
                       name='get_user_games',
                       http_method='GET')
+    @instrumented
     def get_user_games(self, request):
-        """Return all User's active games"""
+        """Return a page of a User's active games"""
         user =  users.get_by_name(request.name)
         if not user:
             raise endpoints.BadRequestException('User not found!')
-        user_games = games.get_user_games(user)
-        return GameForms(items=[games.to_form(game) for game in user_games])
+        user_games, next_cursor = games.get_user_games(user, self._page_size(request), request.cursor)
+        return games.to_forms(user_games, next_cursor=next_cursor)
     
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='DELETE')
+    @instrumented
     def cancel_game(self, request):
-        """Cancel a game. Game must not have ended to be canceled"""
+        """Cancel a game. Game must not have ended, or be part of a tournament, to be canceled"""
         game = games.get_by_urlsafe(request.urlsafe_game_key)
-        if game and not game.game_over:
+        if game and game.tournament:
+            raise endpoints.BadRequestException('Tournament games can\'t be canceled!')
+        elif game and not game.game_over:
             games.delete(game)
             return StringMessage(message='Game canceled with key: {}.'.
                                  format(request.urlsafe_game_key))
@@ -131,29 +270,72 @@ class GameApi(remote.Service):
             raise endpoints.NotFoundException('Game not found!')
 
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{name}',
                       name='get_user_scores',
                       http_method='GET')
+    @instrumented
     def get_user_scores(self, request):
-        """Returns all of an individual User's scores"""
+        """Returns a page of an individual User's scores"""
         user =  users.get_by_name(request.name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-        user_scores = scores.get_user_scores(user)
-        return ScoreForms(items=[scores.to_form(score) for score in user_scores])
+        user_scores, next_cursor = scores.get_user_scores(user, self._page_size(request), request.cursor)
+        return scores.to_forms(user_scores, next_cursor)
     
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/{urlsafe_game_key}/history',
                       name='get_game_history',
                       http_method='GET')
+    @instrumented
     def get_game_history(self, request):
         """Return a Game's move history"""
         game = games.get_by_urlsafe(request.urlsafe_game_key)
         if not game:
             raise endpoints.NotFoundException('Game not found')
-        return StringMessage(message=str(game.history))
-        
\ No newline at end of file
+        return StringMessage(message=str(games.get_history(game)))
+    
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=GameBoardForm,
+                      path='game/{urlsafe_game_key}/board',
+                      name='get_game_board',
+                      http_method='GET')
+    @instrumented
+    def get_game_board(self, request):
+        """Return the current game state with the board as a list of cell codes"""
+        game = games.get_by_urlsafe(request.urlsafe_game_key)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        return games.to_board_form(game, 'Time to make a move!')
+    
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=TurnForms,
+                      path='game/{urlsafe_game_key}/turns',
+                      name='get_game_turns',
+                      http_method='GET')
+    @instrumented
+    def get_game_turns(self, request):
+        """Return a Game's move history as a list of turns"""
+        game = games.get_by_urlsafe(request.urlsafe_game_key)
+        if not game:
+            raise endpoints.NotFoundException('Game not found')
+        return games.to_turn_forms(games.get_history(game))
+            
+    def _page_size(self, request):
+        """Returns the page size requested, or None for the service's default page
+        size. Raises an error if it is out of range"""
+        if request.page_size is None:
+            return None
+        if not 0 < request.page_size <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                    'Page size must be between 1 and {0}'.format(MAX_PAGE_SIZE))
+        return request.page_size
+    
+    def _board_size(self, request):
+        """Returns the board dimensions and card set size requested for a new game, 
+        leaving out any not given so the service defaults are used"""
+        return dict((name, getattr(request, name)) for name in ('rows', 'columns', 'card_set_size')
+                    if getattr(request, name) is not None)
@@ -0,0 +1,58 @@
+'''
+Created on 18/10/2026
+
+Tournament api concerned primarily with communicating to/from the api's users. Contains
+api endpoints to create and find a tournament of memory games.
+Tournament scheduling and persistence is manipulated in the tournament service module.
+
+@author: thurstonemerson
+'''
+
+import endpoints
+from protorpc import remote, messages
+
+from api import memory_api
+from instrumentation import instrumented
+
+from forms import NewTournamentForm, TournamentForm
+
+from services import tournaments, users
+
+NEW_TOURNAMENT_REQUEST = endpoints.ResourceContainer(NewTournamentForm)
+GET_TOURNAMENT_REQUEST = endpoints.ResourceContainer(
+        urlsafe_tournament_key=messages.StringField(1),)
+
+
+@memory_api.api_class(resource_name='tournaments', path='tournaments')
+class TournamentApi(remote.Service):
+    """Memory game API for requesting creation of and finding a tournament"""
+
+    @endpoints.method(request_message=NEW_TOURNAMENT_REQUEST,
+                      response_message=TournamentForm,
+                      path='tournament',
+                      name='new_tournament',
+                      http_method='POST')
+    @instrumented
+    def new_tournament(self, request):
+        """Creates a tournament between the named users, listed in seeded order, and
+        schedules its first round of games. Later rounds are scheduled as games finish"""
+        if not all(request.players):
+            raise endpoints.BadRequestException('A User name is required for every player!')
+        board = dict((name, getattr(request, name)) for name in ('rows', 'columns', 'card_set_size')
+                     if getattr(request, name) is not None)
+        tournament = tournaments.new_tournament(request.name, [users.key_for_name(name) for name in request.players],
+                                                request.format, **board)
+        return tournaments.to_form(tournament)
+
+    @endpoints.method(request_message=GET_TOURNAMENT_REQUEST,
+                      response_message=TournamentForm,
+                      path='tournament/{urlsafe_tournament_key}',
+                      name='get_tournament',
+                      http_method='GET')
+    @instrumented
+    def get_tournament(self, request):
+        """Return the current state of a tournament, with the games of its current round"""
+        tournament = tournaments.get_by_urlsafe(request.urlsafe_tournament_key)
+        if not tournament:
+            raise endpoints.NotFoundException('Tournament not found!')
+        return tournaments.to_form(tournament)
@@ -15,8 +15,17 @@ from forms import StringMessage, UserForms
 from services import users 
 
 from api import memory_api
+from instrumentation import instrumented
 USER_REQUEST = endpoints.ResourceContainer(name=messages.StringField(1),
                                            email=messages.StringField(2))
+RANKINGS_REQUEST = endpoints.ResourceContainer(limit=messages.IntegerField(1),
+                                               offset=messages.IntegerField(2))
+
+#The largest page of rankings that can be requested
+MAX_PAGE_SIZE = 100
+#The deepest a page of rankings can start, as pages past the rankings kept in memcache
+#are read with an offset query, which reads every user skipped
+MAX_RANKINGS_OFFSET = 1000
 
 @memory_api.api_class(resource_name='users', path='users')
 class UserApi(remote.Service):
@@ -27,23 +36,32 @@ class UserApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrumented
     def create_user(self, request):
         """Create a User. Requires a unique username"""
-        if users.get_by_name(request.name):
+        if not request.name:
+            raise endpoints.BadRequestException('A User name is required!')
+        
+        if not users.create(request):
             raise endpoints.ConflictException(
                     'A User with that name already exists!')
             
-        users.create(request)    
-            
         return StringMessage(message='User {} created!'.format(
                 request.name))
         
-    @endpoints.method(response_message=UserForms,
+    @endpoints.method(request_message=RANKINGS_REQUEST,
+                      response_message=UserForms,
                       path='user/ranking',
                       name='get_user_rankings',
                       http_method='GET')
+    @instrumented
     def get_user_rankings(self, request):
-        """Return all Users ranked by their win percentage"""
-        user_rankings = users.get_user_rankings() 
+        """Return a page of Users ranked by their win percentage"""
+        limit, offset = request.limit, request.offset or 0
+        if (limit is not None and not 0 < limit <= MAX_PAGE_SIZE) or not 0 <= offset <= MAX_RANKINGS_OFFSET:
+            raise endpoints.BadRequestException(
+                    'Rankings can be requested {0} at a time, starting within the top {1}'.format(
+                            MAX_PAGE_SIZE, MAX_RANKINGS_OFFSET))
+        user_rankings = users.get_user_rankings(limit, offset)
         return UserForms(items=[users.to_form(user) for user in user_rankings])
     
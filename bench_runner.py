@@ -0,0 +1,20 @@
+'''
+Created on 18/10/2026
+Run all benchmarks in the benchmarking suite
+
+@author: thurstonemerson
+'''
+import unittest
+import sys
+from config import SDK_PATH, BENCH_PATH
+
+ 
+def run_benchmarks(sdk_path, bench_path):
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    suite = unittest.loader.TestLoader().discover(bench_path, pattern='bench_*.py', top_level_dir='.')
+    unittest.TextTestRunner(verbosity=2).run(suite)
+ 
+if __name__ == '__main__':
+    run_benchmarks(SDK_PATH, BENCH_PATH)
\ No newline at end of file
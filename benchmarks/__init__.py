@@ -0,0 +1,32 @@
+"""
+Created on 18/10/2026
+
+Base benchmarking module, runs each benchmark against the testbed stubs so that
+the google app engine doesn't need to be running.
+@author: thurstonemerson
+"""
+import timeit
+
+from tests import MemoryGameUnitTest
+
+class MemoryGameBenchmark(MemoryGameUnitTest):
+    
+    def time(self, label, func, number=1000, threshold=None):
+        """Run func the requested number of times, print and return the 
+        mean time taken per call in microseconds. Fails if the mean exceeds
+        the threshold, in microseconds, if one is given"""
+        mean = timeit.timeit(func, number=number) / number * 1e6
+        print("{0:<50} {1:>12.2f} us".format(label, mean))
+        if threshold is not None:
+            self.assertLess(mean, threshold, "{0} regressed, {1:.2f} us is over the {2} us threshold".format(label, mean, threshold))
+        return mean
+    
+    def report(self, label, value, unit):
+        """Print and return a measurement"""
+        print("{0:<50} {1:>12.2f} {2}".format(label, value, unit))
+        return value
+    
+    def size(self, label, value):
+        """Print and return the size in bytes of an encoded value"""
+        print("{0:<50} {1:>12d} bytes".format(label, len(value)))
+        return len(value)
@@ -0,0 +1,46 @@
+'''
+Created on 18/10/2026
+
+Benchmarks comparing the compact board encoding with the pickled boards
+stored by earlier versions of the game.
+
+@author: thurstonemerson
+'''
+import pickle
+
+from benchmarks import MemoryGameBenchmark
+from games.models import Card, CardNames, encode_board, decode_board, deal_layout
+
+
+class BoardEncodingBenchmark(MemoryGameBenchmark):
+    
+    def _get_board(self):
+        """Deal a board and flip a few of its cards"""
+        layout = deal_layout(0, 16, len(CardNames))
+        board = [[Card(card_name=card_name) for card_name in layout[row * 4:(row + 1) * 4]] for row in range(4)]
+        board[0][0].flip()
+        board[1][2].flip()
+        return board
+    
+    def test_encode(self):
+        """Compare the cost of encoding a board"""
+        board = self._get_board()
+        pickled = self.time("pickle encode", lambda: pickle.dumps(board, 2))
+        compact = self.time("compact encode", lambda: encode_board(board))
+        self.assertLess(compact, pickled)
+        
+    def test_decode(self):
+        """Compare the cost of decoding a board"""
+        board = self._get_board()
+        pickled_value = pickle.dumps(board, 2)
+        compact_value = encode_board(board)
+        pickled = self.time("pickle decode", lambda: pickle.loads(pickled_value))
+        compact = self.time("compact decode", lambda: decode_board(compact_value))
+        self.assertLess(compact, pickled)
+    
+    def test_stored_bytes(self):
+        """Compare the number of bytes stored for a board"""
+        board = self._get_board()
+        pickled = self.size("pickle stored bytes", pickle.dumps(board, 2))
+        compact = self.size("compact stored bytes", encode_board(board))
+        self.assertLess(compact, pickled)
@@ -0,0 +1,45 @@
+'''
+Created on 18/10/2026
+
+Benchmarks comparing the seeded shuffle that deals the layout of a gridboard 
+with the deal used by earlier versions, which removed a random card from the deck for each 
+cell of the board.
+
+@author: thurstonemerson
+'''
+import math
+import random
+
+from benchmarks import MemoryGameBenchmark
+from games.models import Card, CardNames, deal_layout
+
+#The widths of the square boards dealt, each holding a whole number of card sets
+BOARD_SIZES = (4, 8, 16, 32, 64, 100, 200)
+
+
+class DealBenchmark(MemoryGameBenchmark):
+    
+    def _make_carddeck(self, size):
+        """Make a deck with enough cards to fill a size x size board"""
+        return [Card(card_name=card_name) for _ in range(size * size // len(CardNames)) 
+                for card_name in CardNames]
+    
+    def _removal_deal(self, deck):
+        """Deal a board as earlier versions did, removing a random card for each cell"""
+        griddimension = int(math.sqrt(len(deck)))
+        def remove_random_card():
+            card = random.choice(deck)
+            deck.remove(card)
+            return card
+        return [[remove_random_card() for row in range(griddimension)] for col in range(griddimension)]
+    
+    def test_deal(self):
+        """Compare the cost of dealing boards of increasing size"""
+        for size in BOARD_SIZES:
+            number = max(1, 4096 // (size * size))
+            removal = self.time("removal deal {0}x{0}".format(size), 
+                                lambda: self._removal_deal(self._make_carddeck(size)), number)
+            shuffle = self.time("seeded shuffle deal {0}x{0}".format(size), 
+                                lambda: deal_layout(size, size * size, len(CardNames)), number)
+            if size >= 16:
+                self.assertLess(shuffle, removal)
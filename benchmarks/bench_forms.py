@@ -0,0 +1,55 @@
+'''
+Created on 18/10/2026
+
+Benchmarks comparing the time taken to render and serialize a game, and the 
+bytes sent, with the board as a string and as a list of masked cell codes.
+
+@author: thurstonemerson
+'''
+from protorpc import protojson
+from google.appengine.api import memcache
+
+from benchmarks import MemoryGameBenchmark
+from services import games
+from users.models import User
+
+#The widths of the square boards rendered
+BOARD_SIZES = (4, 64)
+
+
+class GameFormBenchmark(MemoryGameBenchmark):
+    
+    def setUp(self):
+        super(GameFormBenchmark, self).setUp()
+        self.first_user = User(name=u'good golly', email=u'generic@thingy.com')
+        self.first_user.put()
+        self.second_user = User(name=u'my mummy', email=u'generic@thingy.com')
+        self.second_user.put()
+    
+    def _get_game(self, size):
+        """Create a game and flip a card, so the board isn't entirely masked"""
+        game = games.new_game(self.first_user.key, self.second_user.key, 
+                              self.first_user.name, self.second_user.name, rows=size, columns=size)
+        games.make_move(game, 0, 0, True)
+        return game
+    
+    def test_serialization(self):
+        """Compare the cost and size of a serialized game"""
+        for size in BOARD_SIZES:
+            game = self._get_game(size)
+            number = max(10, 16384 // (size * size))
+            
+            string = self.time("string board {0}x{0}".format(size), 
+                               lambda: protojson.encode_message(games.to_form(game)), number)
+            def uncached():
+                game._layout = None
+                memcache.delete(games._board_cache_key(game))
+                return protojson.encode_message(games.to_board_form(game))
+            self.time("cell codes {0}x{0} rendered".format(size), uncached, number)
+            cached = self.time("cell codes {0}x{0} cached".format(size), 
+                               lambda: protojson.encode_message(games.to_board_form(game)), number)
+            
+            self.size("string board {0}x{0}".format(size), protojson.encode_message(games.to_form(game)))
+            self.size("cell codes {0}x{0}".format(size), protojson.encode_message(games.to_board_form(game)))
+            if size > 4:
+                self.assertLess(cached, string)
@@ -0,0 +1,142 @@
+'''
+Created on 18/10/2026
+
+Load test driving the game and user apis through WSGI against the testbed stubs.
+Simulated players create their accounts, then play games to the end. The player
+waiting for their turn polls the game with the version they last saw, and the
+player to move reads the board, remembering the cards they have seen. Reports the 
+throughput, the p50/p95/p99 latency of each endpoint and the RPCs made per game.
+
+The players and boards are seeded, so the same requests are made on every run 
+and the report can be compared between commits. The number of players, games and
+polls can be raised with the BENCH_PLAYERS, BENCH_GAMES and BENCH_POLLS environment
+variables, to load test with thousands of games.
+
+@author: thurstonemerson
+'''
+import os
+import random
+import time
+from collections import defaultdict
+
+import endpoints
+import webtest
+
+from benchmarks import MemoryGameBenchmark
+from api.games import GameApi
+from api.users import UserApi
+
+#The number of players, the number of games played between them and the seed of their moves
+PLAYERS = int(os.environ.get('BENCH_PLAYERS', 20))
+GAMES = int(os.environ.get('BENCH_GAMES', 40))
+SEED = 1234
+#The times the waiting player polls a game for a change before each move
+POLLS = int(os.environ.get('BENCH_POLLS', 2))
+
+
+class LoadBenchmark(MemoryGameBenchmark):
+    
+    def setUp(self):
+        super(LoadBenchmark, self).setUp()
+        self.app = webtest.TestApp(endpoints.api_server([GameApi, UserApi], restricted=False))
+        self.latency = defaultdict(list)
+        self.unchanged = 0
+        self.random = random.Random(SEED)
+        random.seed(SEED)
+    
+    def _call(self, endpoint, request):
+        """Call an endpoint, recording its latency. Returns the response"""
+        start = time.time()
+        resp = self.app.post_json('/_ah/spi/' + endpoint, request, expect_errors=True)
+        self.latency[endpoint].append((time.time() - start) * 1000)
+        return resp
+    
+    def _choose_cell(self, cells, memory, first_card=None):
+        """Choose a face down cell to flip. A player flips a card whose pair they
+        remember, or the remembered pair of their first card, before trying a 
+        card they haven't seen"""
+        face_down = [cell for cell, code in enumerate(cells) if code == 0]
+        if first_card is None:
+            seen = defaultdict(list)
+            for cell in face_down:
+                if cell in memory:
+                    seen[memory[cell]].append(cell)
+            pairs = [found for found in seen.values() if len(found) > 1]
+            if pairs:
+                return pairs[0][0]
+        else:
+            mates = [cell for cell in face_down if memory.get(cell) == first_card]
+            if mates:
+                return mates[0]
+        unseen = [cell for cell in face_down if cell not in memory]
+        return self.random.choice(unseen or face_down)
+    
+    def _poll(self, game):
+        """Poll a game as the player waiting for their turn, with the version of the
+        game they last saw"""
+        resp = self._call('GameApi.get_game', {'urlsafe_game_key': game['key'], 'version': game['version']})
+        self.assertEqual(resp.status_int, 200)
+        if resp.json.get('unchanged'):
+            self.unchanged += 1
+        game['version'] = resp.json['version']
+    
+    def _play_move(self, game):
+        """Poll a game as the waiting player, then read the board as the player whose
+        turn it is and make their next move. Returns false once the game has ended"""
+        for _ in range(POLLS):
+            self._poll(game)
+        board = self._call('GameApi.get_game_board', {'urlsafe_game_key': game['key']}).json
+        cells, memory = board['cells'], game['memory']
+        for cell, code in enumerate(cells):
+            if code:
+                memory[cell] = code
+        
+        first_card = memory[game['first_guess']] if game['first_guess'] is not None else None
+        cell = self._choose_cell(cells, memory, first_card)
+        row, column = divmod(cell, board['columns'])
+        resp = self._call('GameApi.make_move', {'urlsafe_game_key': game['key'], 'name': board['next_move'],
+                                                'row': row, 'column': column})
+        if resp.status_int == 404: #the game was a draw and has been cancelled
+            return False
+        self.assertEqual(resp.status_int, 200)
+        game['first_guess'] = cell if first_card is None else None
+        return not resp.json['game_over']
+    
+    def test_load(self):
+        """Play games between simulated players and report the load"""
+        rpcs, memcache_rpcs = self.count_rpcs(), self.count_rpcs('memcache')
+        start = time.time()
+        
+        names = ['player {0}'.format(number) for number in range(PLAYERS)]
+        for name in names:
+            self._call('UserApi.create_user', {'name': name})
+        
+        active = []
+        for _ in range(GAMES):
+            first_user, second_user = self.random.sample(names, 2)
+            resp = self._call('GameApi.new_game', {'first_user': first_user, 'second_user': second_user})
+            active.append({'key': resp.json['urlsafe_key'], 'version': resp.json['version'],
+                           'memory': {}, 'first_guess': None})
+        
+        #take turns across every game until they have all ended
+        while active:
+            active = [game for game in active if self._play_move(game)]
+        
+        for name in names:
+            self._call('GameApi.get_user_games', {'name': name})
+            self._call('GameApi.get_user_scores', {'name': name})
+        self._call('UserApi.get_user_rankings', {})
+        
+        elapsed = time.time() - start
+        requests = sum(len(latencies) for latencies in self.latency.values())
+        self.report("requests", requests, "calls")
+        self.report("throughput", requests / elapsed, "calls/s")
+        polls = len(self.latency['GameApi.get_game'])
+        self.report("unchanged polls", 100.0 * self.unchanged / max(polls, 1), "%")
+        for endpoint in sorted(self.latency):
+            latencies = sorted(self.latency[endpoint])
+            for percentile in (50, 95, 99):
+                index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+                self.report("{0} p{1}".format(endpoint, percentile), latencies[index], "ms")
+        self.report("datastore rpcs per game", float(sum(rpcs.values())) / GAMES, "rpcs")
+        self.report("memcache rpcs per game", float(sum(memcache_rpcs.values())) / GAMES, "rpcs")
@@ -0,0 +1,83 @@
+'''
+Created on 18/10/2026
+
+Benchmarks comparing the wall clock time of the final, game ending move made
+sequentially with the tasklet based make_move endpoint.
+
+@author: thurstonemerson
+'''
+from benchmarks import MemoryGameBenchmark
+from services import games, users, scores
+from users.models import User
+from games.models import Card, CardNames
+from api.games import GameApi, MAKE_MOVE_REQUEST
+from google.appengine.ext import ndb
+
+#The number of games played to their final move by each benchmark
+GAMES = 200
+#The mean time in microseconds each final move must stay under, set well above the
+#times measured on a development machine so that only real regressions fail
+THRESHOLDS = {
+    'sequential final move': 50000,
+    'tasklet final move': 50000,
+}
+
+
+class MakeMoveBenchmark(MemoryGameBenchmark):
+    
+    def setUp(self):
+        super(MakeMoveBenchmark, self).setUp()
+        self.first_user = User(name=u'good golly', email=u'generic@thingy.com')
+        self.first_user.put()
+        self.second_user = User(name=u'my mummy', email=u'generic@thingy.com')
+        self.second_user.put()
+    
+    def _get_game_with_one_pair_left(self):
+        """Create a game where the first user has found all but one pair and 
+        has made their first guess of the last pair"""
+        game = games.new_game(self.first_user.key, self.second_user.key, self.first_user.name, self.second_user.name)
+        game.board = [[Card(card_name=CardNames.DEATH), Card(card_name=CardNames.DEATH)],
+                      [Card(card_name=CardNames.FOOL), Card(card_name=CardNames.FOOL)]]
+        game.unmatched_pairs = 1
+        game.first_user_score = 1
+        games.make_move(game, 1, 0, True)
+        return game
+    
+    def _reload(self, game):
+        """The final move may be made on a fresh copy of the game, so read back
+        the game from the datastore to see its effect"""
+        ndb.get_context().clear_cache()
+        return game.key.get()
+    
+    def _time_final_moves(self, label, make_final_move):
+        """Time the final move of a number of games, excluding their setup, as the
+        games are set up before the timing starts"""
+        ready = [self._get_game_with_one_pair_left() for _ in range(GAMES)]
+        remaining = iter(ready)
+        mean = self.time(label, lambda: make_final_move(next(remaining)), GAMES, THRESHOLDS[label])
+        for game in ready:
+            self.assertTrue(self._reload(game).game_over)
+        return mean
+    
+    def _sequential_final_move(self, game):
+        """The final move as made before make_move used tasklets"""
+        user = users.get_by_name(self.first_user.name)
+        game = games.get_by_urlsafe(game.key.urlsafe())
+        games.is_valid_move(game, 1, 1)
+        message = games.make_move(game, 1, 1, user.key == game.first_user)
+        users.add_win(game.winner.get())
+        users.add_loss(game.loser.get())
+        scores.new_score(game.winner, game.loser, game.first_user_score, game.second_user_score)
+        return games.to_form(game, message)
+    
+    def _tasklet_final_move(self, game):
+        """The final move as made by the make_move endpoint"""
+        request = MAKE_MOVE_REQUEST.combined_message_class(urlsafe_game_key=game.key.urlsafe(),
+                                                           name=self.first_user.name, row=1, column=1)
+        return GameApi()._make_move_async(request, (1, 1)).get_result()
+    
+    def test_final_move(self):
+        """Compare the wall clock time of a game ending move"""
+        sequential = self._time_final_moves("sequential final move", self._sequential_final_move)
+        tasklet = self._time_final_moves("tasklet final move", self._tasklet_final_move)
+        self.report("tasklet improvement", (sequential - tasklet) / sequential * 100, "%")
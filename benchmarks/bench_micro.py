@@ -0,0 +1,117 @@
+'''
+Created on 18/10/2026
+
+Microbenchmarks of the game's hot paths: dealing a board, validating and making
+moves, rendering forms and pickling games. Each runs a fixed, seeded workload so
+results are comparable between runs, and fails if its mean time regresses past
+its threshold.
+
+@author: thurstonemerson
+'''
+import pickle
+
+from benchmarks import MemoryGameBenchmark
+from services import games
+from users.models import User
+from games.models import Card, CardNames, deal_layout
+
+#The mean time in microseconds each benchmark must stay under. The thresholds are
+#set well above the times measured on a development machine, so that only real 
+#regressions fail rather than noise
+THRESHOLDS = {
+    'deal 4x4': 100,
+    'deal 64x64': 20000,
+    'board view 4x4': 300,
+    'is_valid_move': 30,
+    'apply_move': 300,
+    'make_move': 5000,
+    'make_move_async': 5000,
+    'apply_move match': 300,
+    'make_move match': 5000,
+    'make_move game over': 10000,
+    'to_form': 1000,
+    'to_board_form': 1000,
+    'pickle encode game': 1000,
+    'pickle decode game': 2000,
+}
+
+
+class MicroBenchmark(MemoryGameBenchmark):
+    
+    def setUp(self):
+        super(MicroBenchmark, self).setUp()
+        first_user = User(name=u'good golly', email=u'generic@thingy.com')
+        first_user.put()
+        second_user = User(name=u'my mummy', email=u'generic@thingy.com')
+        second_user.put()
+        self.game = games.new_game(first_user.key, second_user.key, first_user.name, second_user.name)
+        self.game.board = [[Card(card_name=CardNames.DEATH), Card(card_name=CardNames.FOOL), Card(card_name=CardNames.DEATH), Card(card_name=CardNames.HIGH_PRIESTESS)],
+                           [Card(card_name=CardNames.HANGED_MAN), Card(card_name=CardNames.TEMPERANCE), Card(card_name=CardNames.HIGH_PRIESTESS), Card(card_name=CardNames.LOVERS)],
+                           [Card(card_name=CardNames.JUSTICE), Card(card_name=CardNames.FOOL), Card(card_name=CardNames.HERMIT), Card(card_name=CardNames.LOVERS)],
+                           [Card(card_name=CardNames.JUSTICE), Card(card_name=CardNames.HANGED_MAN), Card(card_name=CardNames.TEMPERANCE), Card(card_name=CardNames.HERMIT)]]
+        self.game.put()
+    
+    def _time(self, label, func, number=1000):
+        return self.time(label, func, number, THRESHOLDS[label])
+    
+    def _no_match(self, make_move):
+        """A turn without a match, flipping DEATH then FOOL. The next turn's first
+        guess turns the cards face down again, so the workload can be repeated"""
+        def turn():
+            make_move(self.game, 0, 0, True)
+            make_move(self.game, 0, 1, True)
+        return turn
+    
+    def _copies(self, game, number):
+        """Returns an iterator over copies of the game, so a workload changing the game
+        for good starts each run from the same seeded state"""
+        pickled = pickle.dumps(game, 2)
+        return iter([pickle.loads(pickled) for _ in range(number)])
+    
+    def _match(self, make_move, number):
+        """A turn matching the pair of DEATH cards, made on a fresh copy of the game each run"""
+        copies = self._copies(self.game, number)
+        def turn():
+            game = next(copies)
+            make_move(game, 0, 0, True)
+            make_move(game, 0, 2, True)
+        return turn
+    
+    def _game_over(self, make_move, number):
+        """The move ending the game, matching the last pair of DEATH cards once the 
+        first of them is flipped, made on a fresh copy of the game each run"""
+        self.game.matched = [cell for cell in range(16) if cell not in (0, 2)]
+        self.game.unmatched_pairs = 1
+        self.game.first_user_score = 7
+        games.apply_move(self.game, 0, 0, True)
+        copies = self._copies(self.game, number)
+        return lambda: make_move(next(copies), 0, 2, True)
+    
+    def test_deal(self):
+        self._time('deal 4x4', lambda: deal_layout(1, 16, len(CardNames)))
+        self._time('deal 64x64', lambda: deal_layout(1, 64 * 64, len(CardNames)), number=20)
+        self._time('board view 4x4', lambda: self.game.board)
+        
+    def test_is_valid_move(self):
+        self._time('is_valid_move', lambda: games.is_valid_move(self.game, 3, 3, False))
+    
+    def test_make_move(self):
+        # the times are of a whole turn, two moves, without and with a match
+        self._time('apply_move', self._no_match(games.apply_move), number=500)
+        self._time('make_move', self._no_match(games.make_move), number=100)
+        self._time('make_move_async', self._no_match(lambda *args: games.make_move_async(*args).get_result()), number=100)
+        self._time('apply_move match', self._match(games.apply_move, 500), number=500)
+        self._time('make_move match', self._match(games.make_move, 100), number=100)
+    
+    def test_make_move_game_over(self):
+        # the time is of the final move alone, which also decides the winner
+        self._time('make_move game over', self._game_over(games.make_move, 100), number=100)
+    
+    def test_forms(self):
+        self._time('to_form', lambda: games.to_form(self.game))
+        self._time('to_board_form', lambda: games.to_board_form(self.game))
+    
+    def test_pickle(self):
+        pickled = pickle.dumps(self.game, 2)
+        self._time('pickle encode game', lambda: pickle.dumps(self.game, 2))
+        self._time('pickle decode game', lambda: pickle.loads(pickled))
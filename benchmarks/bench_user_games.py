@@ -0,0 +1,68 @@
+'''
+Created on 18/10/2026
+
+Benchmarks comparing the datastore RPCs and time taken to find a user's active 
+games with the OR query on the first and second users, and with the keys only 
+query on the players followed by a batch get.
+
+@author: thurstonemerson
+'''
+from benchmarks import MemoryGameBenchmark
+from services import games
+from users.models import User
+from games.models import Game
+from google.appengine.ext import ndb
+
+#The number of active and finished games played by the user
+ACTIVE_GAMES = 20
+FINISHED_GAMES = 100
+
+
+class UserGamesBenchmark(MemoryGameBenchmark):
+    
+    def setUp(self):
+        super(UserGamesBenchmark, self).setUp()
+        self.user = User(name=u'good golly', email=u'generic@thingy.com')
+        self.user.put()
+        opponent = User(name=u'my mummy', email=u'generic@thingy.com')
+        opponent.put()
+        
+        for number in range(ACTIVE_GAMES + FINISHED_GAMES):
+            if number % 2:
+                game = games.new_game(self.user.key, opponent.key, self.user.name, opponent.name)
+            else:
+                game = games.new_game(opponent.key, self.user.key, opponent.name, self.user.name)
+            if number >= ACTIVE_GAMES:
+                game.game_over = True
+                game.put()
+    
+    def _or_query(self):
+        """A user's active games as found before the players were recorded"""
+        return Game.query(ndb.OR(Game.first_user == self.user.key,
+                                 Game.second_user == self.user.key)).filter(Game.game_over == False).fetch()
+    
+    def _players_query(self):
+        """A user's active games as found by the games service"""
+        return games.get_user_games(self.user, page_size=ACTIVE_GAMES)[0]
+    
+    def _count_rpcs(self, label, func):
+        """Print the datastore RPCs made by func with an empty in-context cache"""
+        ndb.get_context().clear_cache()
+        rpcs = self.count_rpcs()
+        self.assertEqual(len(func()), ACTIVE_GAMES)
+        for call in sorted(rpcs):
+            print("{0:<50} {1:>12d} rpcs".format("{0} {1}".format(label, call), rpcs[call]))
+        return sum(rpcs.values())
+    
+    def _time(self, label, func):
+        def timed():
+            ndb.get_context().clear_cache()
+            func()
+        return self.time(label, timed, number=100)
+    
+    def test_user_games(self):
+        """Compare the RPCs and time taken to find a user's active games"""
+        self._count_rpcs("or query", self._or_query)
+        self._count_rpcs("players query", self._players_query)
+        self._time("or query", self._or_query)
+        self._time("players query", self._players_query)
@@ -1,3 +1,4 @@
 DEBUG = False
 SDK_PATH = "C:\Program Files (x86)\Google\google_appengine"
 TEST_PATH = "."
+BENCH_PATH = "benchmarks"
\ No newline at end of file
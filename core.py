@@ -7,15 +7,29 @@ Encapsulation module used for interacting with the google app engine ndb.model c
 '''
 import logging
 from google.appengine.ext import ndb
+from google.appengine.api import memcache, datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 import endpoints
 
+from instrumentation import stats, timed
+
 class Service(object):
     """A :class:`Service` instance encapsulates common ndb.Model 
     operations in the context of a Google app engine application.
     Adapted from SQLAlchemy/Flask service module found in 
     https://github.com/mattupstate/overholt
+    
+    Services may opt in to caching their model's entities in memcache by setting
+    `__cache__`. Cached entities are read through memcache, and evicted when they
+    are saved or deleted.
     """
     __model__ = None
+    __cache__ = False
+    __cache_timeout__ = 3600
+    
+    def __init__(self):
+        #: Memcache hit and miss counters of this service instance
+        self.cache_stats = {'hits': 0, 'misses': 0}
 
     def _isinstance(self, model, raise_error=True):
         """Checks if the specified model instance matches the service's model.
@@ -29,6 +43,7 @@ class Service(object):
             raise ValueError('%s is not of type %s' % (model, self.__model__))
         return rv
     
+    @timed
     def get_by_urlsafe(self, urlsafe):
         """Returns an ndb.Model entity that the urlsafe key points to. Checks
         that the type of entity returned is of the correct kind. Raises an
@@ -36,23 +51,86 @@ class Service(object):
         kind.
         :param urlsafe: A urlsafe key string
         """
-        try:
-            key = ndb.Key(urlsafe=urlsafe)
-        except TypeError:
-            raise endpoints.BadRequestException('Invalid Key')
-        except Exception, e:
-            if e.__class__.__name__ == 'ProtocolBufferDecodeError':
-                raise endpoints.BadRequestException('Invalid Key')
-            else:
-                raise
-        model = key.get()
+        return self.get_by_urlsafe_async(urlsafe).get_result()
+    
+    @ndb.tasklet
+    def get_by_urlsafe_async(self, urlsafe):
+        """Tasklet version of get_by_urlsafe, returning a future for the entity
+        :param urlsafe: A urlsafe key string
+        """
+        key = self.key_from_urlsafe(urlsafe)
+        model = yield self.get_by_key_async(key)
         if not model:
-            return None
+            raise ndb.Return(None)
         
         self._isinstance(model)
         
-        return model
+        raise ndb.Return(model)
     
+    @timed
+    def get_multi_by_urlsafe(self, urlsafes):
+        """Returns a list of the ndb.Model entities the urlsafe keys point to, in 
+        the same order, with `None` for any that do not exist. Raises an error if 
+        any key String is malformed or of the incorrect kind before fetching.
+        :param urlsafes: a list of urlsafe key strings
+        """
+        return self.get_multi_by_urlsafe_async(urlsafes).get_result()
+    
+    @ndb.tasklet
+    def get_multi_by_urlsafe_async(self, urlsafes):
+        """Tasklet version of get_multi_by_urlsafe, returning a future for the list
+        of entities. The entities are read as get_by_key reads them, and ndb batches
+        the reads into one memcache and one datastore batch get
+        :param urlsafes: a list of urlsafe key strings
+        """
+        keys = [self.key_from_urlsafe(urlsafe) for urlsafe in urlsafes]
+        if any(key.kind() != self.__model__._get_kind() for key in keys):
+            raise endpoints.BadRequestException('Invalid Key')
+        
+        models = yield [self.get_by_key_async(key) for key in keys]
+        for model in models:
+            if model:
+                self._isinstance(model)
+        raise ndb.Return(models)
+    
+    def get_by_key(self, key):
+        """Returns the ndb.Model entity the key points to, or `None` if it does not
+        exist. Entities of a cached model are read through memcache, except within
+        a transaction where they are always read from the datastore.
+        :param key: an ndb.Key
+        """
+        return self.get_by_key_async(key).get_result()
+    
+    @ndb.tasklet
+    def get_by_key_async(self, key):
+        """Tasklet version of get_by_key, returning a future for the entity
+        :param key: an ndb.Key
+        """
+        if not self.__cache__ or ndb.in_transaction():
+            model = yield key.get_async()
+            raise ndb.Return(model)
+        
+        # an entity already in the request's in-context cache is returned as is
+        model = yield key.get_async(use_datastore=False, use_memcache=False)
+        if model is not None:
+            raise ndb.Return(model)
+        
+        ctx = ndb.get_context()
+        model = yield ctx.memcache_get(self._cache_key(key))
+        if model is not None:
+            self.cache_stats['hits'] += 1
+            raise ndb.Return(model)
+        
+        self.cache_stats['misses'] += 1
+        model = yield key.get_async(use_memcache=False)
+        if model is not None and self._is_cacheable(model):
+            #added rather than set, so a copy read before a concurrent save never
+            #replaces one read after it
+            yield [ctx.memcache_add(cache_key, value, time=self.__cache_timeout__)
+                   for cache_key, value in self._cache_values(model).items()]
+        raise ndb.Return(model)
+    
+    @timed
     def get_by_name(self, model_name):
         """Returns an instance of the service's model with the specified model name.
         Returns `None` if an instance with the specified model name does not exist.
@@ -60,21 +138,50 @@ class Service(object):
         """
         return self.__model__.query(self.__model__.name == model_name).get()
 
+    @timed
     def find(self, *args):
         """Returns a list of instances of the service's model filtered by the
         specified key word arguments.
         :param *args: a single filter argument
         """
         return self.__model__.query().filter(*args).fetch()
+    
+    def fetch_page(self, query, page_size, urlsafe_cursor=None, **options):
+        """Returns a page of the query's results and the urlsafe cursor of the 
+        next page, or None if this is the last page
+        :param query: the query to page through
+        :param page_size: the maximum number of results returned
+        :param urlsafe_cursor: a urlsafe cursor returned with the previous page
+        :param **options: query options such as keys_only
+        """
+        results, next_cursor, more = query.fetch_page(page_size, 
+                                                      start_cursor=self.cursor_from_urlsafe(urlsafe_cursor),
+                                                      **options)
+        return results, next_cursor.urlsafe() if more and next_cursor else None
 
 
-    def save(self, model):
-        """Commits the model to the database and returns the model
+    @timed
+    def save(self, model, *related):
+        """Commits the model to the database and returns the model. Any related
+        entities are committed in the same batch as the model. Within a transaction
+        the model is evicted from memcache once the transaction commits
         :param model: the model to save
+        :param *related: related entities of any kind to save alongside the model
+        """
+        return self.save_async(model, *related).get_result()
+    
+    @ndb.tasklet
+    def save_async(self, model, *related):
+        """Tasklet version of save, returning a future for the saved model
+        :param model: the model to save
+        :param *related: related entities of any kind to save alongside the model
         """
         self._isinstance(model)
-        model.put()
-        return model
+        for entity in [model] + list(related):
+            stats.record_save(entity)
+        yield ndb.put_multi_async([model] + list(related))
+        yield self._cache_evict_async(model)
+        raise ndb.Return(model)
     
     def new(self, request=None):
         """Returns a new, unsaved instance of the service's model class. Initialise
@@ -96,22 +203,112 @@ class Service(object):
     
         return self.save(self.new(request))
     
+    @timed
     def update(self, model, **kwargs):
         """Returns an updated instance of the service's model class.
         :param model: the model to update
         :param **kwargs: update parameters
         """
+        return self.update_async(model, **kwargs).get_result()
+    
+    def update_async(self, model, **kwargs):
+        """Updates an instance of the service's model class, returning a future 
+        for the model once it is saved.
+        :param model: the model to update
+        :param **kwargs: update parameters
+        """
         self._isinstance(model)
         for k, v in kwargs.items():
             setattr(model, k, v)
-        self.save(model)
-        return model
+        return self.save_async(model)
     
+    @timed
     def delete(self, model):
         """Immediately deletes the specified model instance.
         :param model: the model instance to delete
         """
         self._isinstance(model)
         model.key.delete()
+        self._cache_delete(model.key)
+    
+    def get_names(self, keys):
+        """Returns a dictionary of key to name for the named entities the keys point
+        to, fetched with a single batch get. Empty keys and duplicates are ignored.
+        :param keys: a list of ndb.Keys of entities with a name property
+        """
+        keys = list(set(key for key in keys if key))
+        if not keys:
+            return {}
+        return dict((model.key, model.name) for model in ndb.get_multi(keys) if model)
+    
+    def key_from_urlsafe(self, urlsafe):
+        """Returns the ndb.Key of a urlsafe key string. Raises an error if the 
+        key String is malformed
+        :param urlsafe: A urlsafe key string
+        """
+        try:
+            return ndb.Key(urlsafe=urlsafe)
+        except TypeError:
+            raise endpoints.BadRequestException('Invalid Key')
+        except Exception, e:
+            if e.__class__.__name__ == 'ProtocolBufferDecodeError':
+                raise endpoints.BadRequestException('Invalid Key')
+            else:
+                raise
+    
+    def cursor_from_urlsafe(self, urlsafe):
+        """Returns the query Cursor of a urlsafe cursor string, or None if no 
+        cursor is given. Raises an error if the cursor string is malformed
+        :param urlsafe: A urlsafe cursor string
+        """
+        if not urlsafe:
+            return None
+        try:
+            return Cursor(urlsafe=urlsafe)
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException('Invalid Cursor')
+    
+    #-----------------------------------------------------------------------
+    #Private methods handling the memcache layer
+    #-----------------------------------------------------------------------
+    
+    def _cache_key(self, key):
+        """Returns the memcache key an entity is cached under"""
+        return 'cache:' + key.urlsafe()
+    
+    def _cache_keys(self, key):
+        """Returns the memcache keys kept for an entity, which are evicted together.
+        Services keeping more than the entity override this along with _cache_values"""
+        return [self._cache_key(key)]
+    
+    def _cache_values(self, model):
+        """Returns the memcache keys and values kept for a model instance read through
+        memcache. Services may override this to keep more than the entity, ndb batches
+        the sets into one RPC"""
+        return {self._cache_key(model.key): model}
+    
+    def _is_cacheable(self, model):
+        """Returns true if the model instance should be kept in memcache. 
+        Services may override this to cache only some of their entities"""
+        return True
+    
+    @ndb.tasklet
+    def _cache_evict_async(self, model):
+        """Evicts a saved model instance from memcache, to be read through again. A
+        saved entity isn't written through, as concurrent saves could set memcache 
+        in another order than they commit in. Within a transaction the entity is 
+        evicted once the transaction commits"""
+        if not self.__cache__:
+            return
+        ctx = ndb.get_context()
+        if ndb.in_transaction():
+            ctx.call_on_commit(lambda: self._cache_delete(model.key))
+            return
+        yield [ctx.memcache_delete(cache_key) for cache_key in self._cache_keys(model.key)]
+    
+    def _cache_delete(self, *keys):
+        """Evicts the entities the keys point to from memcache"""
+        if self.__cache__:
+            memcache.delete_multi([cache_key for key in keys for cache_key in self._cache_keys(key)])
 
     
@@ -1,12 +1,13 @@
 '''
 Created on 21/03/2016
 
-Import all of the forms needed for games and users modules
+Import all of the forms needed for games, users and tournaments modules
 
 @author: thurstonemerson
 '''
 
 from games.forms import *
 from users.forms import *
+from tournaments.forms import *
 
 
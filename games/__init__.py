@@ -6,127 +6,364 @@ is contained. Persistence is dealt with in the service.
 
 @author: thurstonemerson
 '''
-from models import Game, CardNames, Card, Move, Score, Turn
-from forms import GameForm, ScoreForm
+from models import Game, CardNames, Move, Score, GameTurn, new_seed
+from forms import GameForm, GameForms, ScoreForm, ScoreForms, GameBoardForm, TurnForm, TurnForms
 from core import Service
 from google.appengine.ext import ndb
-from google.appengine.api import taskqueue
-from datetime import date
+from google.appengine.api import taskqueue, memcache, mail, app_identity
+from google.appengine.datastore.datastore_query import Cursor
+from datetime import datetime
 from config import DEBUG
 import logging
-import math
-import random
+import time
 import endpoints
 
+#The default number of games or scores returned in a page of a user's games or scores
+PAGE_SIZE = 20
+
+#The default dimensions of a new game's board, and the largest number of rows or columns
+BOARD_ROWS = 4
+BOARD_COLUMNS = 4
+MAX_BOARD_DIMENSION = 256
+
+#Users are notified that it is their turn in a game at most once in this many seconds
+NOTIFY_WINDOW = 300
+#The pull queue of turn notifications, and how many are leased at once and for how long
+NOTIFY_QUEUE = 'notifications'
+NOTIFY_LEASE_SIZE = 100
+NOTIFY_LEASE_SECONDS = 60
+#The most leases made each time the turn digests are sent
+NOTIFY_MAX_LEASES = 10
+
+#The task advancing a tournament once one of its games is over
+TOURNAMENT_URL = '/tournaments/advance'
+
+#The default seconds a user waits for a game to change, and the seconds between the 
+#first and the slowest checks of the game's version while waiting
+WAIT_TIMEOUT = 20
+WAIT_INTERVAL = 0.1
+WAIT_MAX_INTERVAL = 1.0
+
 class ScoreService(Service):
     """Service class interacting with the Score datastore"""
     __model__ = Score
+    __cache__ = False
     
     #-----------------------------------------------------------------------
     #Create a new score on the scoreboard
     #-----------------------------------------------------------------------
     
-    def new_score(self, winner, loser, first_user_score, second_user_score):
-        """Creates and returns a new score, persisting to the google datastore"""
+    def new_score(self, winner, loser, first_user_score, second_user_score, winner_name=None, loser_name=None):
+        """Creates and returns a new score, persisting to the google datastore. The 
+        user names are copied onto the score, and are fetched if they aren't given"""
+        return self.new_score_async(winner, loser, first_user_score, second_user_score, 
+                                    winner_name, loser_name).get_result()
+    
+    def new_score_async(self, winner, loser, first_user_score, second_user_score, winner_name=None, loser_name=None):
+        """Creates a new score, returning a future for the score once it is persisted"""
+        score = self.build_score(winner, loser, first_user_score, second_user_score, winner_name, loser_name)
+        return super(ScoreService, self).save_async(score)
+    
+    def build_score(self, winner, loser, first_user_score, second_user_score, winner_name=None, loser_name=None):
+        """Creates and returns a new score without persisting it"""
        
         if first_user_score == second_user_score:
                 raise endpoints.BadRequestException('Score cannot be created, game was a draw')
+        
+        if winner_name is None or loser_name is None:
+            names = super(ScoreService, self).get_names([winner, loser])
+            winner_name, loser_name = names.get(winner), names.get(loser)
          
         #create a new score and initialise with winner/loser deatils
         score = super(ScoreService, self).new()
-        data = {"date": date.today(), "winner": winner, "loser": loser,
+        now = datetime.now()
+        data = {"date": now.date(), "created": now, "winner": winner, "loser": loser,
+               "winner_name": winner_name, "loser_name": loser_name,
                "winner_score": first_user_score if first_user_score > second_user_score else second_user_score, 
                "loser_score": first_user_score if first_user_score < second_user_score else second_user_score}
          
-        super(ScoreService, self).update(score, **data)
+        for k, v in data.items():
+            setattr(score, k, v)
         return score
     
+    #-----------------------------------------------------------------------
+    #Rewrite the users of scores when users are re-keyed
+    #-----------------------------------------------------------------------
+    
+    def rekey_users(self, rekeyed):
+        """Rewrite the winner and loser of scores referencing re-keyed users.
+        :param rekeyed: dictionary of old to new user keys
+        """
+        changed = {}
+        for old_key in rekeyed:
+            for score in Score.query(ndb.OR(Score.winner == old_key, Score.loser == old_key)):
+                score = changed.setdefault(score.key, score)
+                score.winner = rekeyed.get(score.winner, score.winner)
+                score.loser = rekeyed.get(score.loser, score.loser)
+        ndb.put_multi(changed.values())
+    
+    def migrate_scores(self, urlsafe_cursor=None, batch_size=100):
+        """Copy the user names onto a batch of scores stored by earlier versions. 
+        Scores without a creation time are given the start of the day they were 
+        recorded, and the participants are set as each score is put. Returns the 
+        urlsafe cursor of the next batch, or None when done"""
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        batch, next_cursor, more = Score.query().fetch_page(batch_size, start_cursor=cursor)
+        
+        unnamed = [score for score in batch if score.winner_name is None or score.loser_name is None]
+        names = super(ScoreService, self).get_names([key for score in unnamed for key in (score.winner, score.loser)])
+        for score in unnamed:
+            score.winner_name = names.get(score.winner)
+            score.loser_name = names.get(score.loser)
+        for score in batch:
+            if score.created is None:
+                score.created = datetime.combine(score.date, datetime.min.time())
+        ndb.put_multi(batch)
+        
+        logging.info("Migrated {0} scores".format(len(batch)))
+        return next_cursor.urlsafe() if more and next_cursor else None
+    
     #-----------------------------------------------------------------------
     #Return a list of scores from the specified user
     #-----------------------------------------------------------------------
   
     
-    def get_user_scores(self, user):
-        """Returns a list of scores by the requested user"""
-        scores = Score.query(ndb.OR(Score.winner == user.key,
-                                    Score.loser == user.key)).fetch()
-        return scores
+    def get_user_scores(self, user, page_size=None, urlsafe_cursor=None):
+        """Returns a page of scores by the requested user, newest first, and the 
+        urlsafe cursor of the next page, or None if there are no more scores"""
+        query = Score.query(Score.participants == user.key).order(-Score.created)
+        return super(ScoreService, self).fetch_page(query, page_size or PAGE_SIZE, urlsafe_cursor)
     
     #-----------------------------------------------------------------------
     #Create a form from a score
     #-----------------------------------------------------------------------
   
 
-    def to_form(self, score):
-        """Returns a ScoreForm representation of the Score"""
+    def to_form(self, score, names=None):
+        """Returns a ScoreForm representation of the Score. Scores stored before user
+        names were copied onto them look up their users in names, a dictionary of 
+        user key to name, or fetch them if it isn't given"""
+        if names is None:
+            names = super(ScoreService, self).get_names(self._unnamed_users([score]))
         form = ScoreForm(date=str(score.date),
-                         winner=score.winner.get().name,
-                         loser=score.loser.get().name,
+                         winner=score.winner_name or names.get(score.winner),
+                         loser=score.loser_name or names.get(score.loser),
                          winner_score=score.winner_score,
                          loser_score=score.loser_score)
         return form
+    
+    def to_forms(self, scores, next_cursor=None):
+        """Returns a ScoreForms representation of a list of scores. Any users whose
+        names aren't on the scores are fetched with a single batch get"""
+        names = super(ScoreService, self).get_names(self._unnamed_users(scores))
+        return ScoreForms(items=[self.to_form(score, names) for score in scores],
+                          next_cursor=next_cursor)
+    
+    def _unnamed_users(self, scores):
+        """Returns the keys of users whose names haven't been copied onto the scores"""
+        return ([score.winner for score in scores if score.winner_name is None] +
+                [score.loser for score in scores if score.loser_name is None])
 
 class GamesService(Service):
-    """Service class interacting with the Game datastore"""
+    """Service class interacting with the Game datastore. Active games are 
+    cached in memcache as they are polled constantly by waiting players"""
     __model__ = Game
+    __cache__ = True
     
     #-----------------------------------------------------------------------
     #Return a list of active games from the specified user
     #-----------------------------------------------------------------------
   
-    def get_user_games(self, user):
-        """Returns a list of active games by the requested user"""
-        games = Game.query(ndb.OR(Game.first_user == user.key,
-                                  Game.second_user == user.key)).filter(Game.game_over == False).fetch()
-        return games
+    def get_user_games(self, user, page_size=None, urlsafe_cursor=None):
+        """Returns a page of active games by the requested user and the urlsafe 
+        cursor of the next page, or None if there are no more games. The keys are 
+        queried and the games read with one batch get, so games are always current 
+        even when the query's index is not"""
+        query = Game.query(Game.players == user.key, Game.game_over == False).order(Game.key)
+        keys, next_cursor = super(GamesService, self).fetch_page(query, page_size or PAGE_SIZE, 
+                                                                 urlsafe_cursor, keys_only=True)
+        games = [game for game in ndb.get_multi(keys) if game and not game.game_over]
+        return games, next_cursor
     
         
+    #-----------------------------------------------------------------------
+    #Migration of games stored by earlier versions of the game
+    #-----------------------------------------------------------------------
+    
+    def migrate_games(self, urlsafe_cursor=None, batch_size=100):
+        """Rewrite a batch of games so that their boards are stored in the compact
+        encoding, their pickled history is moved into the turn log and the user names
+        are copied onto them. Pickled boards are decoded, and the dimensions, matched
+        and flipped cells of boards stored whole are taken from them. The 
+        players are set as the game is put, so saving a game is enough to migrate its 
+        board and players. Returns the urlsafe cursor of the next batch, or None 
+        when done"""
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        batch, next_cursor, more = Game.query().fetch_page(batch_size, start_cursor=cursor)
+        
+        unnamed = [game for game in batch if game.first_user_name is None or game.second_user_name is None]
+        names = super(GamesService, self).get_names([key for game in unnamed for key in (game.first_user, game.second_user)])
+        
+        entities = list(batch)
+        for game in unnamed:
+            game.first_user_name = names.get(game.first_user)
+            game.second_user_name = names.get(game.second_user)
+        for game in batch:
+            game.upgrade_stored_board()
+            if game.history:
+                for turn in game.history:
+                    game.turns += 1
+                    entities.append(GameTurn(parent=game.key, id=game.turns, user=turn.user,
+                                             first_guess=turn.first_guess, second_guess=turn.second_guess,
+                                             match_made=turn.match_made))
+                game.history = None
+        ndb.put_multi(entities)
+        self._cache_delete(*[game.key for game in batch])
+        
+        logging.info("Migrated {0} games".format(len(batch)))
+        return next_cursor.urlsafe() if more and next_cursor else None
+        
     #-----------------------------------------------------------------------
     #Creation of a new game of memory
     #-----------------------------------------------------------------------
    
-    def new_game(self, first_user, second_user):
-        """Creates and returns a new game, persisting to the google datastore"""
-        deck = self._make_carddeck()
+    def new_game(self, first_user, second_user, first_user_name=None, second_user_name=None,
+                 rows=BOARD_ROWS, columns=BOARD_COLUMNS, card_set_size=None):
+        """Creates and returns a new game, persisting to the google datastore. The 
+        user names are copied onto the game, and are fetched if they aren't given"""
+        if first_user_name is None or second_user_name is None:
+            names = super(GamesService, self).get_names([first_user, second_user])
+            first_user_name, second_user_name = names.get(first_user), names.get(second_user)
+        
+        game = self.build_game(first_user, second_user, first_user_name, second_user_name, 
+                               rows, columns, card_set_size)
+        return super(GamesService, self).save(game)
+    
+    def build_game(self, first_user, second_user, first_user_name, second_user_name,
+                   rows=BOARD_ROWS, columns=BOARD_COLUMNS, card_set_size=None, **properties):
+        """Returns a new, unsaved game, so many games can be saved in one batch. The 
+        board's layout is dealt from a random seed kept on the game, with pairs of the 
+        first card_set_size card names, by default every card name. Any other properties, 
+        such as the key, are set on the game"""
+        card_set_size = card_set_size or len(CardNames)
+        self._check_board_size(rows, columns, card_set_size)
         
         #create a new game model and initialise with user details, gridboard
         game = super(GamesService, self).new()
         data = {"first_user": first_user, "second_user": second_user, 
-               "board": self._make_gridboard(deck), "history":[],
-               "unmatched_pairs": len(CardNames), "next_move": first_user}
-         
-        super(GamesService, self).update(game, **data)
-          
+               "first_user_name": first_user_name, "second_user_name": second_user_name, 
+               "seed": new_seed(), "rows": rows, "columns": columns,
+               "card_set_size": card_set_size, "unmatched_pairs": rows * columns // 2, 
+               "next_move": first_user}
+        data.update(properties)
+        for name, value in data.items():
+            setattr(game, name, value)
         return game
     
+    def rekey_users(self, rekeyed):
+        """Rewrite the user keys of games referencing re-keyed users.
+        :param rekeyed: dictionary of old to new user keys
+        """
+        changed = {}
+        for old_key in rekeyed:
+            for game in Game.query(ndb.OR(Game.first_user == old_key, Game.second_user == old_key)):
+                game = changed.setdefault(game.key, game)
+                for name in ('first_user', 'second_user', 'next_move', 'winner', 'loser'):
+                    user_key = getattr(game, name)
+                    setattr(game, name, rekeyed.get(user_key, user_key))
+        ndb.put_multi(changed.values())
+        self._cache_delete(*changed.keys())
+        
+    #-----------------------------------------------------------------------
+    #Reading the turn log and deleting a game along with its turns
+    #-----------------------------------------------------------------------
+    
+    def get_history(self, game):
+        """Returns the turns of a game in the order they were taken. The turn 
+        keys are known from the turn count, so the log is read with one batch get"""
+        keys = [ndb.Key(GameTurn, number, parent=game.key) for number in range(1, game.turns + 1)]
+        turns = [turn for turn in ndb.get_multi(keys) if turn]
+        return (game.history or []) + turns
+    
+    def delete(self, game):
+        """Immediately deletes the game and its turn log"""
+        self._isinstance(game)
+        keys = [ndb.Key(GameTurn, number, parent=game.key) for number in range(1, game.turns + 1)]
+        ndb.delete_multi([game.key] + keys)
+        self._cache_delete(game.key)
+    
+    def _is_cacheable(self, game):
+        """Only active games are kept in memcache"""
+        return not game.game_over
+    
+    #-----------------------------------------------------------------------
+    #Checking the version of a game without reading it
+    #-----------------------------------------------------------------------
+    
+    def is_unchanged(self, urlsafe, version):
+        """Returns true if the game is still at the version, checked against the 
+        version kept in memcache as the game is read, so the game isn't read again.
+        Returns false if the version isn't in memcache, as it is once the game moves"""
+        return memcache.get(self._version_key(self.key_from_urlsafe(urlsafe))) == version
+    
+    def wait_for_change(self, game, timeout=None, version=None):
+        """Waits up to timeout seconds, by default WAIT_TIMEOUT, for the game to change
+        from the version, by default the game's current version. While waiting only the
+        version kept in memcache is checked, at growing intervals, so waiting users 
+        cost a memcache get each check rather than a read of the game. Returns the game,
+        read again if it changed, or None if it was deleted"""
+        version = game.version if version is None else version
+        version_key = self._version_key(game.key)
+        deadline = time.time() + (timeout or WAIT_TIMEOUT)
+        interval = WAIT_INTERVAL
+        while True:
+            current = memcache.get(version_key)
+            if current is None: #the version was evicted, so read the game and keep its version again
+                game = self._reread(game.key)
+                if game is None or game.version != version:
+                    return game
+                memcache.add(version_key, game.version, time=self.__cache_timeout__)
+            elif current != version:
+                return self._reread(game.key)
+            if time.time() + interval > deadline:
+                return game
+            time.sleep(interval)
+            interval = min(interval * 2, WAIT_MAX_INTERVAL)
+    
+    def _reread(self, key):
+        """Read the game again, rather than returning the copy cached in the request's 
+        context. The rest of the request's context is left cached"""
+        return key.get(use_cache=False)
+    
+    def _version_key(self, key):
+        """Returns the memcache key the version of a game is kept under"""
+        return 'version:' + key.urlsafe()
+    
+    def _cache_keys(self, key):
+        """Games are evicted along with their version"""
+        return super(GamesService, self)._cache_keys(key) + [self._version_key(key)]
+    
+    def _cache_values(self, game):
+        """Games read through memcache are kept along with their version"""
+        values = super(GamesService, self)._cache_values(game)
+        values[self._version_key(game.key)] = game.version
+        return values
+    
     #-----------------------------------------------------------------------
     #Private methods handling creation of card deck and gridboard
     #-----------------------------------------------------------------------
     
-    def _make_carddeck(self):
-        """"create a deck of cards with two of each card"""
-        deck = []
-        for name in CardNames:
-            cardOne = Card(card_name=name)
-            cardTwo = Card(card_name=name)
-            deck.append(cardOne)
-            deck.append(cardTwo)
-            
-        logging.info("Completed building card deck {0}".format(deck))
-        return deck
-    
-    def _make_gridboard(self, deck):
-        """"make a gridboard from a deck of cards with random placement"""
-        griddimension = int(math.sqrt(len(deck)))
-        gridboard = [[self._remove_random_card_from_deck(deck) for row in range(griddimension)] for col in range(griddimension)]
-        logging.info("Completed building grid board {0}".format(gridboard))
-        return gridboard
-    
-    def _remove_random_card_from_deck(self, deck):
-        """Select and return a random card, removing it from the deck"""
-        card = random.choice(deck)
-        deck.remove(card)
-        return card
+    def _check_board_size(self, rows, columns, card_set_size):
+        """Raise an exception unless the board can be filled with pairs of cards
+        from a card set no larger than the card names"""
+        if not 0 < rows <= MAX_BOARD_DIMENSION or not 0 < columns <= MAX_BOARD_DIMENSION:
+            raise endpoints.BadRequestException(
+                    'Board rows and columns must be between 1 and {0}'.format(MAX_BOARD_DIMENSION))
+        if rows * columns % 2:
+            raise endpoints.BadRequestException('Board must have an even number of cards')
+        if not 0 < card_set_size <= len(CardNames):
+            raise endpoints.BadRequestException(
+                    'Card set size must be between 1 and {0}'.format(len(CardNames)))
     
     #-----------------------------------------------------------------------
     #Validating a requested move on the gridboard
@@ -143,7 +380,7 @@ class GamesService(Service):
                 return False
          
         # Check that the card has not already been flipped    
-        if game.board[row][column].flipped:
+        if game.is_face_up(row, column):
             if raise_error:
                 raise endpoints.BadRequestException('Card has already been flipped')
             else:
@@ -151,30 +388,34 @@ class GamesService(Service):
         
         return True
     
-    #-----------------------------------------------------------------------
-    #Private methods handling validation of moves on the gridboard
-    #-----------------------------------------------------------------------
-  
-    
-    def _get_max_row_number(self, game):
-        """Returns the maximum row number allowed for the gridboard"""
-        logging.info("Maximum gridboard row number: {0}".format(len(game.board)-1)) 
-        return len(game.board)-1
-    
-    def _get_max_col_number(self, game):
-        """Returns the maximum column number allowed for the gridboard"""
-        if self._get_max_row_number(game) >= 0:
-            logging.info("Maximum gridboard col number: {0}".format(len(game.board[0])-1))
-            return len(game.board[0])-1
-        return 0
+    def is_valid_turn(self, game, first_guess, second_guess, raise_error=True):
+        """Check both guesses of a turn, given as (row, column) pairs, are valid before 
+        either is made. Optionally raise an exception if invalid"""
+        error = None
+        
+        # Check that a turn has not already been begun with a single move
+        if game.firstGuess is not None and game.secondGuess is None:
+            error = 'Finish the turn already begun with one more guess'
+        elif first_guess == second_guess:
+            error = 'Both guesses are the same card'
+        
+        # Check both cards are on the gridboard and will be face down once the 
+        # cards of the last turn are reset, which leaves only the matched cards face up
+        for row, column in (first_guess, second_guess):
+            if error:
+                break
+            if not self._is_on_gridboard(game, row, column):
+                error = 'Requested move is out of grid board boundary'
+            elif game.cell(row, column) in game.matched:
+                error = 'Card has already been flipped'
+        
+        if error and raise_error:
+            raise endpoints.BadRequestException(error)
+        return error is None
     
     def _is_on_gridboard(self, game, row, column):
         """Check if the requested move is actually on the gridboard"""
-        if row < 0 or row > self._get_max_row_number(game):
-            return False
-        if column < 0 or column > self._get_max_col_number(game):
-            return False
-        return True
+        return 0 <= row < game.rows and 0 <= column < game.columns
     
     #-----------------------------------------------------------------------
     #Making an actual move on a grid board
@@ -182,12 +423,50 @@ class GamesService(Service):
     
     def make_move(self, game, row, column, first_user):
         """Make a move on the gridboard by flipping the card located at the row and column"""
-
+        return self.make_move_async(game, row, column, first_user).get_result()
+    
+    def make_move_async(self, game, row, column, first_user):
+        """Make a move on the gridboard by flipping the card located at the row and column.
+        The game is updated immediately and saved asynchronously, returns a future for 
+        the move's message"""
+        message, turns = self.apply_move(game, row, column, first_user)
+        return self._save_move_async(game, message, game.first_user if first_user else game.second_user, *turns)
+    
+    def make_turn(self, game, first_guess, second_guess, first_user):
+        """Make both guesses of a turn, given as (row, column) pairs"""
+        return self.make_turn_async(game, first_guess, second_guess, first_user).get_result()
+    
+    def make_turn_async(self, game, first_guess, second_guess, first_user):
+        """Make both guesses of a turn, given as (row, column) pairs. The game is updated
+        immediately and saved once, asynchronously, returns a future for the turn's message"""
+        message, turns = self.apply_turn(game, first_guess, second_guess, first_user)
+        return self._save_move_async(game, message, game.first_user if first_user else game.second_user, *turns)
+    
+    def apply_turn(self, game, first_guess, second_guess, first_user):
+        """Make both guesses of a turn, given as (row, column) pairs, without saving the 
+        game. Returns the message of the second guess and a list holding the turn to 
+        append to the turn log"""
+        self.apply_move(game, first_guess[0], first_guess[1], first_user)
+        return self.apply_move(game, second_guess[0], second_guess[1], first_user)
+    
+    def apply_move(self, game, row, column, first_user):
+        """Make a move on the gridboard by flipping the card located at the row and column,
+        without saving the game. Returns the move's message and a list holding the turn
+        to append to the turn log, if the move completed a turn"""
+        turn = None
+        game.version += 1
+        
+        #Turn the cards of the last turn face down before a new turn begins, as the
+        #card flipped may be one of them
+        if game.secondGuess is not None:
+            self._reset_gridboard(game)
+            game.firstGuess = game.secondGuess = None
+        
         #First flip the card
-        game.board[row][column].flip()
+        game.flipped.append(game.cell(row, column))
  
         #Make the first guess of this turn
-        if game.firstGuess is None or game.secondGuess is not None:
+        if game.firstGuess is None:
  
             self._make_first_guess(game, row, column)
             message = "One more guess to make"
@@ -196,12 +475,14 @@ class GamesService(Service):
  
             #If the second guess returns true, we have made a match
             if self._make_second_guess(game, row, column) == True:
+                #the pair stays face up for the rest of the game
+                self._match_guesses(game)
                 #add one to the user score
                 self._increment_score(game, first_user)
                 #decrement the number of card pairs left to find
                 game.unmatched_pairs-=1
                 #add the turn to the game history, and clear the cached guesses
-                self._add_history(game, first_user, match_made=True)
+                turn = self._add_history(game, first_user, match_made=True)
                 game.firstGuess = game.secondGuess = None                
                 #Check to see if the game has been completed
                 if game.unmatched_pairs == 0:
@@ -212,31 +493,128 @@ class GamesService(Service):
                     message = "You made a match"
             else: #We didn't make a match, so it is the other players turn
                 game.next_move = game.second_user if first_user else game.first_user
-                
-                # Add a task to the queue to notify the other user that it is their turn
-                taskqueue.add(url='/notify_user_of_turn', params={'user':game.next_move.get().name})    
        
                 #add the turn to the game history
-                self._add_history(game, first_user, match_made=False)  
+                turn = self._add_history(game, first_user, match_made=False)  
                 message = "Not a match"
             
         
-        super(GamesService, self).save(game)
+        return message, ([turn] if turn else [])
+    
+    @ndb.tasklet
+    def _save_move_async(self, game, message, user_key, *turns):
+        """Save a game along with any new turns, returning the move's message. The
+        turn is appended to the turn log in the same batch as the game. Once the 
+        game is saved, the other user is notified if it has become their turn"""
+        yield super(GamesService, self).save_async(game, *turns)
+        self.advance_tournament(game)
+        if self.turn_passed(game, user_key):
+            yield self.notify_turn_async(game)
+        raise ndb.Return(message)
+    
+    #-----------------------------------------------------------------------
+    #Notifying users that it is their turn
+    #-----------------------------------------------------------------------
+    
+    def turn_passed(self, game, user_key):
+        """Returns true if the move made by the user passed the turn to the other user"""
+        return not game.game_over and game.next_move != user_key
+    
+    @ndb.tasklet
+    def notify_turn_async(self, game):
+        """Queue a pull task notifying the user whose move is next that it is their 
+        turn. A memcache marker skips the queue for a user notified in the last
+        NOTIFY_WINDOW seconds, whichever game it was for, and the task is named for the
+        user and window so a duplicate is refused if the marker is lost. The task is 
+        tagged with the user's key. Returns a future for true if a task was queued"""
+        user_urlsafe, game_urlsafe = game.next_move.urlsafe(), game.key.urlsafe()
+        window = int(time.time()) // NOTIFY_WINDOW
+        added = yield ndb.get_context().memcache_add('notify:{0}'.format(user_urlsafe), 
+                                                     window, time=NOTIFY_WINDOW)
+        if not added:
+            raise ndb.Return(False)
         
-        return message
+        task = taskqueue.Task(method='PULL', params={'user_key': user_urlsafe, 'game_key': game_urlsafe},
+                              name='notify-{0}-{1}'.format(user_urlsafe, window), tag=user_urlsafe)
+        try:
+            yield taskqueue.Queue(NOTIFY_QUEUE).add_async(task)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            raise ndb.Return(False)
+        raise ndb.Return(True)
+    
+    def send_turn_digests(self, max_leases=NOTIFY_MAX_LEASES):
+        """Lease the queued turn notifications in bulk and email each user a single
+        digest of every game where it is their turn. The users of a lease are fetched
+        in one batch and their waiting games queried in parallel. A lease's tasks are
+        deleted once its digests are sent, so they are leased again if sending fails. 
+        Returns the number of tasks processed by each lease"""
+        queue = taskqueue.Queue(NOTIFY_QUEUE)
+        processed = []
+        while len(processed) < max_leases:
+            tasks = queue.lease_tasks(NOTIFY_LEASE_SECONDS, NOTIFY_LEASE_SIZE)
+            if not tasks:
+                break
+            if len(tasks) == NOTIFY_LEASE_SIZE:
+                tasks += self._lease_rest(queue, set(task.tag for task in tasks if task.tag))
+            
+            notified = set(ndb.Key(urlsafe=task.extract_params()['user_key']) for task in tasks)
+            recipients = [user for user in ndb.get_multi(notified) if user is not None and user.email]
+            queries = [Game.query(Game.next_move == user.key, Game.game_over == False).fetch_async()
+                       for user in recipients]
+            for user, query in zip(recipients, queries):
+                waiting = sorted(query.get_result(), key=lambda game: game.key)
+                if waiting:
+                    self._send_digest(user, waiting)
+            
+            queue.delete_tasks(tasks)
+            processed.append(len(tasks))
+            logging.info("Processed {0} turn notifications for {1} users".format(len(tasks), len(notified)))
+        return processed
+    
+    def _lease_rest(self, queue, tags):
+        """Lease the tasks left in the queue for each of the tagged users, so a user
+        whose tasks were split by a full lease is still sent a single digest"""
+        tasks = []
+        for tag in tags:
+            leased = NOTIFY_LEASE_SIZE
+            while leased == NOTIFY_LEASE_SIZE:
+                more = queue.lease_tasks_by_tag(NOTIFY_LEASE_SECONDS, NOTIFY_LEASE_SIZE, tag=tag)
+                tasks += more
+                leased = len(more)
+        return tasks
+    
+    def _send_digest(self, user, waiting):
+        """Email the user a digest listing the games where it is their turn"""
+        lines = ['Hello {0}, thanks for playing Memory - it is now your turn in {1} game{2}:'
+                 .format(user.name, len(waiting), '' if len(waiting) == 1 else 's'), '']
+        for game in waiting:
+            opponent = game.second_user if game.first_user == user.key else game.first_user
+            lines.append(' - against {0} (game {1})'.format(game.user_name(opponent), game.key.urlsafe()))
+        mail.send_mail('noreply@{0}.appspotmail.com'.format(app_identity.get_application_id()),
+                       user.email, 'It is your turn!', '\n'.join(lines))
+    
+    def advance_tournament(self, game):
+        """Queue a task advancing the game's tournament once a tournament game is over.
+        Within a transaction the task is only added if the end of the game is committed"""
+        if game.game_over and game.tournament:
+            taskqueue.add(url=TOURNAMENT_URL, params={'tournament_key': game.tournament.urlsafe()},
+                          transactional=ndb.in_transaction())
     
     #-----------------------------------------------------------------------
     #Private methods handling move making on the gridboard
     #-----------------------------------------------------------------------
     
     def _add_history(self, game, first_user, match_made):
-        """When both guesses have been made, add a turn to the game history"""
+        """When both guesses have been made, return a new turn to be appended 
+        to the game's turn log"""
         current_user = game.first_user if first_user else game.second_user
-        turn = Turn(user=current_user.get().name, 
-                    first_guess=str(game.firstGuess), 
-                    second_guess=str(game.secondGuess), 
-                    match_made=match_made)
-        game.history.append(turn)
+        game.turns += 1
+        return GameTurn(parent=game.key,
+                        id=game.turns,
+                        user=self._user_name(game, current_user), 
+                        first_guess=str(game.firstGuess), 
+                        second_guess=str(game.secondGuess), 
+                        match_made=match_made)
     
     def _increment_score(self, game, first_user):
         """Increment the score for a particular user"""
@@ -261,24 +639,17 @@ class GamesService(Service):
         
     def _make_first_guess(self, game, row, column):
         """Make a first guess on the gridboard at the specified row and column"""
-        logging.info("First guess: {0}, Second guess : {1}".format(game.firstGuess, game.firstGuess))
         
-        #reset the gridboard to start a new guess
-        if game.secondGuess is not None:
-            self._reset_gridboard(game)
-            game.firstGuess = game.secondGuess = None
-             
         #you have made a first guess, you have one more guess to make
-        game.firstGuess = Move(game.board[row][column], row, column)
+        game.firstGuess = Move(game.card(row, column), row, column)
         
     def _make_second_guess(self, game, row, column):
         """Make a second guess on the gridboard at the specified row and column
         Return true if the second guess was a match"""
-        logging.info("First guess: {0}, Second guess : {1}".format(game.firstGuess, game.firstGuess))
-        game.secondGuess = Move(game.board[row][column], row, column)
+        game.secondGuess = Move(game.card(row, column), row, column)
         
         #If the first guess matches the selected tile, we have a match
-        if game.firstGuess.card.card_name == game.board[row][column].card_name:
+        if game.firstGuess.card.card_name == game.secondGuess.card.card_name:
                 return True
         
         return False
@@ -286,26 +657,100 @@ class GamesService(Service):
     
     def _reset_gridboard(self, game):
         """Take the cards moved in the first and second guess and reset to not flipped"""
-        card = game.board[game.firstGuess.row][game.firstGuess.col]
-        card.reset()
-        card = game.board[game.secondGuess.row][game.secondGuess.col]
-        card.reset()
+        guesses = self._guess_cells(game)
+        game.flipped = [cell for cell in game.flipped if cell not in guesses]
+    
+    def _match_guesses(self, game):
+        """Move the cards of the first and second guess to the matched cells"""
+        self._reset_gridboard(game)
+        game.matched.extend(self._guess_cells(game))
+    
+    def _guess_cells(self, game):
+        """Returns the cells of the first and second guess"""
+        return [game.cell(game.firstGuess.row, game.firstGuess.col),
+                game.cell(game.secondGuess.row, game.secondGuess.col)]
     
     #-----------------------------------------------------------------------
     #Initialising a form object to return to the user
     #-----------------------------------------------------------------------
     
-    def to_form(self, game, message=""):
-        """Returns a GameForm representation of the Game"""
+    def to_form(self, game, message="", names=None):
+        """Returns a GameForm representation of the Game. Games stored before user
+        names were copied onto them look up their users in names, a dictionary of 
+        user key to name, or fetch them if it isn't given"""
+        if names is None:
+            names = super(GamesService, self).get_names(self._unnamed_users([game]))
         form = GameForm(urlsafe_key=game.key.urlsafe(),
-                        board = str(game.board),
-                        next_move=game.next_move.get().name,
+                        board = game.board_label(),
+                        next_move=game.user_name(game.next_move) or names.get(game.next_move),
                         game_over=game.game_over,
                         message=message,
-                        history=str(game.history),
                         first_user_score=game.first_user_score,
                         second_user_score=game.second_user_score,
-                        unmatched_pairs=game.unmatched_pairs)
+                        unmatched_pairs=game.unmatched_pairs,
+                        version=game.version)
+        if game.winner:
+            form.winner = game.user_name(game.winner) or names.get(game.winner)
+        return form
+    
+    def to_board_form(self, game, message="", names=None):
+        """Returns a GameBoardForm representation of the Game, with the board as
+        the masked code of each cell rather than a string"""
+        if names is None:
+            names = super(GamesService, self).get_names(self._unnamed_users([game]))
+        form = GameBoardForm(urlsafe_key=game.key.urlsafe(),
+                             rows=game.rows,
+                             columns=game.columns,
+                             cells=self.masked_cells(game),
+                             next_move=game.user_name(game.next_move) or names.get(game.next_move),
+                             game_over=game.game_over,
+                             message=message,
+                             first_user_score=game.first_user_score,
+                             second_user_score=game.second_user_score,
+                             unmatched_pairs=game.unmatched_pairs,
+                             version=game.version)
         if game.winner:
-            form.winner = game.winner.get().name
+            form.winner = game.user_name(game.winner) or names.get(game.winner)
         return form
+    
+    def masked_cells(self, game):
+        """Returns the code of each cell of the board, row by row: the number of its
+        card name if the card is face up, or 0 if it is face down. The codes are kept
+        in memcache for each version of the board, so games polled by waiting players
+        aren't rendered again until a card is flipped"""
+        cache_key = self._board_cache_key(game)
+        codes = memcache.get(cache_key)
+        if codes is None:
+            face_up = set(game.matched) | set(game.flipped)
+            codes = str(bytearray(card_name.number if cell in face_up else 0 
+                                  for cell, card_name in enumerate(game.layout)))
+            memcache.set(cache_key, codes, time=self.__cache_timeout__)
+        return list(bytearray(codes))
+    
+    def to_turn_forms(self, turns):
+        """Returns a TurnForms representation of a game's history"""
+        return TurnForms(items=[TurnForm(user=turn.user, first_guess=turn.first_guess, 
+                                         second_guess=turn.second_guess, match_made=turn.match_made)
+                                for turn in turns])
+    
+    def _board_cache_key(self, game):
+        """Returns the memcache key of the masked board, for the game's version"""
+        return 'board:{0}:{1}'.format(game.key.urlsafe(), game.version)
+    
+    def to_forms(self, games, message="", next_cursor=None):
+        """Returns a GameForms representation of a list of games. Any users whose
+        names aren't on the games are fetched with a single batch get"""
+        names = super(GamesService, self).get_names(self._unnamed_users(games))
+        return GameForms(items=[self.to_form(game, message, names) for game in games],
+                         next_cursor=next_cursor)
+    
+    def _unnamed_users(self, games):
+        """Returns the keys of users shown in a form whose names haven't been 
+        copied onto the games"""
+        return [key for game in games for key in (game.next_move, game.winner)
+                if key and not game.user_name(key)]
+    
+    def _user_name(self, game, user_key):
+        """Returns the name of one of the game's users, fetching the user only
+        if the name hasn't been copied onto the game"""
+        return game.user_name(user_key) or user_key.get().name
@@ -12,22 +12,28 @@ class StringMessage(messages.Message):
     message = messages.StringField(1, required=True)
 
 class GameForm(messages.Message):
-    """GameForm for outbound game state information"""
+    """GameForm for outbound game state information. When the game is unchanged 
+    since the version a client already has, only the key, version and message 
+    are returned and unchanged is set"""
     urlsafe_key = messages.StringField(1, required=True)
-    board = messages.StringField(2, required=True)
-    next_move = messages.StringField(3, required=True)
-    game_over = messages.BooleanField(4, required=True)
-    unmatched_pairs = messages.IntegerField(5, required=True)
-    first_user_score = messages.IntegerField(6, required=True)
-    second_user_score = messages.IntegerField(7, required=True)
+    board = messages.StringField(2)
+    next_move = messages.StringField(3)
+    game_over = messages.BooleanField(4)
+    unmatched_pairs = messages.IntegerField(5)
+    first_user_score = messages.IntegerField(6)
+    second_user_score = messages.IntegerField(7)
     message = messages.StringField(8, required=True)
     winner = messages.StringField(9)
-    history = messages.StringField(10)
+    version = messages.IntegerField(10, variant=messages.Variant.INT32)
+    unchanged = messages.BooleanField(11)
     
 class NewGameForm(messages.Message):
     """Used to create a new game"""
     first_user = messages.StringField(1, required=True)
     second_user = messages.StringField(2, required=True)
+    rows = messages.IntegerField(3)
+    columns = messages.IntegerField(4)
+    card_set_size = messages.IntegerField(5)
     
 class ScoreForm(messages.Message):
     """ScoreForm for outbound Score information"""
@@ -40,6 +46,7 @@ class ScoreForm(messages.Message):
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 class MakeMoveForm(messages.Message):
     """Used to make a move in an existing game"""
@@ -47,7 +54,44 @@ class MakeMoveForm(messages.Message):
     row = messages.IntegerField(2, required=True)
     column = messages.IntegerField(3, required=True)
     
+class MakeTurnForm(messages.Message):
+    """Used to make both guesses of a turn in an existing game"""
+    name = messages.StringField(1, required=True)
+    first_row = messages.IntegerField(2, required=True)
+    first_column = messages.IntegerField(3, required=True)
+    second_row = messages.IntegerField(4, required=True)
+    second_column = messages.IntegerField(5, required=True)
+    
 class GameForms(messages.Message):
-    """Container for multiple GameForm"""
+    """Container for multiple GameForm. A batch of games requested by key lists the
+    keys of games that weren't found"""
     items = messages.MessageField(GameForm, 1, repeated=True)
-    
\ No newline at end of file
+    next_cursor = messages.StringField(2)
+    not_found = messages.StringField(3, repeated=True)
+    
+class GameBoardForm(messages.Message):
+    """GameForm with the board as a list of cell codes, row by row. A cell's code 
+    is the number of its card name, or 0 if the card is face down"""
+    urlsafe_key = messages.StringField(1, required=True)
+    rows = messages.IntegerField(2, required=True, variant=messages.Variant.INT32)
+    columns = messages.IntegerField(3, required=True, variant=messages.Variant.INT32)
+    cells = messages.IntegerField(4, repeated=True, variant=messages.Variant.INT32)
+    next_move = messages.StringField(5, required=True)
+    game_over = messages.BooleanField(6, required=True)
+    unmatched_pairs = messages.IntegerField(7, required=True)
+    first_user_score = messages.IntegerField(8, required=True)
+    second_user_score = messages.IntegerField(9, required=True)
+    message = messages.StringField(10, required=True)
+    winner = messages.StringField(11)
+    version = messages.IntegerField(12, variant=messages.Variant.INT32)
+
+class TurnForm(messages.Message):
+    """A turn in a game's history"""
+    user = messages.StringField(1, required=True)
+    first_guess = messages.StringField(2)
+    second_guess = messages.StringField(3)
+    match_made = messages.BooleanField(4, required=True)
+
+class TurnForms(messages.Message):
+    """Return multiple TurnForms"""
+    items = messages.MessageField(TurnForm, 1, repeated=True)
@@ -8,13 +8,60 @@ Created on 18/03/2016
 from protorpc import messages
 from google.appengine.ext import ndb
 from config import DEBUG
+import pickle
+import random
+import struct
+
+#Header of an encoded gridboard: magic, codec version, number of rows, number of columns
+BOARD_MAGIC = 'MB'
+BOARD_CODEC_VERSION = 1
+BOARD_HEADER = struct.Struct('>2sBHH')
+
+#The bits of the seed a board's layout is dealt from. Seeds are drawn from the operating
+#system's random source, so a board's layout can't be found by trying seeds from a 
+#predictable generator
+SEED_BITS = 64
+SEED_RANDOM = random.SystemRandom()
+
+class BoardProperty(ndb.BlobProperty):
+    """Stores a gridboard of Cards as a compact blob rather than a pickle. 
+    Boards pickled by earlier versions of the game are still readable, and are 
+    rewritten in the compact encoding the next time the game is saved"""
+    
+    def _validate(self, value):
+        if not isinstance(value, list):
+            raise TypeError('Expected a list of rows of cards, got %r' % (value,))
+    
+    def _to_base_type(self, value):
+        return encode_board(value)
+    
+    def _from_base_type(self, value):
+        return decode_board(value)
+
+class SeedProperty(ndb.IntegerProperty):
+    """Stores an unsigned seed of SEED_BITS bits as a signed integer, to fit in the 
+    datastore. Seeds stored by earlier versions are smaller and read back unchanged"""
+    
+    def _to_base_type(self, value):
+        return value - 2 ** SEED_BITS if value >= 2 ** (SEED_BITS - 1) else value
+    
+    def _from_base_type(self, value):
+        return value % 2 ** SEED_BITS
 
 class Game(ndb.Model):
     """Game object"""
-    board = ndb.PickleProperty(required=True)
+    seed = SeedProperty(indexed=False) # The seed the board's layout is dealt from
+    rows = ndb.IntegerProperty(indexed=False)
+    columns = ndb.IntegerProperty(indexed=False)
+    card_set_size = ndb.IntegerProperty(indexed=False) # The number of card names dealt in pairs
+    matched = ndb.IntegerProperty(repeated=True, indexed=False) # Cells of the cards found in pairs
+    flipped = ndb.IntegerProperty(repeated=True, indexed=False) # Cells of the cards flipped in the current turn
+    stored_board = BoardProperty('board') # Boards stored whole by earlier versions, rather than dealt from the seed
     next_move = ndb.KeyProperty(required=True) # The User's whose turn it is
     first_user = ndb.KeyProperty(required=True, kind='User')
     second_user = ndb.KeyProperty(required=True, kind='User')
+    first_user_name = ndb.StringProperty(indexed=False) # Names copied from the users when the game is created
+    second_user_name = ndb.StringProperty(indexed=False)
     first_user_score = ndb.IntegerProperty(default=0)
     second_user_score = ndb.IntegerProperty(default=0)
     unmatched_pairs = ndb.IntegerProperty(default=0)
@@ -23,15 +70,134 @@ class Game(ndb.Model):
     loser = ndb.KeyProperty()
     firstGuess = ndb.PickleProperty()
     secondGuess = ndb.PickleProperty()
-    history = ndb.PickleProperty(required=True)
+    turns = ndb.IntegerProperty(default=0) # The number of turns in the turn log
+    history = ndb.PickleProperty() # Turns pickled by earlier versions, moved to the turn log on migration
+    players = ndb.KeyProperty(kind='User', repeated=True) # Both users, so a user's games are found with one indexed query
+    tournament = ndb.KeyProperty(kind='Tournament') # The tournament the game was scheduled by, if any
+    round = ndb.IntegerProperty(indexed=False) # The tournament round, starting at 1
+    version = ndb.IntegerProperty(default=0, indexed=False) # Bumped by every move, so clients can tell if the game has changed
+    
+    _layout = None
+    
+    @classmethod
+    def _post_get_hook(cls, key, future):
+        """Games are upgraded from boards stored whole as they are got by key, games
+        read by a query are upgraded by the layout or once migrated"""
+        game = future.get_result()
+        if game is not None:
+            game.upgrade_stored_board()
+    
+    def _pre_put_hook(self):
+        """Keep the players in step with the first and second users"""
+        self.players = [self.first_user, self.second_user]
+    
+    #-----------------------------------------------------------------------
+    #The gridboard, an immutable layout of cards with the matched and flipped cells
+    #-----------------------------------------------------------------------
+    
+    @property
+    def layout(self):
+        """Returns the card names of the board's cells, row by row"""
+        if self.stored_board is not None:
+            self.upgrade_stored_board()
+            return [card.card_name for row in self.stored_board for card in row]
+        if self._layout is None:
+            self._layout = deal_layout(self.seed, self.rows * self.columns, self.card_set_size)
+        return self._layout
+    
+    @property
+    def board(self):
+        """Returns the gridboard as rows of Cards, showing which cards are face up"""
+        layout, face_up = self.layout, set(self.matched) | set(self.flipped)
+        return [[self._card(layout, row * self.columns + column, face_up) for column in range(self.columns)]
+                for row in range(self.rows)]
+    
+    @board.setter
+    def board(self, board):
+        """Replace the layout with a fixed board of Cards, as stored by earlier 
+        versions of the game"""
+        self.stored_board = board
+        self.rows = None
+        self.upgrade_stored_board()
+    
+    def board_label(self):
+        """Returns the gridboard as shown in a GameForm, the string of its rows of 
+        Cards, without making a Card for each cell"""
+        layout, face_up = self.layout, set(self.matched) | set(self.flipped)
+        labels = [card_label(card_name, cell in face_up) for cell, card_name in enumerate(layout)]
+        return '[{0}]'.format(', '.join('[{0}]'.format(', '.join(labels[row * self.columns:(row + 1) * self.columns]))
+                                        for row in range(self.rows)))
+    
+    def cell(self, row, column):
+        """Returns the number of the cell at the row and column"""
+        return row * self.columns + column
+    
+    def card(self, row, column):
+        """Returns the Card at the row and column"""
+        return self._card(self.layout, self.cell(row, column), set(self.matched) | set(self.flipped))
+    
+    def is_face_up(self, row, column):
+        """Returns true if the card at the row and column has been flipped or matched"""
+        cell = self.cell(row, column)
+        return cell in self.flipped or cell in self.matched
+    
+    def _card(self, layout, cell, face_up):
+        card = Card(card_name=layout[cell])
+        card.flipped = cell in face_up
+        return card
+    
+    def upgrade_stored_board(self):
+        """Take the dimensions, matched and flipped cells of a board stored whole. 
+        Face up cards are matched unless they are a guess of the current turn"""
+        if self.rows is not None or self.stored_board is None:
+            return
+        self.rows = len(self.stored_board)
+        self.columns = len(self.stored_board[0]) if self.rows else 0
+        guesses = set(self.cell(guess.row, guess.col) for guess in (self.firstGuess, self.secondGuess) if guess)
+        face_up = [self.cell(row, column) for row in range(self.rows) for column in range(self.columns)
+                   if self.stored_board[row][column].flipped]
+        self.matched = [cell for cell in face_up if cell not in guesses]
+        self.flipped = [cell for cell in face_up if cell in guesses]
+    
+    def user_name(self, user_key):
+        """Returns the name of one of the game's users without fetching the user,
+        or None if the name has not been copied onto the game"""
+        if user_key == self.first_user:
+            return self.first_user_name
+        if user_key == self.second_user:
+            return self.second_user_name
+        return None
+
+class GameTurn(ndb.Model):
+    """A user's turn in the game of memory. Turns are stored as children of their
+    game, keyed by the turn number starting at 1, so they are written once and
+    never rewritten"""
+    user = ndb.StringProperty(required=True, indexed=False)
+    first_guess = ndb.StringProperty(indexed=False)
+    second_guess = ndb.StringProperty(indexed=False)
+    match_made = ndb.BooleanProperty(required=True, indexed=False)
+    
+    def __repr__(self):
+        return "{0}:{1}:{2}:{3}".format(self.user, self.first_guess, self.second_guess, self.match_made)    
+       
+    def __str__(self):
+        return "{0}:{1}:{2}:{3}".format(self.user, self.first_guess, self.second_guess, self.match_made)    
     
 class Score(ndb.Model):
     """Score object"""
     date = ndb.DateProperty(required=True)
     winner = ndb.KeyProperty(required=True)
     loser = ndb.KeyProperty(required=True)
+    winner_name = ndb.StringProperty(indexed=False) # Names copied from the users when the score is created
+    loser_name = ndb.StringProperty(indexed=False)
     winner_score = ndb.IntegerProperty(default=0)
     loser_score = ndb.IntegerProperty(default=0)
+    created = ndb.DateTimeProperty() # When the score was recorded, so a user's scores are listed newest first
+    participants = ndb.KeyProperty(kind='User', repeated=True) # The winner and loser, so a user's scores are found with one indexed query
+    
+    def _pre_put_hook(self):
+        """Keep the participants in step with the winner and loser"""
+        self.participants = [self.winner, self.loser]
 
 class CardNames(messages.Enum):
     """The names of the cards to be used in the memory game"""
@@ -45,7 +211,8 @@ class CardNames(messages.Enum):
     FOOL = 8
 
 class Turn():
-    """"A user's turn in the game of memory"""
+    """"A user's turn in the game of memory, as pickled in the history of games
+    stored by earlier versions"""
     def __init__(self, user, first_guess, second_guess, match_made):
         self.user = user
         self.first_guess = first_guess
@@ -84,15 +251,79 @@ class Card():
         self.flipped = not self.flipped
     
     def __repr__(self):
-        if DEBUG:
-            return "{0}:{1}".format(self.card_name.name, self.flipped)
-        else:    
-            return "{0}".format(self.card_name if self.flipped else "XXX")
+        return card_label(self.card_name, self.flipped)
         
     def __str__(self):
-        if DEBUG:
-            return "{0}:{1}".format(self.card_name.name, self.flipped)
-        else:    
-            return "{0}".format(self.card_name if self.flipped else "XXX")
+        return card_label(self.card_name, self.flipped)
+
+def card_label(card_name, flipped):
+    """Returns a card as shown on the gridboard, its name only once it is flipped"""
+    if DEBUG:
+        return "{0}:{1}".format(card_name.name, flipped)
+    else:    
+        return "{0}".format(card_name if flipped else "XXX")
+
+
+#-----------------------------------------------------------------------
+#Dealing the layout of a gridboard
+#-----------------------------------------------------------------------
+
+def deal_layout(seed, cells, card_set_size):
+    """Returns the card names of a board's cells, row by row. Pairs of the first
+    card_set_size card names are dealt in turn until the cells are filled, then 
+    shuffled by a random number generator seeded with seed, so the same seed 
+    always deals the same layout"""
+    card_set = sorted(CardNames, key=lambda card_name: card_name.number)[:card_set_size]
+    deck = [card_set[pair % card_set_size] for pair in range(cells // 2) for _ in range(2)]
+    random.Random(seed).shuffle(deck)
+    return deck
+
+def new_seed():
+    """Returns a random seed to deal a new board's layout from"""
+    return SEED_RANDOM.getrandbits(SEED_BITS)
+
+#-----------------------------------------------------------------------
+#Compact encoding of a gridboard
+#-----------------------------------------------------------------------
+
+#Card names indexed by their number, so decoding doesn't search the enum
+CARDS_BY_ID = dict((card_name.number, card_name) for card_name in CardNames)
+
+def encode_board(board):
+    """Encode a gridboard as a header holding the board dimensions, one byte
+    per card id (row by row) and a bitset of the flipped cards"""
+    rows = len(board)
+    columns = len(board[0]) if rows else 0
+    cards = [card for row in board for card in row]
+    
+    card_ids = bytearray(card.card_name.number for card in cards)
+    flipped = bytearray((len(cards) + 7) // 8)
+    for index, card in enumerate(cards):
+        if card.flipped:
+            flipped[index >> 3] |= 1 << (index & 7)
     
+    return BOARD_HEADER.pack(BOARD_MAGIC, BOARD_CODEC_VERSION, rows, columns) + str(card_ids) + str(flipped)
 
+def decode_board(value):
+    """Decode a gridboard created by encode_board. Falls back to unpickling
+    boards stored before the compact encoding was introduced"""
+    if not value.startswith(BOARD_MAGIC):
+        return pickle.loads(value)
+    
+    magic, version, rows, columns = BOARD_HEADER.unpack_from(value)
+    if version != BOARD_CODEC_VERSION:
+        raise ValueError('Unknown board codec version {0}'.format(version))
+    
+    size = rows * columns
+    card_ids = bytearray(value[BOARD_HEADER.size:BOARD_HEADER.size + size])
+    flipped = bytearray(value[BOARD_HEADER.size + size:])
+    
+    board = []
+    for row in range(rows):
+        cards = []
+        for index in range(row * columns, (row + 1) * columns):
+            card = Card(card_name=CARDS_BY_ID[card_ids[index]])
+            card.flipped = bool(flipped[index >> 3] & (1 << (index & 7)))
+            cards.append(card)
+        board.append(cards)
+    return board
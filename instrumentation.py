@@ -0,0 +1,161 @@
+'''
+Created on 18/10/2026
+
+Instrumentation module recording the latency of service calls and api endpoints,
+the datastore and memcache RPCs they make and the pickled size of saved entities.
+
+Statistics are kept in memory by each instance, so they are cheap enough to
+record on every call, and are reported by the admin stats handler. Each endpoint
+call also writes a single structured log line with its latency and RPC counts.
+
+@author: thurstonemerson
+'''
+import functools
+import json
+import logging
+import pickle
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+#Upper bounds of the latency histogram buckets in milliseconds, the last bucket is unbounded
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+#Upper bounds of the entity size histogram buckets in bytes
+SIZE_BUCKETS = (256, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+#The services whose RPCs are counted
+COUNTED_SERVICES = ('datastore_v3', 'memcache')
+#One in this many saved entities is pickled to record its size
+SIZE_SAMPLE_RATE = 10
+
+class Histogram(object):
+    """Counts values into fixed buckets, keeping their total so the mean is known"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the bucket holding the fraction of values,
+        or None if that is the unbounded bucket"""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def to_dict(self):
+        return {'count': self.count,
+                'mean': float(self.total) / self.count if self.count else 0,
+                'p50': self.percentile(0.5),
+                'p95': self.percentile(0.95),
+                'p99': self.percentile(0.99),
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['inf'], self.counts))}
+
+
+class Stats(object):
+    """Statistics recorded by this instance since it started or was reset"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.latency = {}
+            self.rpcs = {}
+            self.entity_sizes = {}
+            self.saves = 0
+
+    def record_latency(self, name, milliseconds):
+        with self.lock:
+            self.latency.setdefault(name, Histogram(LATENCY_BUCKETS)).add(milliseconds)
+
+    def record_rpc(self, service, call):
+        name = '{0}.{1}'.format(service, call)
+        with self.lock:
+            self.rpcs[name] = self.rpcs.get(name, 0) + 1
+        request_rpcs = getattr(self.local, 'rpcs', None)
+        if request_rpcs is not None:
+            request_rpcs[name] = request_rpcs.get(name, 0) + 1
+
+    def record_save(self, model):
+        """Record the pickled size of one in every SIZE_SAMPLE_RATE saved entities"""
+        with self.lock:
+            self.saves += 1
+            if self.saves % SIZE_SAMPLE_RATE:
+                return
+        size = len(pickle.dumps(model, pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            self.entity_sizes.setdefault(model.__class__.__name__, Histogram(SIZE_BUCKETS)).add(size)
+
+    def to_dict(self):
+        with self.lock:
+            return {'latency_ms': dict((name, histogram.to_dict()) for name, histogram in self.latency.items()),
+                    'rpcs': dict(self.rpcs),
+                    'entity_bytes': dict((kind, histogram.to_dict()) for kind, histogram in self.entity_sizes.items())}
+
+#: The statistics of this instance
+stats = Stats()
+
+def install():
+    """Count the RPCs made to the counted services. The hook is added to the
+    current api proxy, and is only added once"""
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('instrumentation', _count_rpc)
+
+def _count_rpc(service, call, request, response):
+    if service in COUNTED_SERVICES:
+        stats.record_rpc(service, call)
+
+def timed(func):
+    """Decorate a service method to record its latency under the name of the
+    service class and method"""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        install()
+        start = time.time()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            stats.record_latency('{0}.{1}'.format(self.__class__.__name__, func.__name__),
+                                 (time.time() - start) * 1000)
+    return wrapper
+
+def instrumented(func):
+    """Decorate an api endpoint to record its latency and write a structured log
+    line with the latency and RPCs of the call"""
+    @functools.wraps(func)
+    def wrapper(self, request):
+        install()
+        name = '{0}.{1}'.format(self.__class__.__name__, func.__name__)
+        stats.local.rpcs = {}
+        start = time.time()
+        status = 'ok'
+        try:
+            return func(self, request)
+        except Exception, e:
+            status = e.__class__.__name__
+            raise
+        finally:
+            milliseconds = (time.time() - start) * 1000
+            stats.record_latency(name, milliseconds)
+            logging.info('stats ' + json.dumps({'endpoint': name, 'status': status,
+                                                'latency_ms': round(milliseconds, 2),
+                                                'rpcs': stats.local.rpcs}, sort_keys=True))
+            stats.local.rpcs = None
+    return wrapper
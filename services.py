@@ -9,6 +9,7 @@ Create the service instances required for interacting with the ndb.model classes
 from games import GamesService
 from games import ScoreService
 from users import UsersService
+from tournaments import TournamentService
 
 
 #: An instance of the :class:`GamesService` class
@@ -20,4 +21,5 @@ users = UsersService()
 #: An instance of the :class:`ScoreService` class
 scores = ScoreService()
 
-
+#: An instance of the :class:`TournamentService` class, creating games with the games service
+tournaments = TournamentService(games)
@@ -1,19 +1,24 @@
 """
 This module contains handlers that are called by taskqueue and/orcronjobs.
 """
+import json
 import logging
 
 import webapp2
-from google.appengine.api import mail, app_identity
+from google.appengine.api import mail, app_identity, taskqueue
 
-from services import users
+from services import users, games, scores, tournaments
 
 
 class NotifyUserOfTurn(webapp2.RequestHandler):
     def post(self):
-        """Send an email to a user to notify them of their turn"""
+        """Send an email to a user to notify them of their turn. Turns are now notified
+        by the digest, this handles the push tasks queued by earlier versions"""
         app_id = app_identity.get_application_id()
-        user = users.get_by_name(self.request.get('user'))
+        if self.request.get('user_key'):
+            user = users.get_by_key(users.key_from_urlsafe(self.request.get('user_key')))
+        else: #tasks queued by earlier versions name the user
+            user = users.get_by_name(self.request.get('user'))
         
         if user:
             if user.email:
@@ -26,10 +31,65 @@ class NotifyUserOfTurn(webapp2.RequestHandler):
                            subject,
                            body)
         else: #lets not throw an exception, just log the error
-            logging.debug("Unable to find user {0}".format(self.request.get('user')))
+            logging.debug("Unable to find user {0}".format(self.request.get('user_key') or self.request.get('user')))
+        
+
+class SendTurnDigests(webapp2.RequestHandler):
+    def get(self):
+        """Email each user a digest of the games where it is their turn, run by cron 
+        every NOTIFY_WINDOW seconds. Reports the number of tasks processed by each lease"""
+        processed = games.send_turn_digests()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'tasks_per_lease': processed}))
+
+
+class AdvanceTournament(webapp2.RequestHandler):
+    def post(self):
+        """Schedule the next round of a tournament once the games of its current round 
+        are over, queued as each of its games ends"""
+        tournaments.advance(tournaments.key_from_urlsafe(self.request.get('tournament_key')))
+
+
+class MigrateGames(webapp2.RequestHandler):
+    def post(self):
+        """Migrate a batch of games stored by earlier versions, queueing 
+        a task for the next batch until all games are migrated"""
+        cursor = games.migrate_games(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/migrate/games', params={'cursor':cursor})
+        else:
+            logging.info("Finished migrating games")
+            
+            
+class MigrateScores(webapp2.RequestHandler):
+    def post(self):
+        """Copy the user names onto a batch of scores stored by earlier versions, 
+        queueing a task for the next batch until all scores are migrated"""
+        cursor = scores.migrate_scores(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/migrate/scores', params={'cursor':cursor})
+        else:
+            logging.info("Finished migrating scores")
+            
+
+class RekeyUsers(webapp2.RequestHandler):
+    def post(self):
+        """Re-key a batch of users by their normalized name, rewriting the user 
+        keys held by games and scores. Queues a task for the next batch until 
+        all users are re-keyed"""
+        cursor = users.rekey_users(self.request.get('cursor') or None, references=(games, scores))
+        if cursor:
+            taskqueue.add(url='/migrate/users', params={'cursor':cursor})
+        else:
+            logging.info("Finished re-keying users")
         
 
 app = webapp2.WSGIApplication([
     ('/notify_user_of_turn', NotifyUserOfTurn),
+    ('/notify/digest', SendTurnDigests),
+    ('/tournaments/advance', AdvanceTournament),
+    ('/migrate/games', MigrateGames),
+    ('/migrate/scores', MigrateScores),
+    ('/migrate/users', RekeyUsers),
 ], debug=True)
 
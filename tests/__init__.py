@@ -7,7 +7,9 @@ Base testing module, sets up/tears down the sqllite database configuration and t
 import yaml
 import unittest
 import os 
+import collections
 
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.ext import ndb
 from google.appengine.ext import testbed
 
@@ -23,10 +25,23 @@ class MemoryGameUnitTest(unittest.TestCase):
         # Next, declare which service stubs you want to use.
         self.testbed.init_datastore_v3_stub()
         self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.testbed.init_mail_stub()
+        self.mail_stub = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
         # Clear ndb's in-context cache between tests.
         ndb.get_context().clear_cache()
         
     
+    def count_rpcs(self, service='datastore_v3'):
+        """Start counting the RPCs made to a service stub. Returns a Counter of 
+        the number of calls made to each of the service's methods"""
+        rpcs = collections.Counter()
+        def hook(service, call, request, response):
+            rpcs[call] += 1
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('count_rpcs_{0}_{1}'.format(service, id(rpcs)), hook, service)
+        return rpcs
+    
     def tearDown(self):
         """Tear down the test bed by deactivating it"""
         self.testbed.deactivate()
@@ -9,12 +9,13 @@ Functional testing module for game api using WebTest library.
 import webtest
 import endpoints
 
-from mock import patch
 from datetime import date
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
 from users.models import User
 from games.models import Card, CardNames, Score
 from services import games, scores
-from api.games import GameApi
+from api.games import GameApi, MAKE_MOVE_REQUEST
 from tests import MemoryGameUnitTest
 
 class GameApiTest(MemoryGameUnitTest):
@@ -36,6 +37,12 @@ class GameApiTest(MemoryGameUnitTest):
         game = games.new_game(first_user.key, second_user.key)
         return (game, first_user, second_user) 
     
+    def _reload(self, game):
+        """Moves are made in a transaction on a fresh copy of the game, so read back
+        the game from the datastore to see their effect"""
+        ndb.get_context().clear_cache()
+        return game.key.get()
+    
     def _get_new_game_with_mock_gridboard(self):
         (game, first_user, second_user) = self._get_new_game()  
         gridboard = [[Card(card_name=CardNames.DEATH), Card(card_name=CardNames.FOOL), Card(card_name=CardNames.DEATH), Card(card_name=CardNames.HIGH_PRIESTESS)],
@@ -66,7 +73,7 @@ class GameApiTest(MemoryGameUnitTest):
         self.assertEqual(resp.json['unmatched_pairs'], "8")
         self.assertEqual(resp.json['first_user_score'], "0")
         self.assertEqual(resp.json['second_user_score'], "0")
-        self.assertEqual(resp.json['history'], "[]")
+        self.assertNotIn('history', resp.json)
         
         #test user not found
         request = {"first_user":"", "second_user":""} 
@@ -76,6 +83,16 @@ class GameApiTest(MemoryGameUnitTest):
         request = {"first_user":first_user.name, "second_user":first_user.name} 
         self.assertRaises(Exception, testapp.post_json, api_call, request)
         
+        #test a larger board
+        request = {"first_user":first_user.name, "second_user":second_user.name, 
+                   "rows":8, "columns":6, "card_set_size":3} 
+        resp = testapp.post_json(api_call, request)
+        self.assertEqual(resp.json['unmatched_pairs'], "24")
+        
+        #test a board with an odd number of cards
+        request = {"first_user":first_user.name, "second_user":second_user.name, "rows":5, "columns":5} 
+        self.assertRaises(Exception, testapp.post_json, api_call, request)
+        
     def test_get_game(self):
         """Functional test for api call to get an existing game"""
         #create the api 
@@ -96,10 +113,113 @@ class GameApiTest(MemoryGameUnitTest):
         self.assertEqual(resp.json['unmatched_pairs'], "8")
         self.assertEqual(resp.json['first_user_score'], "0")
         self.assertEqual(resp.json['second_user_score'], "0")
-        self.assertEqual(resp.json['history'], "[]")
+        self.assertNotIn('history', resp.json)
+        
+    def test_get_game_unchanged(self):
+        """Functional test for api call to poll a game with a known version"""
+        api_call = '/_ah/spi/GameApi.get_game'
+        testapp = webtest.TestApp(endpoints.api_server([GameApi], restricted=False))
+        game, first_user, second_user = self._get_new_game()
+        
+        #test the unchanged game is not read once its version is kept in memcache
+        ndb.get_context().clear_cache()
+        games.get_by_urlsafe(game.key.urlsafe())
+        rpcs = self.count_rpcs()
+        resp = testapp.post_json(api_call, {"urlsafe_game_key":game.key.urlsafe(), "version":0})
+        self.assertTrue(resp.json['unchanged'])
+        self.assertNotIn('board', resp.json)
+        self.assertEqual(sum(rpcs.values()), 0)
+        
+        #test a move, made in a transaction, changes the version
+        testapp.post_json('/_ah/spi/GameApi.make_move', {"urlsafe_game_key":game.key.urlsafe(), 
+                                                         "name":first_user.name, "row":0, "column":0})
+        ndb.get_context().clear_cache()
+        resp = testapp.post_json(api_call, {"urlsafe_game_key":game.key.urlsafe(), "version":0})
+        self.assertNotIn('unchanged', resp.json)
+        self.assertEqual(resp.json['version'], 1)
+        resp = testapp.post_json(api_call, {"urlsafe_game_key":game.key.urlsafe(), "version":1})
+        self.assertTrue(resp.json['unchanged'])
+        
+        #test a game evicted from memcache is read once, and kept along with its version
+        memcache.delete_multi(['cache:' + game.key.urlsafe(), 'version:' + game.key.urlsafe()])
+        ndb.get_context().clear_cache()
+        rpcs = self.count_rpcs()
+        resp = testapp.post_json(api_call, {"urlsafe_game_key":game.key.urlsafe(), "version":1})
+        self.assertNotIn('unchanged', resp.json)
+        self.assertEqual(rpcs['Get'], 1)
+        resp = testapp.post_json(api_call, {"urlsafe_game_key":game.key.urlsafe(), "version":1})
+        self.assertTrue(resp.json['unchanged'])
+        self.assertEqual(rpcs['Get'], 1)
+        
+    def test_wait_for_turn(self):
+        """Functional test for api call to wait for the other user to move"""
+        api_call = '/_ah/spi/GameApi.wait_for_turn'
+        testapp = webtest.TestApp(endpoints.api_server([GameApi], restricted=False))
+        game, first_user, second_user = self._get_new_game()
+        
+        #test the user whose turn it is doesn't wait
+        resp = testapp.post_json(api_call, {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name})
+        self.assertEqual(resp.json['message'], "It's your turn!")
+        self.assertTrue(resp.json['unchanged'])
+        
+        #test the other user waits until the timeout, or returns once the game has moved on
+        request = {"urlsafe_game_key":game.key.urlsafe(), "name":second_user.name, "timeout":1}
+        resp = testapp.post_json(api_call, request)
+        self.assertEqual(resp.json['message'], "Still waiting for the other user")
+        self.assertTrue(resp.json['unchanged'])
+        games.make_move(game, 0, 0, True)
+        request['version'] = 0
+        resp = testapp.post_json(api_call, request)
+        self.assertEqual(resp.json['version'], 1)
+        self.assertNotIn('unchanged', resp.json)
+        
+        #test the timeout is bounded and only the game's users can wait
+        request['timeout'] = 60
+        self.assertRaises(Exception, testapp.post_json, api_call, request)
+        resp = testapp.post_json(api_call, {"urlsafe_game_key":game.key.urlsafe()}, status=400)
+        self.assertIn('A User name is required!', resp.body)
+        self.assertRaises(Exception, testapp.post_json, api_call, 
+                          {"urlsafe_game_key":game.key.urlsafe(), "name":"nobody"})
+        
+    def test_get_games(self):
+        """Functional test for api call to get a batch of games"""
+        testapp = webtest.TestApp(endpoints.api_server([GameApi], restricted=False))
+        game, first_user, second_user = self._get_new_game()
+        other_game = games.new_game(first_user.key, second_user.key)
+        deleted_game = games.new_game(first_user.key, second_user.key)
+        games.delete(deleted_game)
+        
+        keys = [game.key.urlsafe(), deleted_game.key.urlsafe(), other_game.key.urlsafe()]
+        resp = testapp.post_json('/_ah/spi/GameApi.get_games', {"urlsafe_game_keys":keys})
+        self.assertEqual([item['urlsafe_key'] for item in resp.json['items']], [keys[0], keys[2]])
+        self.assertEqual(resp.json['not_found'], [keys[1]])
+        
+        #test keys of another kind are rejected
+        self.assertRaises(Exception, testapp.post_json, '/_ah/spi/GameApi.get_games', 
+                          {"urlsafe_game_keys":[first_user.key.urlsafe()]})
+        
+    def test_get_game_board_and_turns(self):
+        """Functional test for api calls to get the structured board and history of a game"""
+        testapp = webtest.TestApp(endpoints.api_server([GameApi], restricted=False))
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        games.make_move(game, 0, 0, True) #DEATH
+        games.make_move(game, 0, 1, True) #FOOL
+        
+        request = {"urlsafe_game_key":game.key.urlsafe()} 
+        resp = testapp.post_json('/_ah/spi/GameApi.get_game_board', request)
+        self.assertEqual(resp.json['rows'], 4)
+        self.assertEqual(resp.json['columns'], 4)
+        self.assertEqual(resp.json['cells'], [CardNames.DEATH.number, CardNames.FOOL.number] + [0] * 14)
+        self.assertEqual(resp.json['next_move'], second_user.name)
+        
+        resp = testapp.post_json('/_ah/spi/GameApi.get_game_turns', request)
+        self.assertEqual(resp.json['items'], [{"user":first_user.name, "first_guess":"DEATH:0:0", 
+                                               "second_guess":"FOOL:0:1", "match_made":False}])
         
-    @patch('games.taskqueue')
-    def test_make_move_no_match(self, mock_taskqueue):
+        request = {"urlsafe_game_key":game.key.urlsafe()[:-4]} 
+        self.assertRaises(Exception, testapp.post_json, '/_ah/spi/GameApi.get_game_board', request)
+        
+    def test_make_move_no_match(self):
         """Functional test for api call to make a move"""
         #create the api 
         api_call = '/_ah/spi/GameApi.make_move'
@@ -116,17 +236,19 @@ class GameApiTest(MemoryGameUnitTest):
         self.assertEqual(resp.json['message'], "One more guess to make")
           
         #test card is flipped
-        self.assertTrue(game.board[0][0].flipped)
+        self.assertTrue(self._reload(game).board[0][0].flipped)
         
         #make the second move, flip FOOL. Test match wasn't made.
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":1} 
         resp = testapp.post_json(api_call, request)
         self.assertEqual(resp.json['message'], "Not a match")  
-        self.assertTrue(game.board[0][1].flipped)
-        self.assertTrue(resp.json['history'], "[good golly:DEATH:0:0:FOOL:0:1:False]")
+        self.assertTrue(self._reload(game).board[0][1].flipped)
+        
+        #test the turn is appended to the game history
+        resp = testapp.post_json('/_ah/spi/GameApi.get_game_history', {"urlsafe_game_key":game.key.urlsafe()})
+        self.assertEqual(resp.json['message'], "[good golly:DEATH:0:0:FOOL:0:1:False]")
     
-    @patch('games.taskqueue')
-    def test_make_move_made_match(self, mock_taskqueue):
+    def test_make_move_made_match(self):
         """Functional test for api call to make a move"""
         #create the api 
         api_call = '/_ah/spi/GameApi.make_move'
@@ -143,24 +265,68 @@ class GameApiTest(MemoryGameUnitTest):
         self.assertEqual(resp.json['message'], "One more guess to make")
           
         #test card is flipped
-        self.assertTrue(game.board[0][0].flipped)
+        self.assertTrue(self._reload(game).board[0][0].flipped)
         
         #make the second move, flip DEATH. Test match is made.
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":2} 
         resp = testapp.post_json(api_call, request)
         self.assertEqual(resp.json['message'], "You made a match")  
-        self.assertTrue(game.board[0][2].flipped)
-        self.assertTrue(resp.json['history'], "[good golly:DEATH:0:0:DEATH:0:2:True]")    
+        self.assertTrue(self._reload(game).board[0][2].flipped)
+        history_request = {"urlsafe_game_key":game.key.urlsafe()}
+        resp = testapp.post_json('/_ah/spi/GameApi.get_game_history', history_request)
+        self.assertEqual(resp.json['message'], "[good golly:DEATH:0:0:DEATH:0:2:True]")    
         
         #test game history with two moves
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":3, "column":3} 
         resp = testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":3, "column":2} 
         resp = testapp.post_json(api_call, request)
-        self.assertEqual(resp.json['history'], "[good golly:DEATH:0:0:DEATH:0:2:True, good golly:HERMIT:3:3:TEMPERANCE:3:2:False]")  
+        resp = testapp.post_json('/_ah/spi/GameApi.get_game_history', history_request)
+        self.assertEqual(resp.json['message'], "[good golly:DEATH:0:0:DEATH:0:2:True, good golly:HERMIT:3:3:TEMPERANCE:3:2:False]")  
+      
+    def test_make_turn(self):
+        """Functional test for api call to make both guesses of a turn"""
+        #create the api 
+        api_call = '/_ah/spi/GameApi.make_turn'
+        app = endpoints.api_server([GameApi], restricted=False)
+        testapp = webtest.TestApp(app)
+        
+        #create a new game with a mock gridboard
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        
+        #flip DEATH and DEATH, test the match is made with a single write of the game
+        rpcs = self.count_rpcs()
+        request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,
+                   "first_row":0, "first_column":0, "second_row":0, "second_column":2} 
+        resp = testapp.post_json(api_call, request)
+        self.assertEqual(resp.json['message'], "You made a match")
+        self.assertEqual(rpcs['Put'], 1)
+        game = self._reload(game)
+        self.assertEqual(game.first_user_score, 1)
+        self.assertTrue(game.board[0][0].flipped)
+        self.assertTrue(game.board[0][2].flipped)
+        
+        #test a turn can't flip the same card twice or a matched card
+        request.update(first_row=1, first_column=1, second_row=1, second_column=1)
+        self.assertRaises(Exception, testapp.post_json, api_call, request)
+        request.update(second_row=0, second_column=0)
+        self.assertRaises(Exception, testapp.post_json, api_call, request)
+        
+        #flip HERMIT and TEMPERANCE, test the turn passes to the other user
+        request.update(first_row=3, first_column=3, second_row=3, second_column=2)
+        resp = testapp.post_json(api_call, request)
+        self.assertEqual(resp.json['message'], "Not a match")
+        resp = testapp.post_json('/_ah/spi/GameApi.get_game_history', {"urlsafe_game_key":game.key.urlsafe()})
+        self.assertEqual(resp.json['message'], "[good golly:DEATH:0:0:DEATH:0:2:True, good golly:HERMIT:3:3:TEMPERANCE:3:2:False]")
+        
+        #test the other user's turn can flip the cards of the missed turn
+        request = {"urlsafe_game_key":game.key.urlsafe(), "name":second_user.name,
+                   "first_row":3, "first_column":3, "second_row":2, "second_column":2} 
+        resp = testapp.post_json(api_call, request)
+        self.assertEqual(resp.json['message'], "You made a match")
+        self.assertEqual(self._reload(game).second_user_score, 1)
       
-    @patch('games.taskqueue')   
-    def test_make_move_game_not_found(self, mock_taskqueue):
+    def test_make_move_game_not_found(self):
         """Functional test for api call to make a move"""
         #create the api 
         api_call = '/_ah/spi/GameApi.make_move'
@@ -178,8 +344,7 @@ class GameApiTest(MemoryGameUnitTest):
         request = {"urlsafe_game_key":"asadfdsf", "name":first_user.name,  "row":0, "column":1} 
         self.assertRaises(Exception, testapp.post_json, api_call, request)
        
-    @patch('games.taskqueue')
-    def test_make_move_game_already_over(self, mock_taskqueue):
+    def test_make_move_game_already_over(self):
         """Functional test for api call to make a move"""
         #create the api 
         api_call = '/_ah/spi/GameApi.make_move'
@@ -196,8 +361,7 @@ class GameApiTest(MemoryGameUnitTest):
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":1} 
         self.assertRaises(Exception, testapp.post_json, api_call, request)
        
-    @patch('games.taskqueue')
-    def test_make_move_invalid_move(self, mock_taskqueue):
+    def test_make_move_invalid_move(self):
         """Functional test for api call to make a move"""
         #create the api 
         api_call = '/_ah/spi/GameApi.make_move'
@@ -213,14 +377,14 @@ class GameApiTest(MemoryGameUnitTest):
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":4, "column":0} 
         self.assertRaises(Exception, testapp.post_json, api_call, request)
        
-        game.board[0][0].flip()
+        game.flipped.append(game.cell(0, 0))
+        game.put()
        
         #test exception raised if card already flipped
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":0} 
         self.assertRaises(Exception, testapp.post_json, api_call, request)
        
-    @patch('games.taskqueue') 
-    def test_make_move_winner_loser_score(self, mock_taskqueue):
+    def test_make_move_winner_loser_score(self):
         """Functional test for api call to make a move"""
         #create the api 
         api_call = '/_ah/spi/GameApi.make_move'
@@ -235,49 +399,49 @@ class GameApiTest(MemoryGameUnitTest):
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":2} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)
+        self.assertFalse(self._reload(game).game_over)
             
         #FOOL
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":1} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":2, "column":1} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)
+        self.assertFalse(self._reload(game).game_over)
           
         #HIGH_PRIESTESS
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":3} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":1, "column":2} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over) 
+        self.assertFalse(self._reload(game).game_over) 
           
         #HANGED_MAN
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":1, "column":0} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":3, "column":1} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over) 
+        self.assertFalse(self._reload(game).game_over) 
           
         #TEMPERANCE
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":1, "column":1} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":3, "column":2} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)   
+        self.assertFalse(self._reload(game).game_over)   
           
         #LOVERS
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":1, "column":3} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":2, "column":3} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)   
+        self.assertFalse(self._reload(game).game_over)   
           
         #JUSTICE
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":2, "column":0} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":3, "column":0} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)
+        self.assertFalse(self._reload(game).game_over)
           
         #HERMIT
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":3, "column":3} 
@@ -286,6 +450,7 @@ class GameApiTest(MemoryGameUnitTest):
         testapp.post_json(api_call, request)
           
         #test game is ended when all pairs are found
+        game = self._reload(game)
         self.assertTrue(game.game_over)  
          
         #test correct winner and loser are assigned
@@ -300,8 +465,7 @@ class GameApiTest(MemoryGameUnitTest):
         self.assertEqual(score.loser_score, game.second_user_score)
         self.assertEqual(score.date, date.today())
         
-    @patch('games.taskqueue')
-    def test_make_move_draw(self, mock_taskqueue):
+    def test_make_move_draw(self):
         """Functional test for api call to make a move"""
         #create the api 
         api_call = '/_ah/spi/GameApi.make_move'
@@ -316,29 +480,30 @@ class GameApiTest(MemoryGameUnitTest):
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":2} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)
+        self.assertFalse(self._reload(game).game_over)
           
         #FOOL
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":1} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":2, "column":1} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)
+        self.assertFalse(self._reload(game).game_over)
         
         #HIGH_PRIESTESS
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":3} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":1, "column":2} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over) 
+        self.assertFalse(self._reload(game).game_over) 
         
         #HANGED_MAN
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":1, "column":0} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":3, "column":1} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over) 
+        self.assertFalse(self._reload(game).game_over) 
         
+        game = self._reload(game)
         game.next_move = second_user.key
         game.put()
         
@@ -347,21 +512,21 @@ class GameApiTest(MemoryGameUnitTest):
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":second_user.name,  "row":3, "column":2} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)   
+        self.assertFalse(self._reload(game).game_over)   
         
         #LOVERS
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":second_user.name,  "row":1, "column":3} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":second_user.name,  "row":2, "column":3} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)   
+        self.assertFalse(self._reload(game).game_over)   
         
         #JUSTICE
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":second_user.name,  "row":2, "column":0} 
         testapp.post_json(api_call, request)
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":second_user.name,  "row":3, "column":0} 
         testapp.post_json(api_call, request)
-        self.assertFalse(game.game_over)
+        self.assertFalse(self._reload(game).game_over)
         
         #HERMIT, test an exception is thrown stating game is a draw
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":second_user.name,  "row":3, "column":3} 
@@ -369,6 +534,52 @@ class GameApiTest(MemoryGameUnitTest):
         request = {"urlsafe_game_key":game.key.urlsafe(), "name":second_user.name,  "row":2, "column":2} 
         self.assertRaises(Exception, testapp.post_json, api_call, request)
     
+    def test_make_move_contention(self):
+        """Test that concurrent moves on one game are retried rather than lost"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        api = GameApi()
+        
+        #make two moves on the same game at the same time, the second to commit is retried
+        requests = [MAKE_MOVE_REQUEST.combined_message_class(urlsafe_game_key=game.key.urlsafe(), 
+                                                             name=first_user.name, row=0, column=column)
+                    for column in (0, 2)]
+        futures = [api._make_move_async(request, (request.row, request.column)) for request in requests]
+        ndb.Future.wait_all(futures)
+        messages = sorted(future.get_result().message for future in futures)
+        self.assertEqual(messages, ["One more guess to make", "You made a match"])
+        
+        #test neither move was lost
+        game = self._reload(game)
+        self.assertTrue(game.board[0][0].flipped)
+        self.assertTrue(game.board[0][2].flipped)
+        self.assertEqual(game.first_user_score, 1)
+        self.assertEqual(game.turns, 1)
+        
+    def test_make_move_game_over_single_commit(self):
+        """Test that the writes made at the end of a game are committed in one batch"""
+        (game, first_user, second_user) = self._get_new_game()
+        game.board = [[Card(card_name=CardNames.DEATH), Card(card_name=CardNames.DEATH)]]
+        game.unmatched_pairs = 1
+        game.put()
+        
+        api_call = '/_ah/spi/GameApi.make_move'
+        testapp = webtest.TestApp(endpoints.api_server([GameApi], restricted=False))
+        request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":0} 
+        testapp.post_json(api_call, request)
+        
+        rpcs = self.count_rpcs()
+        request = {"urlsafe_game_key":game.key.urlsafe(), "name":first_user.name,  "row":0, "column":1} 
+        resp = testapp.post_json(api_call, request)
+        self.assertEqual(resp.json['message'], "Game over")
+        
+        #the game, turn, winner, loser and score are written with one put and one commit
+        self.assertEqual(rpcs['Put'], 1)
+        self.assertEqual(rpcs['Commit'], 1)
+        ndb.get_context().clear_cache()
+        self.assertEqual(User.key_for_name(first_user.name).get().wins, 1)
+        self.assertEqual(User.key_for_name(second_user.name).get().total_played, 1)
+        self.assertEqual(Score.query().count(), 1)
+        
     def test_get_user_scores(self):
         """Functional test for api call to retrieve user scores"""
         #create the api 
@@ -402,4 +613,18 @@ class GameApiTest(MemoryGameUnitTest):
         self.assertEquals(resp.json['items'][0]['winner_score'], "3")
         self.assertEquals(resp.json['items'][0]['loser'], player_two.name)
         self.assertEquals(resp.json['items'][0]['loser_score'], "2")
+        
+        #test scores paged
+        scores.new_score(winner=player_two.key, loser=player_one.key, first_user_score=3, second_user_score=2)
+        request = {"name":player_two.name, "page_size":1} 
+        resp = testapp.post_json(api_call, request)
+        self.assertEqual(len(resp.json['items']), 1)
+        
+        request["cursor"] = resp.json['next_cursor']
+        resp = testapp.post_json(api_call, request)
+        self.assertEqual(len(resp.json['items']), 1)
+        self.assertNotIn('next_cursor', resp.json)
+        
+        request = {"name":player_two.name, "page_size":0} 
+        self.assertRaises(Exception, testapp.post_json, api_call, request)
       
@@ -0,0 +1,43 @@
+'''
+Created on 18/10/2026
+
+Functional testing module for tournament api using WebTest library.
+
+@author: thurstonemerson
+'''
+
+import webtest
+import endpoints
+
+from users.models import User
+from api.tournaments import TournamentApi
+from api.games import GameApi
+from tests import MemoryGameUnitTest
+
+
+class TournamentApiTest(MemoryGameUnitTest):
+
+    def test_new_tournament(self):
+        """Functional test for api calls to create and find a tournament"""
+        app = endpoints.api_server([TournamentApi, GameApi], restricted=False)
+        testapp = webtest.TestApp(app)
+        for name in ("good golly", "my mummy", "oh my"):
+            User(name=name).put()
+
+        request = {"name":"open", "players":["good golly", "my mummy", "oh my"], "format":"SINGLE_ELIMINATION"}
+        resp = testapp.post_json('/_ah/spi/TournamentApi.new_tournament', request)
+        self.assertEqual(resp.json['round'], '1')
+        self.assertEqual(resp.json['players'], ["good golly", "my mummy", "oh my"])
+        self.assertEqual(len(resp.json['games']), 1)
+
+        resp = testapp.post_json('/_ah/spi/TournamentApi.get_tournament', {"urlsafe_tournament_key":resp.json['urlsafe_key']})
+        self.assertEqual(resp.json['name'], "open")
+        self.assertEqual(resp.json['format'], "SINGLE_ELIMINATION")
+
+        #test tournament games can't be canceled
+        self.assertRaises(Exception, testapp.post_json, '/_ah/spi/GameApi.cancel_game', 
+                          {"urlsafe_game_key":resp.json['games'][0]})
+
+        #test unknown players are rejected
+        request['players'].append("nobody")
+        self.assertRaises(Exception, testapp.post_json, '/_ah/spi/TournamentApi.new_tournament', request)
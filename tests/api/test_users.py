@@ -16,6 +16,19 @@ from tests import MemoryGameUnitTest
  
 class UserApiTest(MemoryGameUnitTest):
      
+    def test_create_user(self):
+        """Test that a user can be created, and that user names must be unique"""
+        
+        api_call = '/_ah/spi/UserApi.create_user'
+        app = endpoints.api_server([UserApi], restricted=False)
+        testapp = webtest.TestApp(app)
+        
+        resp = testapp.post_json(api_call, {"name":"good golly", "email":"generic@thingy.com"})
+        self.assertEquals(resp.json['message'], "User good golly created!")
+        self.assertEquals(User.key_for_name("good golly").get().email, "generic@thingy.com")
+        
+        #test a name differing only by case is rejected
+        self.assertRaises(Exception, testapp.post_json, api_call, {"name":"Good Golly"})
      
     def test_get_user_rankings(self):
         """Test that you are able to retrieve a list of all users ranked by win percentage"""
@@ -47,3 +60,9 @@ class UserApiTest(MemoryGameUnitTest):
         self.assertEquals(resp.json['items'][0]['wins'], "1")
         self.assertEquals(resp.json['items'][0]['total_played'], "1")
         self.assertEquals(resp.json['items'][0]['win_percentage'], 1)
+        
+        #test a page is at most 100 users, starting within the top 1000
+        self.assertEqual(len(testapp.post_json(api_call, {"limit":100}).json['items']), 2)
+        self.assertRaises(Exception, testapp.post_json, api_call, {"limit":101})
+        self.assertRaises(Exception, testapp.post_json, api_call, {"offset":1001})
+        self.assertRaises(Exception, testapp.post_json, api_call, {"offset":-1})
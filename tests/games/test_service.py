@@ -10,10 +10,16 @@ from tests import MemoryGameUnitTest
 
 from services import games, scores
 from users.models import User
-from games.models import CardNames, Card
+from games.models import CardNames, Card, Game, GameTurn, Turn, Score, encode_board, decode_board, deal_layout, SEED_BITS
+from datetime import date, datetime
+from google.appengine.ext import ndb
+from google.appengine.api import memcache, taskqueue
 from mock import patch
 
 import endpoints
+import pickle
+import threading
+import time
  
 
 class GameTest(MemoryGameUnitTest):
@@ -58,7 +64,8 @@ class GameTest(MemoryGameUnitTest):
         self.assertEqual(game.second_user_score, 0)
         self.assertEqual(game.unmatched_pairs, len(CardNames))
         self.assertEqual(game.next_move, first_user.key)
-        self.assertEqual(game.history, [])
+        self.assertEqual(game.turns, 0)
+        self.assertEqual(games.get_history(game), [])
         self.assertFalse(game.game_over)
         self.assertIsNone(game.winner)
         self.assertIsNone(game.loser)
@@ -80,6 +87,137 @@ class GameTest(MemoryGameUnitTest):
                         
             self.assertEqual(num, 2, "There must be 2 {0} in the card deck, only contains {1}".format(card_name, num))
                     
+    def test_board_dealt_from_seed(self):
+        """Test that a game's board can be dealt again from its seed"""
+        (game, first_user, second_user) = self._get_new_game()
+        self.assertIsNotNone(game.seed)
+        
+        layout = deal_layout(game.seed, 16, len(CardNames))
+        self.assertEqual(layout, [card.card_name for row in game.key.get().board for card in row])
+        
+    def test_new_game_seed(self):
+        """Test that a new game's seed is drawn from the full range of seeds, and that 
+        a seed too large for a signed datastore integer is read back unchanged"""
+        first_user, second_user = self._get_two_players()
+        game = games.new_game(first_user.key, second_user.key)
+        self.assertTrue(0 <= game.seed < 2 ** SEED_BITS)
+        self.assertEqual(game.key.get(use_cache=False).seed, game.seed)
+        
+        game.seed = 2 ** SEED_BITS - 1
+        game.put()
+        self.assertEqual(game.key.get(use_cache=False, use_memcache=False).seed, 2 ** SEED_BITS - 1)
+        
+    def test_board_encoding(self):
+        """Test that a gridboard stored whole survives a round trip through the 
+        datastore, with its face up cards taken as matched"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        board = game.board
+        board[1][2].flip()
+        board[3][0].flip()
+        game.board = board
+        game.put()
+        ndb.get_context().clear_cache()
+        
+        stored = game.key.get()
+        self.assertEqual(len(stored.board), 4)
+        self.assertEqual(sorted(stored.matched), [6, 12])
+        for row in range(4):
+            for col in range(4):
+                self.assertEqual(stored.board[row][col].card_name, game.board[row][col].card_name)
+                self.assertEqual(stored.board[row][col].flipped, (row, col) in [(1, 2), (3, 0)])
+                
+        #test the encoding is one byte per card plus a flipped bitset and header
+        self.assertEqual(len(encode_board(game.board)), 7 + 16 + 2)
+        
+        #test a board stored whole by an earlier version is upgraded as the game is got,
+        #and by the migration for games read by a query
+        game.rows = game.columns = None
+        game.matched = []
+        game.put()
+        ndb.get_context().clear_cache()
+        self.assertIsNone(Game.query().get().rows)
+        ndb.get_context().clear_cache()
+        self.assertEqual(game.key.get().rows, 4)
+        ndb.get_context().clear_cache()
+        self.assertIsNone(games.migrate_games())
+        ndb.get_context().clear_cache()
+        self.assertEqual(sorted(Game.query().get().matched), [6, 12])
+        
+    def test_board_label(self):
+        """Test that the board of a GameForm is shown as the string of its rows of Cards"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        games.make_move(game, 0, 0, True)
+        games.make_move(game, 0, 2, True)
+        games.make_move(game, 1, 1, True)
+        self.assertEqual(games.to_form(game).board, str(game.board))
+        self.assertEqual(game.board_label().count('XXX'), 13)
+        
+    def test_large_board(self):
+        """Test that a large, non-square board is dealt from its seed and that a 
+        move stores only the cells it flips"""
+        first_user, second_user = self._get_two_players()
+        game = games.new_game(first_user.key, second_user.key, rows=64, columns=32, card_set_size=4)
+        self.assertEqual(game.unmatched_pairs, 64 * 32 // 2)
+        self.assertIsNone(game.stored_board)
+        
+        ndb.get_context().clear_cache()
+        game = game.key.get()
+        self.assertEqual((len(game.board), len(game.board[0])), (64, 32))
+        self.assertEqual(set(game.layout), set([CardNames.DEATH, CardNames.TEMPERANCE, 
+                                                CardNames.HIGH_PRIESTESS, CardNames.HERMIT]))
+        
+        self.assertTrue(games.is_valid_move(game, 63, 31))
+        self.assertFalse(games.is_valid_move(game, 64, 0, False))
+        self.assertFalse(games.is_valid_move(game, 0, 32, False))
+        games.make_move(game, 63, 31, True)
+        self.assertEqual(game.key.get().flipped, [game.cell(63, 31)])
+        self.assertFalse(games.is_valid_move(game, 63, 31, False))
+        
+        #test boards that can't be filled with pairs are refused
+        self.assertRaises(endpoints.BadRequestException, games.new_game, first_user.key, second_user.key, rows=3, columns=3)
+        self.assertRaises(endpoints.BadRequestException, games.new_game, first_user.key, second_user.key, rows=0, columns=4)
+        self.assertRaises(endpoints.BadRequestException, games.new_game, first_user.key, second_user.key, card_set_size=9)
+        
+    def test_decode_pickled_board(self):
+        """Test that boards pickled by earlier versions can still be read and migrated"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        board = game.board
+        board[0][0].flip()
+        
+        board = decode_board(pickle.dumps(board, 2))
+        self.assertEqual(board[0][1].card_name, CardNames.FOOL)
+        self.assertTrue(board[0][0].flipped)
+        self.assertFalse(board[0][1].flipped)
+        
+        #test the migration rewrites every game
+        self.assertIsNone(games.migrate_games())
+        self.assertEqual(Game.query().count(), 1)
+        
+    def test_migrate_pickled_history(self):
+        """Test that history pickled by earlier versions is moved into the turn log"""
+        (game, first_user, second_user) = self._get_new_game()
+        game.history = [Turn(first_user.name, "DEATH:0:0", "FOOL:0:1", False)]
+        game.put()
+        
+        self.assertIsNone(games.migrate_games())
+        game = game.key.get()
+        self.assertIsNone(game.history)
+        self.assertEqual(game.turns, 1)
+        self.assertEqual(str(games.get_history(game)), "[good golly:DEATH:0:0:FOOL:0:1:False]")
+        
+    def test_migrate_players(self):
+        """Test that games stored before the players were recorded are found once migrated"""
+        (game, first_user, second_user) = self._get_new_game()
+        self.assertEqual(game.players, [first_user.key, second_user.key])
+        with patch.object(Game, '_pre_put_hook'):
+            game.players = []
+            game.put()
+        self.assertEqual(games.get_user_games(second_user), ([], None))
+        
+        self.assertIsNone(games.migrate_games())
+        user_games, next_cursor = games.get_user_games(second_user)
+        self.assertEqual([user_game.key for user_game in user_games], [game.key])
+        
     def test_get_by_urlsafe(self):  
         """Testing retrieval of game by name and urlsafemode"""     
         (game, first_user, second_user) = self._get_new_game()       
@@ -89,6 +227,126 @@ class GameTest(MemoryGameUnitTest):
         self.assertRaises(endpoints.BadRequestException, games.get_by_urlsafe, "")
         self.assertRaises(ValueError, games.get_by_urlsafe, first_user.key.urlsafe())           
             
+    def test_get_multi_by_urlsafe(self):
+        """Test that a batch of games is read through memcache with one batch get of each"""
+        (game, first_user, second_user) = self._get_new_game()
+        uncached_game = games.new_game(first_user.key, second_user.key)
+        deleted_game = games.new_game(first_user.key, second_user.key)
+        games.delete(deleted_game)
+        memcache.delete('cache:' + uncached_game.key.urlsafe())
+        ndb.get_context().clear_cache()
+        
+        rpcs, memcache_rpcs = self.count_rpcs(), self.count_rpcs('memcache')
+        found = games.get_multi_by_urlsafe([key.urlsafe() for key in (game.key, uncached_game.key, deleted_game.key)])
+        self.assertEqual([model and model.key for model in found], [game.key, uncached_game.key, None])
+        self.assertEqual(rpcs['Get'], 1)
+        self.assertEqual(memcache_rpcs['Get'], 1)
+        
+        #test every key is validated before any are read
+        self.assertRaises(endpoints.BadRequestException, games.get_multi_by_urlsafe, [game.key.urlsafe(), ""])
+        self.assertRaises(endpoints.BadRequestException, games.get_multi_by_urlsafe, 
+                          [game.key.urlsafe(), first_user.key.urlsafe()])
+        
+    def test_game_cache(self):
+        """Test that active games are read through memcache, and evicted when saved or deleted"""
+        (game, first_user, second_user) = self._get_new_game()
+        ndb.get_context().clear_cache()
+        hits, misses = games.cache_stats['hits'], games.cache_stats['misses']
+        
+        #the new game is read through memcache once, then found there
+        self.assertEqual(games.get_by_urlsafe(game.key.urlsafe()).key, game.key)
+        ndb.get_context().clear_cache()
+        self.assertEqual(games.get_by_urlsafe(game.key.urlsafe()).key, game.key)
+        self.assertEqual(games.cache_stats['hits'], hits + 1)
+        self.assertEqual(games.cache_stats['misses'], misses + 1)
+        
+        #a saved game is evicted rather than written through, along with its version
+        games.make_move(game, 0, 0, True)
+        self.assertIsNone(memcache.get('cache:' + game.key.urlsafe()))
+        self.assertIsNone(memcache.get('version:' + game.key.urlsafe()))
+        ndb.get_context().clear_cache()
+        self.assertEqual(games.get_by_urlsafe(game.key.urlsafe()).version, 1)
+        self.assertEqual(games.cache_stats['misses'], misses + 2)
+        
+        #a deleted game is evicted and no longer found
+        games.delete(game)
+        ndb.get_context().clear_cache()
+        self.assertIsNone(games.get_by_urlsafe(game.key.urlsafe()))
+        self.assertEqual(games.cache_stats['misses'], misses + 3)
+        
+    def test_game_version(self):
+        """Test that moves bump the game's version, which is checked without reading the game"""
+        (game, first_user, second_user) = self._get_new_game()
+        self.assertEqual(game.version, 0)
+        self.assertFalse(games.is_unchanged(game.key.urlsafe(), 0))
+        ndb.get_context().clear_cache()
+        games.get_by_urlsafe(game.key.urlsafe())
+        self.assertTrue(games.is_unchanged(game.key.urlsafe(), 0))
+        
+        #a move evicts the version, which is kept again once the game is read
+        games.make_move(game, 0, 0, True)
+        self.assertFalse(games.is_unchanged(game.key.urlsafe(), 0))
+        ndb.get_context().clear_cache()
+        self.assertEqual(games.get_by_urlsafe(game.key.urlsafe()).version, 1)
+        rpcs = self.count_rpcs()
+        self.assertFalse(games.is_unchanged(game.key.urlsafe(), 0))
+        self.assertTrue(games.is_unchanged(game.key.urlsafe(), 1))
+        self.assertEqual(sum(rpcs.values()), 0)
+        
+        #a deleted game's version is evicted
+        games.delete(game)
+        self.assertFalse(games.is_unchanged(game.key.urlsafe(), 1))
+        
+    def test_wait_for_change(self):
+        """Test that concurrent waiters are all woken by a move, and time out otherwise"""
+        (game, first_user, second_user) = self._get_new_game()
+        games.make_move(game, 0, 0, True)
+        waited = {}
+        
+        def wait(number):
+            started = time.time()
+            waiting = game.key.get(use_cache=False, use_memcache=False)
+            changed = games.wait_for_change(waiting, timeout=5, version=1)
+            waited[number] = (changed.version, time.time() - started)
+        
+        #the waiters are each woken when the move is saved, well before their timeout
+        waiters = [threading.Thread(target=wait, args=(number,)) for number in range(8)]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.3)
+        games.make_move(game, 0, 1, True)
+        for waiter in waiters:
+            waiter.join()
+        self.assertEqual(len(waited), 8)
+        for version, seconds in waited.values():
+            self.assertEqual(version, 2)
+            self.assertLess(seconds, 3)
+        
+        #an unchanged game is returned once the timeout is reached
+        started = time.time()
+        self.assertIs(games.wait_for_change(game, timeout=1), game)
+        self.assertLessEqual(time.time() - started, 1.1)
+        
+        #a waiter whose version was evicted reads the game once to check it, leaving
+        #the rest of the request's context cached
+        first_user.key.get()
+        memcache.flush_all()
+        rpcs = self.count_rpcs()
+        self.assertEqual(games.wait_for_change(game, timeout=1, version=1).version, 2)
+        self.assertEqual(rpcs['Get'], 1)
+        self.assertIsNotNone(first_user.key.get(use_datastore=False, use_memcache=False))
+        
+    def test_finished_games_not_cached(self):
+        """Test that a finished game is evicted from memcache when saved"""
+        (game, first_user, second_user) = self._get_new_game()
+        game.game_over = True
+        games.save(game)
+        ndb.get_context().clear_cache()
+        misses = games.cache_stats['misses']
+        
+        self.assertTrue(games.get_by_urlsafe(game.key.urlsafe()).game_over)
+        self.assertEqual(games.cache_stats['misses'], misses + 1)
+        
     def test_get_user_games(self):
         """Test that active games of a user can be retrieved""" 
         (game_one, first_user, second_user) = self._get_new_game("first user", "second user") 
@@ -96,22 +354,46 @@ class GameTest(MemoryGameUnitTest):
         game_one.put()
         
         #zero games returned because the user has no active games
-        self.assertEqual(len(games.get_user_games(first_user)), 0)
+        self.assertEqual(games.get_user_games(first_user), ([], None))
         
         #add an active game
         games.new_game(first_user.key, second_user.key)
         
         #one game returned
-        self.assertEqual(len(games.get_user_games(first_user)), 1)
+        user_games, next_cursor = games.get_user_games(first_user)
+        self.assertEqual(len(user_games), 1)
+        self.assertIsNone(next_cursor)
+        
+    def test_get_user_games_paged(self):
+        """Test that a user's games are returned a page at a time"""
+        (game, first_user, second_user) = self._get_new_game("first user", "second user")
+        for _ in range(4):
+            games.new_game(second_user.key, first_user.key)
+        
+        seen = []
+        user_games, next_cursor = games.get_user_games(first_user, page_size=2)
+        while next_cursor:
+            self.assertEqual(len(user_games), 2)
+            seen.extend(user_games)
+            user_games, next_cursor = games.get_user_games(first_user, 2, next_cursor)
+        seen.extend(user_games)
+        self.assertEqual(len(set(game.key for game in seen)), 5)
+        
+        self.assertRaises(endpoints.BadRequestException, games.get_user_games, first_user, 2, 'not a cursor')
         
     def test_delete_game(self):
         """Test that games are able to be deleted via the games service"""
-        (game, first_user, second_user) = self._get_new_game()
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        games.make_move(game, 0, 0, True)
+        games.make_move(game, 0, 1, True)
            
         try:
             games.delete(game)
         except Exception:
             self.fail("Delete game failed unexpectedly")
+        
+        #test the turn log is deleted with the game
+        self.assertEqual(GameTurn.query(ancestor=game.key).count(), 0)
           
         
     def test_is_valid_move(self):  
@@ -125,7 +407,7 @@ class GameTest(MemoryGameUnitTest):
         self.assertRaises(endpoints.BadRequestException, games.is_valid_move, game, 0, -1)
            
         #test that move where card is already flipped is invalid
-        game.board[3][3].flip()
+        game.flipped.append(game.cell(3, 3))
         game.put()
         self.assertRaises(endpoints.BadRequestException, games.is_valid_move, game, 3, 3)
         
@@ -159,7 +441,6 @@ class GameTest(MemoryGameUnitTest):
         self.assertEqual(game.second_user_score, game_form.second_user_score)
         self.assertEqual(message, game_form.message)
         self.assertEqual(game.winner, game_form.winner)
-        self.assertEqual("[]", game_form.history)
         
         #test winner if true
         game.winner = first_user.key
@@ -173,8 +454,68 @@ class GameTest(MemoryGameUnitTest):
         game_form = games.to_form(game, message)
         self.assertEqual(second_user.name, game_form.next_move)
         
-    @patch('games.taskqueue')
-    def test_make_move_game_ended(self, mock_taskqueue): 
+    def test_masked_cells(self):
+        """Test that the masked board is rendered once for each version of the board"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        self.assertEqual(games.masked_cells(game), [0] * 16)
+        
+        #the board is served from memcache, without the layout being dealt or read
+        with patch.object(Game, 'layout') as mock_layout:
+            self.assertEqual(games.masked_cells(game), [0] * 16)
+            self.assertEqual(games.to_board_form(game).cells, [0] * 16)
+        self.assertEqual(mock_layout.mock_calls, [])
+        
+        games.make_move(game, 0, 0, True)
+        self.assertEqual(games.masked_cells(game), [CardNames.DEATH.number] + [0] * 15)
+        games.make_move(game, 0, 2, True)
+        self.assertEqual(games.masked_cells(game), [CardNames.DEATH.number, 0, CardNames.DEATH.number] + [0] * 13)
+        
+    def test_to_forms(self):
+        """Test that the users of many games are resolved with one batch get"""
+        (game_one, first_user, second_user) = self._get_new_game()
+        game_two = games.new_game(second_user.key, first_user.key)
+        game_two.winner = first_user.key
+        
+        #test users are not fetched when their names are on the games
+        with patch('core.ndb.get_multi', wraps=ndb.get_multi) as get_multi:
+            game_forms = games.to_forms([game_one, game_two], "message")
+            self.assertEqual(get_multi.call_count, 0)
+        self.assertEqual(game_forms.items[1].winner, first_user.name)
+        
+        #test games stored without user names fetch the users in one batch
+        for game in (game_one, game_two):
+            game.first_user_name = game.second_user_name = None
+        with patch('core.ndb.get_multi', wraps=ndb.get_multi) as get_multi:
+            game_forms = games.to_forms([game_one, game_two], "message")
+            self.assertEqual(get_multi.call_count, 1)
+            
+        self.assertEqual(len(game_forms.items), 2)
+        self.assertEqual(game_forms.items[0].next_move, first_user.name)
+        self.assertIsNone(game_forms.items[0].winner)
+        self.assertEqual(game_forms.items[1].next_move, second_user.name)
+        self.assertEqual(game_forms.items[1].winner, first_user.name)
+        self.assertEqual(game_forms.items[1].message, "message")
+        
+        score = scores.new_score(winner=first_user.key, loser=second_user.key, first_user_score=3, second_user_score=2)
+        score.winner_name = score.loser_name = None
+        with patch('core.ndb.get_multi', wraps=ndb.get_multi) as get_multi:
+            score_forms = scores.to_forms([score, score])
+            self.assertEqual(get_multi.call_count, 1)
+        self.assertEqual(score_forms.items[1].winner, first_user.name)
+        self.assertEqual(score_forms.items[1].loser, second_user.name)
+        
+    def test_make_move_async(self):
+        """Test that an asynchronous move updates the game immediately and saves it later"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        
+        future = games.make_move_async(game, 0, 0, True)
+        self.assertTrue(game.board[0][0].flipped)
+        self.assertEqual(future.get_result(), "One more guess to make")
+        
+        ndb.get_context().clear_cache()
+        self.assertTrue(game.key.get().board[0][0].flipped)
+        
+    def test_make_move_game_ended(self): 
         """Test that a game is ended when all pairs are found"""  
         (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
         
@@ -215,8 +556,7 @@ class GameTest(MemoryGameUnitTest):
         self.assertEqual(game.winner, first_user.key)
         self.assertEqual(game.loser, second_user.key)
         
-    @patch('games.taskqueue')        
-    def test_draw(self, mock_taskqueue): 
+    def test_draw(self): 
         """Test that a draw results in no winner being assigned"""  
         (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
         
@@ -259,8 +599,7 @@ class GameTest(MemoryGameUnitTest):
         self.assertIsNone(game.winner)
         self.assertIsNone(game.loser)
         
-    @patch('games.taskqueue')
-    def test_make_move_match_made(self, mock_taskqueue):    
+    def test_make_move_match_made(self):    
         """Test that a move can be played where the cards match"""  
         
         (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
@@ -279,7 +618,8 @@ class GameTest(MemoryGameUnitTest):
         self.assertTrue(game.board[0][2].flipped)
         
         #test the game history
-        turn = game.history.pop()
+        self.assertEqual(game.turns, 1)
+        turn = games.get_history(game).pop()
         self.assertEqual(turn.user, first_user.name) 
         self.assertEqual(turn.match_made, True)
         self.assertEqual(turn.first_guess, "DEATH:0:0")  
@@ -301,8 +641,7 @@ class GameTest(MemoryGameUnitTest):
         self.assertEqual(game.first_user_score, 1)
         self.assertEqual(game.second_user_score, 0)
         
-    @patch('games.taskqueue')
-    def test_make_move_match_not_made(self, mock_taskqueue):    
+    def test_make_move_match_not_made(self):    
         """Test that a move can be played where the cards don't match""" 
         (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
         unmatched_pairs_temp = game.unmatched_pairs
@@ -320,7 +659,8 @@ class GameTest(MemoryGameUnitTest):
         self.assertTrue(game.board[0][1].flipped)
         
         #test the game history
-        turn = game.history.pop()
+        self.assertEqual(game.turns, 1)
+        turn = games.get_history(game).pop()
         self.assertEqual(turn.user, first_user.name) 
         self.assertEqual(turn.match_made, False)
         self.assertEqual(turn.first_guess, "DEATH:0:0")  
@@ -338,6 +678,130 @@ class GameTest(MemoryGameUnitTest):
         self.assertFalse(game.board[0][0].flipped)
         self.assertFalse(game.board[0][1].flipped)
         
+    def test_make_turn(self):
+        """Test that both guesses of a turn can be validated and made at once"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        
+        #test the guesses must be different cards on the board
+        self.assertFalse(games.is_valid_turn(game, (0, 0), (0, 0), raise_error=False))
+        self.assertFalse(games.is_valid_turn(game, (0, 0), (4, 0), raise_error=False))
+        
+        #flip DEATH and FOOL, test the turn is saved once and passes to the other user
+        rpcs = self.count_rpcs()
+        message = games.make_turn(game, (0, 0), (0, 1), True)
+        self.assertEqual(message, "Not a match")
+        self.assertEqual(rpcs['Put'], 1)
+        self.assertEqual(game.next_move, second_user.key)
+        self.assertEqual(str(games.get_history(game)), "[good golly:DEATH:0:0:FOOL:0:1:False]")
+        
+        #the missed cards are turned back, so they may be guessed again
+        self.assertTrue(games.is_valid_turn(game, (0, 0), (0, 2)))
+        message = games.make_turn(game, (0, 0), (0, 2), False)
+        self.assertEqual(message, "You made a match")
+        self.assertEqual(game.second_user_score, 1)
+        self.assertFalse(game.board[0][1].flipped)
+        
+        #test a matched card can't be guessed, nor a turn begun with a single move
+        self.assertFalse(games.is_valid_turn(game, (0, 2), (1, 1), raise_error=False))
+        games.make_move(game, 1, 1, False)
+        self.assertRaises(endpoints.BadRequestException, games.is_valid_turn, game, (1, 0), (1, 2))
+        
+    def test_make_turn_reflips_missed_card(self):
+        """Test that a card from the last missed turn can be guessed again and stays
+        face up when the new turn misses too, so it can't be matched with itself"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        games.make_turn(game, (0, 0), (0, 1), True) #DEATH, FOOL
+        
+        #flip FOOL again and HIGH_PRIESTESS, test both are face up after the miss
+        message = games.make_turn(game, (0, 1), (0, 3), False)
+        self.assertEqual(message, "Not a match")
+        self.assertEqual(sorted(game.flipped), [game.cell(0, 1), game.cell(0, 3)])
+        self.assertTrue(game.board[0][1].flipped)
+        self.assertFalse(game.board[0][0].flipped)
+        
+        #test the card can't be flipped twice in the next turn
+        games.make_move(game, 0, 1, True)
+        self.assertFalse(games.is_valid_move(game, 0, 1, raise_error=False))
+        self.assertEqual(game.matched, [])
+        self.assertEqual(game.unmatched_pairs, 8)
+        
+    def test_turn_notifications_coalesced(self):
+        """Test that a user passed the turn by several moves of a game is notified only once"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        games.make_move(game, 0, 0, True)
+        self.assertEqual(self.taskqueue_stub.get_filtered_tasks(), [])
+        
+        #pass the turn to the second user twice
+        games.make_move(game, 0, 1, True)
+        games.make_move(game, 0, 3, False)
+        games.make_move(game, 1, 3, False)
+        games.make_move(game, 0, 3, True)
+        games.make_move(game, 1, 3, True)
+        self.assertEqual(game.next_move, second_user.key)
+        
+        tasks = self.taskqueue_stub.get_filtered_tasks(queue_names=games.NOTIFY_QUEUE)
+        self.assertEqual(len(tasks), 2)
+        self.assertEqual(sorted(task.extract_params()['user_key'] for task in tasks),
+                         sorted([first_user.key.urlsafe(), second_user.key.urlsafe()]))
+        
+        #a lost marker is caught by the task name
+        memcache.flush_all()
+        self.assertFalse(games.notify_turn_async(game).get_result())
+        self.assertEqual(len(self.taskqueue_stub.get_filtered_tasks(queue_names=games.NOTIFY_QUEUE)), 2)
+        
+    def test_send_turn_digests(self):
+        """Test that the queued notifications are leased in bulk and each user is sent
+        one digest of the games where it is their turn"""
+        (game, first_user, second_user) = self._get_new_game_with_mock_gridboard()
+        other_game = games.new_game(first_user.key, second_user.key)
+        for each in (game, other_game):
+            each.next_move = second_user.key
+            each.put()
+            games.notify_turn_async(each).get_result()
+        finished_game = games.new_game(first_user.key, second_user.key)
+        games.notify_turn_async(finished_game).get_result()
+        finished_game.game_over = True
+        finished_game.put()
+        
+        #each user is notified once in a window, however many games wait on them
+        rpcs = self.count_rpcs()
+        self.assertEqual(games.send_turn_digests(), [2])
+        self.assertEqual(rpcs['Get'], 1)
+        
+        #the finished game is left out, so only the second user has a digest
+        messages = self.mail_stub.get_sent_messages()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].to, second_user.email)
+        body = messages[0].body.decode()
+        self.assertIn('your turn in 2 games', body)
+        self.assertIn(game.key.urlsafe(), body)
+        self.assertIn(other_game.key.urlsafe(), body)
+        
+        #the tasks are deleted once the digests are sent
+        self.assertEqual(self.taskqueue_stub.get_filtered_tasks(queue_names=games.NOTIFY_QUEUE), [])
+        self.assertEqual(games.send_turn_digests(), [])
+        
+    def test_send_turn_digest_split_lease(self):
+        """Test that a user with more tasks than fit in a lease is sent a single digest"""
+        first_user, second_user = self._get_two_players()
+        waiting = [games.build_game(first_user.key, second_user.key, first_user.name, second_user.name,
+                                    next_move=second_user.key) for _ in range(games.NOTIFY_LEASE_SIZE + 1)]
+        ndb.put_multi(waiting)
+        
+        #tasks left from earlier windows, one per game
+        queue = taskqueue.Queue(games.NOTIFY_QUEUE)
+        tasks = [taskqueue.Task(method='PULL', tag=second_user.key.urlsafe(),
+                                params={'user_key': second_user.key.urlsafe(), 'game_key': game.key.urlsafe()})
+                 for game in waiting]
+        for index in range(0, len(tasks), games.NOTIFY_LEASE_SIZE):
+            queue.add(tasks[index:index + games.NOTIFY_LEASE_SIZE])
+        
+        self.assertEqual(games.send_turn_digests(), [games.NOTIFY_LEASE_SIZE + 1])
+        messages = self.mail_stub.get_sent_messages()
+        self.assertEqual(len(messages), 1)
+        self.assertIn('your turn in {0} games'.format(games.NOTIFY_LEASE_SIZE + 1), messages[0].body.decode())
+        self.assertEqual(self.taskqueue_stub.get_filtered_tasks(queue_names=games.NOTIFY_QUEUE), [])
+        
     def test_create_score_service(self):    
         
         player_one, player_two = self._get_two_players()
@@ -350,23 +814,63 @@ class GameTest(MemoryGameUnitTest):
         self.assertEquals(score.loser, player_two.key)
         self.assertEquals(score.loser_score, 2)
         
+    def test_user_names_denormalized(self):
+        """Test that user names are copied onto new games and scores, and backfilled on migration"""
+        (game, first_user, second_user) = self._get_new_game()
+        self.assertEqual(game.first_user_name, first_user.name)
+        self.assertEqual(game.second_user_name, second_user.name)
+        self.assertEqual(game.user_name(second_user.key), second_user.name)
+        
+        score = scores.new_score(winner=second_user.key, loser=first_user.key, first_user_score=2, second_user_score=3)
+        self.assertEqual(score.winner_name, second_user.name)
+        self.assertEqual(score.loser_name, first_user.name)
+        
+        #test games and scores stored without user names are backfilled
+        game.first_user_name = game.second_user_name = None
+        game.put()
+        score.winner_name = score.loser_name = None
+        score.put()
+        self.assertIsNone(games.migrate_games())
+        self.assertIsNone(scores.migrate_scores())
+        self.assertEqual(game.key.get().first_user_name, first_user.name)
+        self.assertEqual(score.key.get().loser_name, first_user.name)
+        
     def test_get_user_scores(self):    
         
         player_one, player_two = self._get_two_players()
         scores.new_score(winner=player_one.key, loser=player_two.key, first_user_score=3, second_user_score=2)
         
-        user_scores = scores.get_user_scores(user=player_one)
+        user_scores, next_cursor = scores.get_user_scores(user=player_one)
+        self.assertIsNone(next_cursor)
         self.assertEqual(len(user_scores), 1)
         self.assertEquals(user_scores[0].winner, player_one.key)
         self.assertEquals(user_scores[0].winner_score, 3)
         self.assertEquals(user_scores[0].loser, player_two.key)
         self.assertEquals(user_scores[0].loser_score, 2)
         
-        user_scores = scores.get_user_scores(user=player_two)
+        user_scores, next_cursor = scores.get_user_scores(user=player_two, page_size=1)
         self.assertEqual(len(user_scores), 1)
         self.assertEquals(user_scores[0].winner, player_one.key)
         self.assertEquals(user_scores[0].winner_score, 3)
         self.assertEquals(user_scores[0].loser, player_two.key)
         self.assertEquals(user_scores[0].loser_score, 2)
         
+    def test_get_user_scores_newest_first(self):
+        """Test that a user's scores are paged newest first, including scores 
+        stored before the creation time was recorded once they are migrated"""
+        player_one, player_two = self._get_two_players()
+        legacy = Score(date=date(2016, 3, 30), winner=player_one.key, loser=player_two.key,
+                       winner_score=3, loser_score=2)
+        with patch.object(Score, '_pre_put_hook'):
+            legacy.put()
+        first = scores.new_score(winner=player_one.key, loser=player_two.key, first_user_score=3, second_user_score=2)
+        second = scores.new_score(winner=player_two.key, loser=player_one.key, first_user_score=1, second_user_score=5)
+        self.assertIsNone(scores.migrate_scores())
+        
+        user_scores, next_cursor = scores.get_user_scores(player_one, page_size=2)
+        self.assertEqual([score.key for score in user_scores], [second.key, first.key])
+        user_scores, next_cursor = scores.get_user_scores(player_one, 2, next_cursor)
+        self.assertEqual([score.key for score in user_scores], [legacy.key])
+        self.assertEqual(user_scores[0].created, datetime(2016, 3, 30))
+        
         
\ No newline at end of file
@@ -0,0 +1,84 @@
+'''
+Created on 18/10/2026
+
+Testing module for the instrumentation of services and api endpoints, run against
+the testbed stubs.
+
+@author: thurstonemerson
+'''
+import json
+
+import webtest
+import endpoints
+from mock import patch
+from google.appengine.ext import ndb
+
+import admin
+import instrumentation
+from instrumentation import stats, Histogram
+from api.users import UserApi
+from services import users
+from users.models import User
+from tests import MemoryGameUnitTest
+
+
+class InstrumentationTest(MemoryGameUnitTest):
+
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        stats.reset()
+
+    def test_histogram(self):
+        """Test that values are counted into buckets and percentiles are estimated from them"""
+        histogram = Histogram((1, 10, 100))
+        for value in (0.5, 5, 5, 50, 500):
+            histogram.add(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.percentile(0.5), 10)
+        self.assertEqual(histogram.percentile(0.8), 100)
+        self.assertIsNone(histogram.percentile(0.99))
+        self.assertEqual(histogram.to_dict()['mean'], 112.1)
+
+    def test_service_calls(self):
+        """Test that the latency and RPCs of service calls are recorded"""
+        User(name=u'good golly').put()
+        ndb.get_context().clear_cache()
+        users.get_by_name(u'good golly')
+        users.find(User.wins == 0)
+
+        recorded = stats.to_dict()
+        self.assertEqual(recorded['latency_ms']['UsersService.get_by_name']['count'], 1)
+        self.assertEqual(recorded['latency_ms']['UsersService.find']['count'], 1)
+        self.assertEqual(recorded['rpcs']['datastore_v3.RunQuery'], 1)
+        self.assertEqual(recorded['rpcs']['datastore_v3.Get'], 1)
+
+    @patch.object(instrumentation, 'SIZE_SAMPLE_RATE', 1)
+    def test_entity_sizes(self):
+        """Test that the pickled size of saved entities is recorded"""
+        users.save(User(name=u'good golly'))
+        sizes = stats.to_dict()['entity_bytes']['User']
+        self.assertEqual(sizes['count'], 1)
+        self.assertGreater(sizes['mean'], 0)
+
+    @patch('instrumentation.logging')
+    def test_endpoint_log_line(self, mock_logging):
+        """Test that each endpoint call writes one structured log line and is
+        reported by the admin stats handler"""
+        testapp = webtest.TestApp(endpoints.api_server([UserApi], restricted=False))
+        testapp.post_json('/_ah/spi/UserApi.create_user', {"name":"good golly"})
+
+        line = mock_logging.info.call_args[0][0]
+        self.assertTrue(line.startswith('stats '))
+        logged = json.loads(line[len('stats '):])
+        self.assertEqual(logged['endpoint'], 'UserApi.create_user')
+        self.assertEqual(logged['status'], 'ok')
+        self.assertGreater(logged['rpcs']['datastore_v3.Commit'], 0)
+
+        self.assertRaises(Exception, testapp.post_json, '/_ah/spi/UserApi.create_user', {"name":"good golly"})
+        logged = json.loads(mock_logging.info.call_args[0][0][len('stats '):])
+        self.assertEqual(logged['status'], 'ConflictException')
+
+        resp = webtest.TestApp(admin.app).get('/admin/stats')
+        self.assertEqual(resp.json['latency_ms']['UserApi.create_user']['count'], 2)
+        webtest.TestApp(admin.app).delete('/admin/stats')
+        self.assertEqual(stats.to_dict()['rpcs'], {})
@@ -0,0 +1,153 @@
+'''
+Created on 18/10/2026
+
+Testing module for running unit tests on public methods from the tournament service.
+
+@author: thurstonemerson
+'''
+from tests import MemoryGameUnitTest
+
+from services import games, tournaments
+from users.models import User
+from tournaments import round_robin_pairings, elimination_pairings
+from tournaments.models import Tournament, TournamentFormat
+from google.appengine.ext import ndb
+
+import endpoints
+
+
+class TournamentTest(MemoryGameUnitTest):
+    
+    def _get_players(self, count):
+        """Create the users of a tournament, returning their keys in seeded order"""
+        return ndb.put_multi([User(name=u'player {0:04d}'.format(number)) for number in range(count)])
+    
+    def _finish(self, game, winner=None):
+        """End a tournament game, won by the winner or drawn"""
+        game.game_over = True
+        game.winner = winner
+        game.put()
+    
+    def test_round_robin_pairings(self):
+        """Test that every player meets every other player once"""
+        for count in (4, 5):
+            players = range(count)
+            rounds = [round_robin_pairings(players, number) for number in range(1, count + (count % 2))]
+            met = sorted(tuple(sorted(pairing)) for pairings in rounds for pairing in pairings)
+            self.assertEqual(met, [(first, second) for first in players for second in players if first < second])
+            for pairings in rounds:
+                playing = [player for pairing in pairings for player in pairing]
+                self.assertEqual(len(playing), len(set(playing)))
+    
+    def test_elimination_pairings(self):
+        """Test that the top seeds have a bye when the entrants don't fill the bracket"""
+        self.assertEqual(elimination_pairings(range(4)), [(0, 3), (1, 2)])
+        self.assertEqual(elimination_pairings(range(5)), [(3, 4)])
+        self.assertEqual(elimination_pairings(range(6)), [(2, 5), (3, 4)])
+    
+    def test_new_tournament(self):
+        """Test that a large round is created with a handful of RPCs"""
+        players = self._get_players(512)
+        rpcs = self.count_rpcs()
+        tournament = tournaments.new_tournament(u'big one', players, TournamentFormat.SINGLE_ELIMINATION, 
+                                                rows=2, columns=2)
+        self.assertLessEqual(sum(rpcs.values()), 3)
+        self.assertEqual(rpcs['Get'], 1)
+        
+        self.assertEqual(tournament.round, 1)
+        self.assertEqual(len(tournament.games), 256)
+        round_games = ndb.get_multi(tournament.games)
+        self.assertEqual((round_games[0].first_user, round_games[0].second_user), (players[0], players[511]))
+        self.assertEqual(round_games[0].first_user_name, u'player 0000')
+        self.assertEqual(round_games[0].tournament, tournament.key)
+        self.assertEqual(round_games[0].rows * round_games[0].columns, 4)
+    
+    def test_new_tournament_invalid(self):
+        """Test that a tournament needs two different, existing players"""
+        players = self._get_players(2)
+        self.assertRaises(endpoints.BadRequestException, tournaments.new_tournament, u'solo', players[:1])
+        self.assertRaises(endpoints.BadRequestException, tournaments.new_tournament, u'twins', [players[0]] * 2)
+        self.assertRaises(endpoints.NotFoundException, tournaments.new_tournament, u'ghost', 
+                          players + [User.key_for_name(u'nobody')])
+        self.assertEqual(Tournament.query().count(), 0)
+    
+    def test_single_elimination(self):
+        """Test that the winners of each round, and the byes, meet in the next round"""
+        players = self._get_players(3)
+        tournament = tournaments.new_tournament(u'three', players, TournamentFormat.SINGLE_ELIMINATION)
+        game, = ndb.get_multi(tournament.games)
+        self.assertEqual((game.first_user, game.second_user), (players[1], players[2]))
+        self.assertFalse(tournaments.advance(tournament.key))
+        
+        #the lower seed wins, and meets the top seed who had a bye
+        self._finish(game, players[2])
+        self.assertTrue(tournaments.advance(tournament.key))
+        self.assertFalse(tournaments.advance(tournament.key))
+        tournament = tournament.key.get()
+        self.assertEqual(tournament.round, 2)
+        final, = ndb.get_multi(tournament.games)
+        self.assertEqual((final.first_user, final.second_user), (players[0], players[2]))
+        
+        #a drawn game is won by the higher seed
+        self._finish(final)
+        self.assertTrue(tournaments.advance(tournament.key))
+        tournament = tournament.key.get()
+        self.assertTrue(tournament.finished)
+        self.assertEqual(tournament.winner, players[0])
+        self.assertEqual(tournaments.to_form(tournament).winner, u'player 0000')
+    
+    def test_advance_keeps_games(self):
+        """Test that a repeated advance leaves the next round's games as they are, and
+        that games missing from the current round are saved again"""
+        players = self._get_players(4)
+        tournament = tournaments.new_tournament(u'four', players)
+        for game in ndb.get_multi(tournament.games):
+            self._finish(game)
+        stale = tournament.key.get()
+        self.assertTrue(tournaments.advance(tournament.key))
+
+        #a game of the next round is played, then the round is advanced by another task
+        game = tournament.key.get().games[0].get()
+        games.make_move(game, 0, 0, True)
+        seed = game.seed
+        self.assertFalse(tournaments._commit_round(stale, stale.round))
+        self.assertFalse(tournaments.advance(tournament.key))
+        game = game.key.get()
+        self.assertEqual((game.seed, game.flipped), (seed, [0]))
+
+        #a game lost after the round was committed is rebuilt, the others are kept
+        game.key.delete()
+        self.assertFalse(tournaments.advance(tournament.key))
+        round_games = ndb.get_multi(tournament.key.get().games)
+        self.assertNotIn(None, round_games)
+        self.assertEqual(round_games[0].flipped, [])
+
+    def test_round_robin(self):
+        """Test that points are awarded each round and the leader wins"""
+        players = self._get_players(3)
+        tournament = tournaments.new_tournament(u'three', players)
+        for round_number in range(1, 4):
+            tournament = tournament.key.get()
+            self.assertEqual(tournament.round, round_number)
+            game, = ndb.get_multi(tournament.games)
+            self._finish(game, players[2] if players[2] in game.players else None)
+            self.assertTrue(tournaments.advance(tournament.key))
+        
+        tournament = tournament.key.get()
+        self.assertTrue(tournament.finished)
+        self.assertEqual(tournament.points, [1, 1, 4])
+        self.assertEqual(tournament.winner, players[2])
+    
+    def test_game_over_advances_tournament(self):
+        """Test that the end of a tournament game queues a task to advance the tournament"""
+        players = self._get_players(2)
+        tournament = tournaments.new_tournament(u'quick', players, rows=1, columns=2, card_set_size=1)
+        game = tournament.games[0].get()
+        games.make_move(game, 0, 0, True)
+        self.assertEqual(self.taskqueue_stub.get_filtered_tasks(url=games.TOURNAMENT_URL), [])
+        games.make_move(game, 0, 1, True)
+        
+        task, = self.taskqueue_stub.get_filtered_tasks(url=games.TOURNAMENT_URL)
+        self.assertEqual(task.extract_params()['tournament_key'], tournament.key.urlsafe())
+        self.assertTrue(tournaments.advance(tournament.key))
+        self.assertEqual(tournament.key.get().winner, players[0])
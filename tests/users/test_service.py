@@ -8,10 +8,12 @@ Uses a sqllite database so that the google app engine doesn't need to be running
 '''
 from tests import MemoryGameUnitTest
 
-from services import users
+from services import users, games, scores
+from users import RANKINGS_SIZE, RANKINGS_CACHE_KEY
 from users.models import User
 
-from google.appengine.api import datastore_errors
+from google.appengine.api import datastore_errors, memcache
+from google.appengine.ext import ndb
  
 
 class UserTest(MemoryGameUnitTest):
@@ -30,6 +32,10 @@ class UserTest(MemoryGameUnitTest):
         
         #ensure that an error is raised when essential attributes are missed
         self.assertRaises(datastore_errors.BadValueError, users.create, None)    
+        
+        #test the user is keyed by its normalized name, and names must be unique
+        self.assertEquals(user.key.id(), name)
+        self.assertIsNone(users.create(Request(" MyTest", email)))
 
     def test_get_by_name(self):
         """Test that you are able to retrieve a user by name"""
@@ -40,6 +46,30 @@ class UserTest(MemoryGameUnitTest):
         self.assertEquals(user.key, new_user.key)
         self.assertEquals(None, users.get_by_name(""))
         
+        #test users are looked up by their normalized name
+        self.assertEquals(user.key, User.key_for_name(u'Good Golly '))
+        self.assertEquals(user.key, users.get_by_name(u'Good Golly ').key)
+        
+    def test_rekey_users(self):
+        """Test that users keyed by id are re-keyed by name along with their games and scores"""
+        legacy = User(id=42, name=u'Legacy User', email=u'generic@thingy.com', wins=1, total_played=1)
+        legacy.put()
+        other = User(name=u'other user')
+        other.put()
+        game = games.new_game(legacy.key, other.key)
+        score = scores.new_score(winner=legacy.key, loser=other.key, first_user_score=3, second_user_score=2)
+        
+        self.assertIsNone(users.rekey_users(references=(games, scores)))
+        
+        new_key = User.key_for_name(legacy.name)
+        self.assertIsNone(legacy.key.get())
+        self.assertEquals(new_key.get().wins, 1)
+        self.assertEquals(game.key.get().first_user, new_key)
+        self.assertEquals(game.key.get().next_move, new_key)
+        self.assertEquals(game.key.get().second_user, other.key)
+        self.assertEquals(score.key.get().winner, new_key)
+        self.assertEquals(score.key.get().loser, other.key)
+        
     def test_get_user_rankings(self):
         """Test that you are able to retrieve a list of all users ranked by win percentage"""
         user = User(name=u'no win', email=u'generic@thingy.com')
@@ -56,6 +86,39 @@ class UserTest(MemoryGameUnitTest):
         self.assertEquals(user_rankings.pop().key, usertwo.key)
         self.assertEquals(user_rankings.pop().key, userone.key)
         
+    def test_rankings_cache(self):
+        """Test that the cached rankings are paged and kept in order as results are recorded"""
+        first = User(name=u'first', total_played=2, wins=2)
+        second = User(name=u'second', total_played=2, wins=1)
+        third = User(name=u'third', total_played=2, wins=0)
+        ndb.put_multi([first, second, third])
+        
+        self.assertEquals([user.key for user in users.get_user_rankings()], 
+                          [first.key, second.key, third.key])
+        self.assertEquals([user.key for user in users.get_user_rankings(limit=1, offset=1)], [second.key])
+        
+        #the cached rankings are updated without querying the datastore again
+        rpcs = self.count_rpcs()
+        for _ in range(4):
+            users.add_win(third)
+        users.add_loss(first)
+        users.add_loss(first)
+        users.add_loss(first)
+        user_rankings = users.get_user_rankings()
+        self.assertEquals(rpcs['RunQuery'], 0)
+        self.assertEquals([user.key for user in user_rankings], [third.key, second.key, first.key])
+        self.assertEquals(user_rankings[0].wins, 4)
+        
+        #users outside the cached rankings are read with a query
+        self.assertEquals([user.key for user in users.get_user_rankings(limit=RANKINGS_SIZE, offset=2)], [first.key])
+        
+        #rankings left short by a user dropping out of the top ranks are rebuilt once
+        memcache.set(RANKINGS_CACHE_KEY, {'users': [third], 'complete': False})
+        users.get_user_rankings()
+        rpcs = self.count_rpcs()
+        self.assertEquals(len(users.get_user_rankings()), 3)
+        self.assertEquals(rpcs['RunQuery'], 0)
+        
         
 class Request():
     """Mocking the google app engine request class"""
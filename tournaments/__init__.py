@@ -0,0 +1,216 @@
+'''
+Tournament service module, where the scheduling of the rounds of a tournament is
+contained. Each round's games are created in one batch, and the next round is
+scheduled once every game of the current round is over.
+
+Created on 18/10/2026
+
+@author: thurstonemerson
+'''
+from models import Tournament, TournamentFormat
+from forms import TournamentForm
+from core import Service
+from google.appengine.ext import ndb
+import endpoints
+import logging
+
+#The fewest and most players in a tournament
+MIN_PLAYERS = 2
+MAX_PLAYERS = 1024
+#The round robin points for a win and for a draw
+WIN_POINTS = 2
+DRAW_POINTS = 1
+
+class TournamentService(Service):
+    """Service class interacting with the Tournament datastore"""
+    __model__ = Tournament
+    __cache__ = False
+
+    def __init__(self, games):
+        super(TournamentService, self).__init__()
+        #: The games service creating the tournament's games
+        self.games = games
+
+    #-----------------------------------------------------------------------
+    #Creation of a new tournament
+    #-----------------------------------------------------------------------
+
+    def new_tournament(self, name, players, format=TournamentFormat.ROUND_ROBIN, **board):
+        """Creates a tournament between the users, given by key in seeded order, and
+        schedules its first round. The users are fetched with one batch get, and the
+        tournament is saved in one batch with the first round's games. The rows,
+        columns and card set size of the games' boards may be given as keywords"""
+        if not MIN_PLAYERS <= len(players) <= MAX_PLAYERS:
+            raise endpoints.BadRequestException(
+                    'A tournament must have between {0} and {1} players'.format(MIN_PLAYERS, MAX_PLAYERS))
+        if len(set(players)) < len(players):
+            raise endpoints.BadRequestException('A player can only enter a tournament once')
+
+        users = ndb.get_multi(players)
+        missing = [key.id() for key, user in zip(players, users) if user is None]
+        if missing:
+            raise endpoints.NotFoundException('Users not found: {0}'.format(', '.join(missing)))
+
+        tournament = super(TournamentService, self).new()
+        data = {"key": ndb.Key(Tournament, Tournament.allocate_ids(1)[0]), "name": name,
+                "format": format.name, "players": players, "player_names": [user.name for user in users],
+                "rows": board.get('rows'), "columns": board.get('columns'),
+                "card_set_size": board.get('card_set_size')}
+        for key, value in data.items():
+            setattr(tournament, key, value)
+        if format == TournamentFormat.ROUND_ROBIN:
+            tournament.points = [0] * len(players)
+        else:
+            tournament.entrants = list(players)
+
+        round_games = self._schedule_round(tournament)
+        return super(TournamentService, self).save(tournament, *round_games)
+
+    #-----------------------------------------------------------------------
+    #Advancing a tournament as its games finish
+    #-----------------------------------------------------------------------
+
+    def advance(self, tournament_key):
+        """Schedules the tournament's next round once every game of the current round
+        is over, or finishes the tournament after its last round. The round's games
+        are read with one batch get and the next round's are saved in one batch, once
+        the tournament has advanced. Returns true if the tournament advanced"""
+        tournament = tournament_key.get()
+        if not tournament or tournament.finished:
+            return False
+        round_games = ndb.get_multi(tournament.games)
+        if None in round_games:
+            self._insert_missing_games(tournament, round_games)
+            return False
+        if not all(game.game_over for game in round_games):
+            return False
+
+        current_round = tournament.round
+        self._record_results(tournament, round_games)
+        if self._is_last_round(tournament):
+            tournament.finished = True
+            tournament.winner = self._leader(tournament)
+            next_games = []
+        else:
+            next_games = self._schedule_round(tournament)
+
+        #only the task that advances the tournament saves the next round's games, so games
+        #already being played are never rewritten by another task advancing the same round
+        if not self._commit_round(tournament, current_round):
+            return False
+        ndb.put_multi(next_games)
+        logging.info("Tournament {0} advanced to round {1} with {2} games".format(
+                tournament.key.id(), tournament.round, len(next_games)))
+        return True
+
+    @ndb.transactional
+    def _commit_round(self, tournament, current_round):
+        """Saves the advanced tournament, unless it has advanced past the round already"""
+        stored = tournament.key.get()
+        if stored.finished or stored.round != current_round:
+            return False
+        tournament.put()
+        return True
+
+    def _insert_missing_games(self, tournament, round_games):
+        """Saves the games of the current round that are missing because the task
+        advancing the tournament failed after it advanced. Each game is inserted in
+        a transaction, so a game saved meanwhile by another task is left as it is"""
+        for game, rebuilt in zip(round_games, self._build_round(tournament)):
+            if game is None:
+                ndb.transaction(lambda: rebuilt.key.get() or rebuilt.put())
+        logging.warning("Saved the missing games of round {0} of tournament {1}".format(
+                tournament.round, tournament.key.id()))
+
+    def _record_results(self, tournament, round_games):
+        """Award round robin points for the round's games, or leave the winners of an
+        elimination round as the entrants to the next. A drawn elimination game is won
+        by the higher seed"""
+        if tournament.format == TournamentFormat.ROUND_ROBIN.name:
+            for game in round_games:
+                for user_key in ([game.winner] if game.winner else [game.first_user, game.second_user]):
+                    tournament.points[tournament.seed(user_key)] += WIN_POINTS if game.winner else DRAW_POINTS
+        else:
+            playing = set(user_key for game in round_games for user_key in (game.first_user, game.second_user))
+            byes = [user_key for user_key in tournament.entrants if user_key not in playing]
+            winners = [game.winner or min(game.first_user, game.second_user, key=tournament.seed)
+                       for game in round_games]
+            tournament.entrants = byes + winners
+
+    def _is_last_round(self, tournament):
+        """Returns true if the tournament's current round is its last"""
+        if tournament.format == TournamentFormat.ROUND_ROBIN.name:
+            return tournament.round >= round_robin_rounds(len(tournament.players))
+        return len(tournament.entrants) == 1
+
+    def _leader(self, tournament):
+        """Returns the key of the user leading the tournament, ties going to the higher seed"""
+        if tournament.format == TournamentFormat.ROUND_ROBIN.name:
+            return tournament.players[max(range(len(tournament.players)),
+                                          key=lambda seed: (tournament.points[seed], -seed))]
+        return tournament.entrants[0]
+
+    def _schedule_round(self, tournament):
+        """Starts the tournament's next round, returning its games unsaved"""
+        tournament.round += 1
+        round_games = self._build_round(tournament)
+        tournament.games = [game.key for game in round_games]
+        return round_games
+
+    def _build_round(self, tournament):
+        """Returns the unsaved games of the tournament's current round. The games are
+        keyed by the tournament, round and their place in the round"""
+        if tournament.format == TournamentFormat.ROUND_ROBIN.name:
+            pairings = round_robin_pairings(tournament.players, tournament.round)
+        else:
+            pairings = elimination_pairings(tournament.entrants)
+
+        board = dict((name, getattr(tournament, name)) for name in ('rows', 'columns', 'card_set_size')
+                     if getattr(tournament, name) is not None)
+        round_games = [self.games.build_game(first_user, second_user,
+                                             tournament.player_name(first_user), tournament.player_name(second_user),
+                                             key=ndb.Key('Game', '{0}-{1}-{2}'.format(tournament.key.id(), tournament.round, index)),
+                                             tournament=tournament.key, round=tournament.round, **board)
+                       for index, (first_user, second_user) in enumerate(pairings)]
+        return round_games
+
+    #-----------------------------------------------------------------------
+    #Initialising a form object to return to the user
+    #-----------------------------------------------------------------------
+
+    def to_form(self, tournament):
+        """Returns a TournamentForm representation of the Tournament"""
+        return TournamentForm(urlsafe_key=tournament.key.urlsafe(), name=tournament.name,
+                              format=TournamentFormat(tournament.format), players=tournament.player_names,
+                              points=tournament.points, round=tournament.round,
+                              games=[key.urlsafe() for key in tournament.games],
+                              finished=tournament.finished, winner=tournament.player_name(tournament.winner))
+
+#-----------------------------------------------------------------------
+#Pairing the players of a round
+#-----------------------------------------------------------------------
+
+def round_robin_rounds(players):
+    """Returns the number of rounds for each of the players to play every other"""
+    return players if players % 2 else players - 1
+
+def round_robin_pairings(players, round):
+    """Returns the pairs of players meeting in a round of a round robin, starting at
+    round 1. The first player is fixed and the others rotate around them, with one
+    player sitting out each round when there is an odd number"""
+    players = list(players) + ([None] if len(players) % 2 else [])
+    rotation = (round - 1) % (len(players) - 1)
+    others = players[1:]
+    lineup = [players[0]] + others[len(others) - rotation:] + others[:len(others) - rotation]
+    pairings = [(lineup[index], lineup[-1 - index]) for index in range(len(lineup) // 2)]
+    return [pairing for pairing in pairings if None not in pairing]
+
+def elimination_pairings(entrants):
+    """Returns the pairs of entrants meeting in a round of a single elimination. When
+    the entrants don't fill the bracket the top seeds have a bye, and the others are
+    paired highest seed against lowest"""
+    bracket = 1
+    while bracket < len(entrants):
+        bracket *= 2
+    playing = entrants[bracket - len(entrants):]
+    return [(playing[index], playing[-1 - index]) for index in range(len(playing) // 2)]
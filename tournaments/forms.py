@@ -0,0 +1,31 @@
+'''
+Created on 18/10/2026
+
+Forms to be used when interacting with the tournament module of the memory api
+
+@author: thurstonemerson
+'''
+from protorpc import messages
+
+from models import TournamentFormat
+
+class NewTournamentForm(messages.Message):
+    """Used to create a new tournament, the players are named in seeded order"""
+    name = messages.StringField(1, required=True)
+    players = messages.StringField(2, repeated=True)
+    format = messages.EnumField(TournamentFormat, 3, default=TournamentFormat.ROUND_ROBIN)
+    rows = messages.IntegerField(4)
+    columns = messages.IntegerField(5)
+    card_set_size = messages.IntegerField(6)
+
+class TournamentForm(messages.Message):
+    """TournamentForm for outbound tournament information"""
+    urlsafe_key = messages.StringField(1, required=True)
+    name = messages.StringField(2, required=True)
+    format = messages.EnumField(TournamentFormat, 3, required=True)
+    players = messages.StringField(4, repeated=True)
+    points = messages.IntegerField(5, repeated=True)
+    round = messages.IntegerField(6, required=True)
+    games = messages.StringField(7, repeated=True)
+    finished = messages.BooleanField(8, required=True)
+    winner = messages.StringField(9)
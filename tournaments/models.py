@@ -0,0 +1,40 @@
+"""
+The class definitions for the Datastore entities used in the tournament service.
+Created on 18/10/2026
+
+@author: thurstonemerson
+"""
+
+from protorpc import messages
+from google.appengine.ext import ndb
+
+class TournamentFormat(messages.Enum):
+    """The formats a tournament can be played in"""
+    ROUND_ROBIN = 1
+    SINGLE_ELIMINATION = 2
+
+class Tournament(ndb.Model):
+    """A tournament of memory games, played in rounds. Only the current round's
+    games are kept on the tournament, the next round is scheduled once they are over"""
+    name = ndb.StringProperty(required=True)
+    format = ndb.StringProperty(required=True, choices=TournamentFormat.names())
+    players = ndb.KeyProperty(kind='User', repeated=True) # The users in seeded order, the top seed first
+    player_names = ndb.StringProperty(repeated=True, indexed=False) # Names copied from the users, in the same order
+    points = ndb.IntegerProperty(repeated=True, indexed=False) # Round robin points of the players, in the same order
+    entrants = ndb.KeyProperty(kind='User', repeated=True, indexed=False) # The users still in an elimination tournament
+    round = ndb.IntegerProperty(default=0) # The current round, starting at 1
+    games = ndb.KeyProperty(kind='Game', repeated=True, indexed=False) # The games of the current round
+    rows = ndb.IntegerProperty(indexed=False)
+    columns = ndb.IntegerProperty(indexed=False)
+    card_set_size = ndb.IntegerProperty(indexed=False)
+    finished = ndb.BooleanProperty(default=False)
+    winner = ndb.KeyProperty(kind='User')
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+    def seed(self, user_key):
+        """Returns the seed of one of the tournament's users, the top seed being 0"""
+        return self.players.index(user_key)
+
+    def player_name(self, user_key):
+        """Returns the name of one of the tournament's users"""
+        return self.player_names[self.seed(user_key)] if user_key else None
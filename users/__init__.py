@@ -9,27 +9,183 @@ Created on 18/03/2016
 
 from models import User
 from core import Service
+from instrumentation import timed
 from forms import UserForm
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+import bisect
 import logging
 
+#The number of top ranked users kept in memcache, and the memcache key they are kept under
+RANKINGS_SIZE = 100
+RANKINGS_CACHE_KEY = 'rankings'
+#The number of times an update to the cached rankings is retried when it races another update
+RANKINGS_CAS_RETRIES = 3
+
 class UsersService(Service):
     __model__ = User
+    __cache__ = False
+    
+    @timed
+    def get_by_name(self, name):
+        """Returns the user with the specified name, or `None` if the user does not
+        exist. Users are keyed by their normalized name so this is a key lookup"""
+        return self.get_by_name_async(name).get_result()
+    
+    def key_for_name(self, name):
+        """Returns the key of the user with the specified name, without fetching the user"""
+        return User.key_for_name(name)
     
-    def get_user_rankings(self):
-        "Return a list of users ranked by their win percentage"
-        users = super(UsersService, self).find(User.total_played > 0)
-        return sorted(users, key=lambda x: x.win_percentage, reverse=True)
+    @ndb.tasklet
+    def get_by_name_async(self, name):
+        """Tasklet version of get_by_name, returning a future for the user"""
+        user = None
+        if name:
+            user = yield super(UsersService, self).get_by_key_async(User.key_for_name(name))
+        raise ndb.Return(user)
+    
+    def create(self, request):
+        """Creates and returns a new user keyed by its normalized name. Returns `None`
+        if a user with that name already exists"""
+        user = super(UsersService, self).new(request)
+        user.key = User.key_for_name(user.name)
+        
+        @ndb.transactional
+        def insert():
+            if user.key.get():
+                return None
+            return super(UsersService, self).save(user)
+            
+        return insert()
+    
+    def rekey_users(self, urlsafe_cursor=None, batch_size=100, references=()):
+        """Re-key a batch of users stored by earlier versions, which were keyed by 
+        datastore id, so they are keyed by their normalized name. The services in
+        references are asked to rewrite their keys to the re-keyed users before the 
+        old users are deleted. Users already keyed by name are saved again to store
+        their ranking properties. Returns the urlsafe cursor of the next batch, or 
+        None when done"""
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        batch, next_cursor, more = User.query().fetch_page(batch_size, start_cursor=cursor)
+        
+        legacy = [user for user in batch if user.key != User.key_for_name(user.name)]
+        existing = ndb.get_multi([User.key_for_name(user.name) for user in legacy])
+        
+        rekeyed = {}
+        new_users = []
+        for user, taken in zip(legacy, existing):
+            key = User.key_for_name(user.name)
+            if taken or key in rekeyed.values():
+                logging.warning("Unable to re-key user {0}, the name {1} is taken".format(user.key, user.name))
+                continue
+            rekeyed[user.key] = key
+            new_users.append(User(key=key, **user.to_dict(exclude=['win_percentage', 'ranked'])))
+            
+        ndb.put_multi(new_users + [user for user in batch if user.key == User.key_for_name(user.name)])
+        for service in references:
+            service.rekey_users(rekeyed)
+        ndb.delete_multi(rekeyed.keys())
+        memcache.delete(RANKINGS_CACHE_KEY)
+        
+        logging.info("Re-keyed {0} users".format(len(rekeyed)))
+        return next_cursor.urlsafe() if more and next_cursor else None
+    
+    #-----------------------------------------------------------------------
+    #Ranking users by their win percentage
+    #-----------------------------------------------------------------------
+    
+    def get_user_rankings(self, limit=None, offset=0):
+        """Return a page of the users who have played a game, ranked by their win 
+        percentage. Pages within the top ranked users are served from memcache, 
+        later pages are read with an indexed query. A page holds at most RANKINGS_SIZE 
+        users"""
+        limit = min(limit or RANKINGS_SIZE, RANKINGS_SIZE)
+        if offset + limit > RANKINGS_SIZE:
+            return self._rankings_query().fetch(limit, offset=offset)
+        
+        rankings = memcache.get(RANKINGS_CACHE_KEY)
+        if rankings is None or (not rankings['complete'] and len(rankings['users']) < offset + limit):
+            rankings = self._build_rankings()
+        return rankings['users'][offset:offset + limit]
+    
+    def update_rankings(self, user):
+        """Move a user to their new place in the cached top ranked users. If the 
+        user drops out of the top ranks, the rankings are left one user short until
+        a read needs them and they are rebuilt"""
+        client = memcache.Client()
+        for _ in range(RANKINGS_CAS_RETRIES):
+            rankings = client.gets(RANKINGS_CACHE_KEY)
+            if rankings is None:
+                return
+            
+            ranked = [other for other in rankings['users'] if other.key != user.key]
+            complete = rankings['complete']
+            if user.ranked:
+                position = bisect.bisect([self._rank(other) for other in ranked], self._rank(user))
+                # a user ranked below every cached user may be outranked by uncached users
+                if position < len(ranked) or complete:
+                    ranked.insert(position, user)
+            if len(ranked) > RANKINGS_SIZE:
+                ranked.pop()
+                complete = False
+                
+            if client.cas(RANKINGS_CACHE_KEY, {'users': ranked, 'complete': complete}):
+                return
+            
+        memcache.delete(RANKINGS_CACHE_KEY)
+    
+    def _rankings_query(self):
+        """Returns the query of ranked users, best first with ties in name order"""
+        return User.query(User.ranked == True).order(-User.win_percentage, User.key)
+    
+    def _rank(self, user):
+        """Returns a sort key matching the order of the rankings query"""
+        return (-user.win_percentage, user.key.id())
+    
+    def _build_rankings(self):
+        """Read the top ranked users into memcache, replacing any rankings left short
+        by update_rankings. Complete is true when every ranked user fits in the cached
+        rankings"""
+        users = self._rankings_query().fetch(RANKINGS_SIZE + 1)
+        rankings = {'users': users[:RANKINGS_SIZE], 'complete': len(users) <= RANKINGS_SIZE}
+        memcache.set(RANKINGS_CACHE_KEY, rankings)
+        return rankings
+    
+    #-----------------------------------------------------------------------
+    #Recording the results of games
+    #-----------------------------------------------------------------------
     
     def add_win(self, user):
         """Add a win"""
+        self.add_win_async(user).get_result()
+        
+    def add_win_async(self, user):
+        """Add a win, returning a future for the saved user"""
+        return super(UsersService, self).save_async(self.record_win(user))
+    
+    def record_win(self, user):
+        """Record a win on the user without saving it. The user's ranking is updated
+        once the current transaction commits"""
         user.wins += 1
         user.total_played += 1
-        super(UsersService, self).save(user)
+        ndb.get_context().call_on_commit(lambda: self.update_rankings(user))
+        return user
  
     def add_loss(self, user):
         """Add a loss"""
+        self.add_loss_async(user).get_result()
+        
+    def add_loss_async(self, user):
+        """Add a loss, returning a future for the saved user"""
+        return super(UsersService, self).save_async(self.record_loss(user))
+    
+    def record_loss(self, user):
+        """Record a loss on the user without saving it. The user's ranking is updated
+        once the current transaction commits"""
         user.total_played += 1
-        super(UsersService, self).save(user)
+        ndb.get_context().call_on_commit(lambda: self.update_rankings(user))
+        return user
         
     def to_form(self, user):
         return UserForm(name=user.name,
@@ -6,18 +6,31 @@ Created on 18/03/2016
 """
 
 from google.appengine.ext import ndb
+from google.appengine.api import datastore_errors
 
 class User(ndb.Model):
-    """User profile"""
+    """User profile, keyed by the user's normalized name"""
     name = ndb.StringProperty(required=True)
     email =ndb.StringProperty()
     wins = ndb.IntegerProperty(default=0)
     total_played = ndb.IntegerProperty(default=0)
-    #win_percentage = ndb.ComputedProperty(lambda self: float(self.wins)/float(self.total_played) if self.total_played > 0 else 0)
-     
-    @property
-    def win_percentage(self):
-        if self.total_played > 0:
-            return float(self.wins)/float(self.total_played)
-        else:
-            return 0
+    #Stored so that users can be ranked by an indexed query, only users who have played are ranked
+    win_percentage = ndb.ComputedProperty(lambda self: float(self.wins)/float(self.total_played) if self.total_played > 0 else 0.0)
+    ranked = ndb.ComputedProperty(lambda self: self.total_played > 0)
+    
+    @classmethod
+    def normalize_name(cls, name):
+        """Returns the normalized form of a user name used as the user's key"""
+        return name.strip().lower()
+    
+    @classmethod
+    def key_for_name(cls, name):
+        """Returns the key of the user with the specified name"""
+        if not name:
+            raise datastore_errors.BadValueError('A user name is required')
+        return ndb.Key(cls, cls.normalize_name(name))
+    
+    def _pre_put_hook(self):
+        """Users created without a key are keyed by their normalized name"""
+        if self.name and (self.key is None or self.key.id() is None):
+            self.key = User.key_for_name(self.name)